@@ -0,0 +1,128 @@
+"""
+What a scraper has done so far. Used instead of rewriting the whole *_sculpture_data.json after every sculpture.
+
+Every item is one line of JSON appended to the file (JSON Lines) -> adding one doesn't depend on how many there are.
+Lookups are against a set of the file names. A crawl killed in the middle of writing a line leaves at most one broken
+line at the end, which is dropped the next time the file is opened.
+
+    state = CrawlState("../../../sculpture_data/wga/sculptures/wga_sculpture_data.jsonl")
+    if file_name not in state:
+        state.add({'Author': name, "title": title, 'file': file_name, 'url': url})
+    state.to_csv(...)
+
+A file from before (*_sculpture_data.json) is moved over the first time.
+"""
+import json
+import os
+import pandas as pd
+
+
+class CrawlState:
+    """
+    Append-only store of the items scraped, keyed by 'file' (or some other field)
+    """
+    def __init__(self, path, legacy_file=None, sync=False, key="file"):
+        """
+        :param path: JSON Lines file
+        :param legacy_file: Old {"data": [...]} json. Read in if there's no JSON Lines file yet.
+                            Default -> path w/ .json
+        :param sync: fsync after every item -> also survives the machine going down (slower)
+        :param key: Field that's looked up w/ 'in'
+        """
+        self.path = path
+        self.sync = sync
+        self.key = key
+        self.records = []
+        self.files = set()
+
+        if legacy_file is None:
+            legacy_file = os.path.splitext(path)[0] + ".json"
+
+        if os.path.isfile(path):
+            self._load()
+        elif os.path.isfile(legacy_file):
+            self._convert(legacy_file)
+
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        good_bytes, newline = 0, True
+        with open(self.path, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # Only the last line can be broken (killed mid-write)
+                    print(f"Dropping broken line at the end of '{self.path}'")
+                    break
+
+                good_bytes += len(line)
+                newline = line.endswith(b"\n")
+                self._remember(record)
+
+        with open(self.path, "r+b") as file:
+            file.truncate(good_bytes)
+
+            # Whole object but no newline -> the next one would be glued onto it
+            if not newline:
+                file.seek(good_bytes)
+                file.write(b"\n")
+
+    def _convert(self, legacy_file):
+        with open(legacy_file, "r", encoding="utf-8") as file:
+            records = json.load(file)['data']
+
+        # Written somewhere else & moved over -> never half converted
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+                self._remember(record)
+        os.replace(self.path + ".tmp", self.path)
+
+        print(f"Converted {len(records)} items from '{legacy_file}' -> '{self.path}'")
+
+    def _remember(self, record):
+        self.records.append(record)
+        self.files.add(record[self.key])
+
+    def __contains__(self, file):
+        return file in self.files
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        """
+        Record one item (needs the key - 'file' by default)
+
+        :param record: dict
+
+        :return: None
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+        self._remember(record)
+
+    def to_frame(self):
+        """
+        :return: DataFrame of everything in the order it was added
+        """
+        return pd.DataFrame(self.records)
+
+    def to_csv(self, csv_file, **kwargs):
+        """
+        Same csv as pd.DataFrame(processed_sculptures).to_csv(...) gave
+        """
+        self.to_frame().to_csv(csv_file, **kwargs)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
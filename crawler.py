@@ -0,0 +1,359 @@
+"""
+Concurrent, rate limited fetching for the scrapers.
+
+- Every host gets its own requests.Session -> connections are kept alive & reused instead of a new one per request
+- Every host gets its own token bucket -> requests to a host are at least its crawl delay apart (CRAWL_DELAYS, NGA's
+  robots.txt says 10 seconds) but different hosts (e.g. the site & its image CDN) don't wait on each other
+- The blocking requests run on a pool of threads driven by an asyncio loop on a background thread, so it can be used
+  from the (synchronous) scrapers as well as from coroutines
+
+Drop-in for helpers.get_page/scrape_image:
+
+    from helpers import *
+    from crawler import get_page, scrape_image, wait_for_downloads
+
+get_page blocks like before (but only as long as the rate limit says) & goes through the cache in http_cache.py.
+scrape_image returns straight away and the image is downloaded in the background -> call wait_for_downloads() before
+the end.
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import http_cache
+import image_ingest
+import retry_queue
+
+# Seconds between requests to the same host
+CRAWL_DELAYS = {"www.nga.gov": 10}
+DEFAULT_DELAY = 3
+
+ERROR_LOG = "../url_error_log.txt"
+
+
+class TokenBucket:
+    """
+    Tokens come back at one every 'delay' seconds up to 'burst'. Each request takes one (waiting if there are none).
+    Has to be made on the loop it's used on.
+    """
+    def __init__(self, delay, burst=1):
+        self.delay = delay
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                refill = (now - self.updated) / self.delay if self.delay else self.burst
+                self.tokens = min(self.burst, self.tokens + refill)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) * self.delay)
+
+
+class Crawler:
+    """
+    Fetch engine. The event loop runs on its own (daemon) thread from when it's made.
+    """
+    def __init__(self, delays=None, default_delay=DEFAULT_DELAY, workers=16, timeout=5, error_log=ERROR_LOG,
+                 cache=None, retries=None):
+        """
+        :param delays: dict of host -> crawl delay. Default -> CRAWL_DELAYS
+        :param default_delay: Crawl delay for every other host
+        :param workers: # of threads doing the requests (i.e. max # of requests at once)
+        :param timeout: Seconds before a request is given up on
+        :param error_log: File the urls that fail are written to
+        :param cache: http_cache.HTTPCache the pages go through (None -> no cache)
+        :param retries: retry_queue.RetryQueue the failures go to (None -> they're only logged)
+        """
+        self.delays = CRAWL_DELAYS if delays is None else delays
+        self.default_delay = default_delay
+        self.workers = workers
+        self.timeout = timeout
+        self.error_log = error_log
+        self.cache = cache
+        self.retries = retries
+
+        self.sessions = {}
+        self.buckets = {}
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def _session(self, host):
+        # Only ever called from the loop's thread
+        if host not in self.sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.sessions[host] = session
+            self.buckets[host] = TokenBucket(self.delays.get(host, self.default_delay))
+
+        return self.sessions[host], self.buckets[host]
+
+    def _log_error(self, url):
+        print("Error getting ", url)
+        with open(self.error_log, "a") as file:
+            file.write(url + "\n")
+
+    async def wait_turn(self, url):
+        """
+        Wait until the rate limit of the url's host allows a request. For requests that aren't made here (e.g. by a
+        browser) but should still count towards the host's crawl delay.
+        """
+        _, bucket = self._session(urlparse(url).netloc)
+        await bucket.acquire()
+
+    async def fetch(self, url, headers=None, use_cache=True, stream=False, context=None):
+        """
+        Get a url once the host's rate limit allows it. Pages in the cache that are still fresh don't wait at all.
+
+        :param url: Link to the page
+        :param headers: dict of headers
+        :param use_cache: Go through the cache (if there is one)
+        :param stream: Don't download the body straight away (see image_ingest.ingest). Never cached.
+        :param context: What the retry queue needs to try it again. Default -> it's a page
+
+        :return: response object (None if it couldn't connect. A bad status is still returned -> get_page doesn't)
+        """
+        cache = self.cache if use_cache and not stream else None
+        entry = None
+
+        if cache is not None:
+            entry = await self.loop.run_in_executor(self.executor, cache.lookup, url)
+            if entry is not None and cache.usable(entry):
+                return cache.response(entry)
+            if cache.cache_only:
+                print("Not in the cache ", url)
+                return None
+            headers = dict(headers or {}, **cache.conditional_headers(entry))
+
+        session, _ = self._session(urlparse(url).netloc)
+        await self.wait_turn(url)
+
+        response = None
+        try:
+            response = await self.loop.run_in_executor(self.executor, functools.partial(
+                session.get, url, headers=headers, timeout=self.timeout, stream=stream))
+            response.raise_for_status()
+        except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError,
+                requests.exceptions.ReadTimeout) as e:
+            # If anything goes wrong we log the url
+            self._log_error(url)
+            self.failed(url, e, response, headers, context)
+        else:
+            # Images only worked once they're saved
+            if self.retries is not None and not stream:
+                self.retries.succeeded(url)
+
+        if cache is not None and response is not None:
+            response = await self.loop.run_in_executor(self.executor, cache.update, url, response, entry)
+
+        return response
+
+    def failed(self, url, error, response, headers, context=None):
+        """
+        Give a failure to the retry queue (if there is one)
+        """
+        if self.retries is not None:
+            self.retries.failed(url, error, response.status_code if response is not None else None,
+                                user_agent=(headers or {}).get('User-Agent'), **(context or {"kind": "page"}))
+
+    async def download_image(self, file_name, url, headers, db):
+        """
+        Get an image & save it (see image_ingest.py)
+
+        :param file_name: Name of file
+        :param url: Link to the image
+        :param headers: dict of headers
+        :param db: wikiart, nga, or wga
+
+        :return: Path of the image (None if it failed)
+        """
+        context = {"kind": "image", "file": file_name, "db": db}
+
+        response = await self.fetch(url, headers, stream=True, context=context)
+        if response is None:
+            return None
+        if not response.ok:
+            response.close()
+            return None
+
+        # Reading the body & writing it is blocking -> keep it off the loop
+        try:
+            path = await self.loop.run_in_executor(self.executor, image_ingest.ingest, response, file_name, db)
+        except requests.exceptions.RequestException as e:
+            # Connection dropped in the middle of the body
+            self._log_error(url)
+            self.failed(url, e, None, headers, context)
+            return None
+
+        if path is None:
+            self.failed(url, "bad image", None, headers, context)
+            return None
+
+        if self.retries is not None:
+            self.retries.succeeded(url)
+
+        await self.loop.run_in_executor(image_ingest.thumbnail_pool(), image_ingest.make_thumbnail, path,
+                                        image_ingest.thumbnail_path(file_name, db))
+        return path
+
+    async def fetch_all(self, urls, headers=None):
+        """
+        Get a bunch of urls at once -> Each host's are in order at its own rate, different hosts go in parallel
+
+        :return: List of responses (or None) in the order of the urls
+        """
+        return await asyncio.gather(*[self.fetch(url, headers) for url in urls])
+
+    def run(self, coroutine):
+        """
+        Run a coroutine on the loop from any other thread & wait for it
+
+        :return: What the coroutine returns
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def submit(self, coroutine, tracked=True):
+        """
+        Run a coroutine on the loop in the background
+
+        :param coroutine: Coroutine
+        :param tracked: If wait() waits for it
+
+        :return: concurrent.futures.Future
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        if tracked:
+            with self.pending_lock:
+                self.pending.add(future)
+        future.add_done_callback(self._done)
+
+        return future
+
+    def _done(self, future):
+        with self.pending_lock:
+            self.pending.discard(future)
+
+        # Nobody waits on the result -> don't lose the error
+        if not future.cancelled() and future.exception() is not None:
+            print("Error in background task:", repr(future.exception()))
+
+    def get(self, url, headers=None):
+        """
+        Blocking version of fetch
+        """
+        return self.run(self.fetch(url, headers))
+
+    def wait(self):
+        """
+        Wait for everything sent to submit
+        """
+        while True:
+            with self.pending_lock:
+                pending = list(self.pending)
+            if not pending:
+                return
+            wait(pending)
+
+    def close(self):
+        self.wait()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown()
+        for session in self.sessions.values():
+            session.close()
+
+
+_crawler = None
+_crawler_lock = threading.Lock()
+_downloading = set()
+
+
+def get_crawler():
+    """
+    The crawler shared by get_page/scrape_image. Made the first time it's needed.
+    """
+    global _crawler
+    with _crawler_lock:
+        if _crawler is None:
+            _crawler = Crawler(cache=http_cache.get_cache(), retries=retry_queue.get_queue())
+        return _crawler
+
+
+def get_page(url, fake_user):
+    """
+    Retrieve the contents for this page. Same as helpers.get_page w/o sleeping after every request.
+
+    :param url: Link to the page
+    :param fake_user: Fake user agent object
+
+    :return: response object (None if it failed - couldn't connect or a bad status. It's in the retry queue.)
+    """
+    response = get_crawler().get(url, {'User-Agent': fake_user.random})
+
+    # An error page is no use to the parsers
+    return response if response is not None and response.ok else None
+
+
+async def _download_image(crawler, file_name, url, headers, db):
+    try:
+        await crawler.download_image(file_name, url, headers, db)
+    finally:
+        _downloading.discard(file_name)
+
+
+def scrape_image(file_name, url, fake_user, db):
+    """
+    Scrape the given image in the background if it hasn't been scraped yet (see helpers.scrape_image)
+
+    NOTE: The item can be recorded before its image is saved. The scrapers check the image is there for every item
+    that's recorded & get it again if it isn't -> an image whose download was cut off (crawl killed) isn't lost.
+
+    :return: None
+    """
+    from helpers import if_image_exists
+
+    if if_image_exists(file_name, db) or file_name in _downloading:
+        return
+
+    crawler = get_crawler()
+    _downloading.add(file_name)
+    crawler.submit(_download_image(crawler, file_name, url, {'User-Agent': fake_user.random}, db))
+
+
+def wait_turn(url):
+    """
+    Block until it's ok to request the url from somewhere else (see Crawler.wait_turn)
+    """
+    crawler = get_crawler()
+    crawler.run(crawler.wait_turn(url))
+
+
+def wait_for_downloads():
+    """
+    Wait for every image from scrape_image to be saved. Retries aren't waited for (see retry_queue.py).
+    """
+    if _crawler is not None:
+        _crawler.wait()
+
+        if _crawler.retries is not None and _crawler.retries.pending():
+            print(f"{len(_crawler.retries.pending())} failed fetches -> 'python retry_queue.py --drain' to try them "
+                  f"again")
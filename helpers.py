@@ -2,11 +2,14 @@
 Collections of shared functions relevant to both more than one file in either or both projects (wga & wikiart)
 """
 import requests
+import http_cache
+import image_ingest
+import retry_queue
 import time
 import os
-from PIL import Image
-from io import BytesIO
 from keras.preprocessing.image import ImageDataGenerator
+from keras import layers
+from keras import regularizers
 
 # Model constant - For 12 Classes
 CLASSES = 12
@@ -15,6 +18,25 @@ TRAIN_IMAGES = 2387
 VALIDATION_IMAGES = 802
 TEST_IMAGES = 804
 
+# Process pool for the loaders in models/pipeline.py
+# WORKERS -> # of processes decoding/augmenting batches
+# MAX_QUEUE_SIZE -> # of batches kept ready ahead of the model
+WORKERS = os.cpu_count() or 1
+MAX_QUEUE_SIZE = 2 * WORKERS
+
+# Custom FC on top of Xception's 10x10x2048 output
+# dense_first -> Dense(128) at each of the 100 positions & then pool (what all the original models use)
+# pool_first  -> Pool & then Dense(128) once. ~100x less work for the head & the weights are the same shape, so the
+#                dense_first weights can be loaded to start from.
+HEADS = ["dense_first", "pool_first"]
+HEAD = "dense_first"
+
+# Fine-tuned model everything predicts with (see head_file_name for the other heads)
+WEIGHTS_FILE = "../models/xception_finetune_12_reg_75_block4.h5"
+
+# Fine-tune sweep -> Index of the first trainable layer for each block (see xception_fine_tune.py)
+BLOCKS = {"block14": 126, "block12": 106, "block10": 86, "block8": 66, "block6": 46, "block4": 26}
+
 
 def fit_train_image_generator():
     """
@@ -47,25 +69,94 @@ def fit_test_image_generator():
     return test_datagen
 
 
-def get_page(url, fake_user):
+def head_layers(head=None):
     """
-    Retrieve the contents for this page
+    Layers of the custom FC. Kept as a list so the same ones can be put on top of more than one tensor.
+
+    :param head: dense_first or pool_first. Default -> HEAD
+
+    :return: list of layers
+    """
+    head = head or HEAD
+
+    dense = layers.Dense(128,
+                         activation='relu',
+                         kernel_regularizer=regularizers.l2(0.0075)
+                         )
+    pool = layers.GlobalAveragePooling2D()
+
+    if head == "dense_first":
+        first = [dense, pool]
+    elif head == "pool_first":
+        first = [pool, dense]
+    else:
+        raise ValueError(f"Unknown head '{head}'")
+
+    return first + [layers.Dropout(0.5), layers.Dense(CLASSES, activation='softmax')]
+
+
+def add_head(x, head=None):
+    """
+    Put the custom FC on top of some tensor (e.g. the output of Xception)
+
+    :param x: tensor
+    :param head: dense_first or pool_first. Default -> HEAD
+
+    :return: predictions
+    """
+    for head_layer in head_layers(head):
+        x = head_layer(x)
+
+    return x
+
+
+def head_file_name(file_name, head=None):
+    """
+    Files (weights, plots...) for anything but the original head get the name of the head on the end
+    e.g. 'model.h5' -> 'model_pool_first.h5'
+
+    :param file_name: Name for dense_first
+    :param head: dense_first or pool_first. Default -> HEAD
+
+    :return: file name
+    """
+    head = head or HEAD
+    if head == "dense_first":
+        return file_name
+
+    root, ext = os.path.splitext(file_name)
+    return f"{root}_{head}{ext}"
+
+
+def request(url, fake_user, extra_headers=None, stream=False, context=None):
+    """
+    Send one request (w/o any cache). Failures go to the retry queue (see retry_queue.py).
 
     :param url: Link to the page
-    :param fake_user: Fake user agent object 
+    :param fake_user: Fake user agent object
+    :param extra_headers: dict of headers on top of the User-Agent
+    :param stream: Don't download the body straight away (see image_ingest.ingest)
+    :param context: What the retry queue needs to try it again. Default -> it's a page
 
     :return: response object
     """
     response = None
+    headers = dict({'User-Agent': fake_user.random}, **(extra_headers or {}))
 
     try:
-        response = requests.get(url, headers={'User-Agent': fake_user.random}, timeout=5)
+        response = requests.get(url, headers=headers, timeout=5, stream=stream)
         response.raise_for_status()
-    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
+    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout) as e:
         # If anything goes wrong we log the url
         print("Error getting ", url)
-        with open("../url_error_log.txt", "w") as file:
-            file.write(url)
+        with open("../url_error_log.txt", "a") as file:
+            file.write(url + "\n")
+
+        failed(url, e, response.status_code if response is not None else None, headers, context)
+    else:
+        # Images only worked once they're saved
+        if not stream:
+            succeeded(url)
 
     # We'll give them 3 seconds
     time.sleep(3)
@@ -73,6 +164,38 @@ def get_page(url, fake_user):
     return response
 
 
+def failed(url, error, status_code, headers, context=None):
+    queue = retry_queue.get_queue()
+    if queue is not None:
+        queue.failed(url, error, status_code, user_agent=headers.get('User-Agent'), **(context or {"kind": "page"}))
+
+
+def succeeded(url):
+    queue = retry_queue.get_queue()
+    if queue is not None:
+        queue.succeeded(url)
+
+
+def get_page(url, fake_user):
+    """
+    Retrieve the contents for this page
+
+    :param url: Link to the page
+    :param fake_user: Fake user agent object 
+
+    :return: response object (None if it failed - couldn't connect or a bad status. It's in the retry queue.)
+    """
+    # Pages that are cached (see http_cache.py) don't need a request at all
+    cache = http_cache.get_cache()
+    if cache is None:
+        response = request(url, fake_user)
+    else:
+        response = cache.get(url, lambda extra_headers: request(url, fake_user, extra_headers))
+
+    # An error page is no use to the parsers
+    return response if response is not None and response.ok else None
+
+
 def if_image_exists(file, db):
     """
     If the image file exists we skip scraping that page
@@ -87,7 +210,7 @@ def if_image_exists(file, db):
 
 def save_image(image_response, file_name, db):
     """
-    Saves the image as a given name. 
+    Saves the image as a given name. The bytes are written as they are (see image_ingest.py).
 
     :param image_response: response from requests
     :param file_name: Name of file
@@ -95,14 +218,8 @@ def save_image(image_response, file_name, db):
 
     :return: None
     """
-    # Idk....
-    if db != "nga":
-        img = Image.open(BytesIO(image_response))
-        img.save(f"../../sculpture_data/{db}/sculpture_images/{file_name}")
-    else:
-        file = open(f"../../sculpture_data/{db}/sculpture_images/{file_name}", 'wb')
-        file.write(image_response)
-        file.close()
+    if image_ingest.save_bytes(image_response, file_name, db) is not None:
+        image_ingest.submit_thumbnail(file_name, db)
 
 
 def scrape_image(file_name, url, fake_user, db):
@@ -114,5 +231,24 @@ def scrape_image(file_name, url, fake_user, db):
     # Get & save image - using file_num
     # Only scrape if not saved already
     if not if_image_exists(file_name, db):
-        image_response = get_page(url, fake_user).content
-        save_image(image_response, file_name, db)
+        context = {"kind": "image", "file": file_name, "db": db}
+
+        # Streamed straight to disk (& not through the page cache)
+        response = request(url, fake_user, stream=True, context=context)
+        if response is None or not response.ok:
+            return
+
+        try:
+            path = image_ingest.ingest(response, file_name, db)
+        except requests.exceptions.RequestException as e:
+            # Connection dropped in the middle of the body
+            path, error = None, e
+        else:
+            error = "bad image"
+
+        if path is None:
+            failed(url, error, None, response.request.headers, context)
+            return
+
+        succeeded(url)
+        image_ingest.submit_thumbnail(file_name, db)
@@ -0,0 +1,245 @@
+"""
+What the scrapers pull out of the pages, w/ lxml instead of building a whole BeautifulSoup tree.
+
+- Big pages (the WGA artist listings w/ max=50000 & the saved WikiArt.html) -> parsed w/o building any tree. The parser
+  calls back on every tag & piece of text (the same events BeautifulSoup's lxml builder gets) and only what's wanted
+  is kept, so memory doesn't grow w/ the size of the page. Files are fed in chunks.
+- Small pages -> lxml tree & XPath
+
+Every function gives the same thing as the BeautifulSoup code it replaces (see tests/test_html_extract.py).
+"""
+import json
+from bs4.dammit import UnicodeDammit
+from lxml import etree, html
+
+CHUNK_SIZE = 64 * 1024
+
+
+def has_class(name):
+    """
+    XPath test for an element w/ the class 'name' (among others) -> like BeautifulSoup's {"class": name}
+    """
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def decode(content):
+    """
+    Bytes -> str the same way BeautifulSoup does it (declared encoding, then guessing)
+    """
+    return UnicodeDammit(content, is_html=True).unicode_markup if isinstance(content, bytes) else content
+
+
+def make_parser(target, encoding=None):
+    # Same options BeautifulSoup uses for 'lxml'
+    return etree.HTMLParser(target=target, strip_cdata=False, recover=True, encoding=encoding)
+
+
+def parse_events(target, source, encoding=None):
+    """
+    Run the events of a page through a target w/o building a tree
+
+    :param target: Object w/ start(tag, attrib), end(tag), data(text) & close()
+    :param source: bytes/str of the page or an open (binary) file
+    :param encoding: Encoding of the bytes (None -> what the page says)
+
+    :return: What target.close() returns
+    """
+    parser = make_parser(target, encoding)
+
+    if hasattr(source, "read"):
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            parser.feed(chunk)
+    else:
+        parser.feed(source)
+
+    return parser.close()
+
+
+class ArtistTable:
+    """
+    Rows of the WGA artist listing -> The first table w/ the given attributes. Cells are (td) text like get_text().
+    """
+    ATTRIBUTES = {'style': 'border: 0;', 'border': "1", "cellpadding": "4", "width": "700"}
+
+    def __init__(self):
+        self.depth = 0
+        self.done = False
+        self.rows = []
+        self.cells = None
+
+    def start(self, tag, attrib):
+        if self.depth:
+            self.depth += tag == "table"
+            if tag == "tr":
+                self.rows.append([])
+            elif tag == "td" and self.rows:
+                self.cells = self.rows[-1]
+                self.cells.append([])
+        elif tag == "table" and not self.done and all(attrib.get(k) == v for k, v in self.ATTRIBUTES.items()):
+            self.depth = 1
+
+    def end(self, tag):
+        if not self.depth:
+            return
+
+        if tag == "td":
+            self.cells = None
+        elif tag == "table":
+            self.depth -= 1
+            self.done = not self.depth
+
+    def data(self, text):
+        if self.cells is not None:
+            self.cells[-1].append(text)
+
+    def close(self):
+        return [["".join(cell) for cell in row] for row in self.rows]
+
+
+def artist_rows(page):
+    """
+    Artist & period of every row of a WGA artist listing (see scrape_wga.scrape_artists.parse_artist_page)
+
+    :param page: bytes of the page (ISO-8859-1)
+
+    :return: list of {'Artist':, 'Period':}
+    """
+    rows = parse_events(ArtistTable(), page, encoding="ISO-8859-1")
+    if not rows:
+        raise IndexError("No artist table in the page")
+
+    # First row are the cols
+    return [{'Artist': cells[1], 'Period': cells[3]} for cells in rows[1:]]
+
+
+class WikiArtList:
+    """
+    Artists, titles, links & images of the saved WikiArt sculpture listing
+    """
+    def __init__(self):
+        self.artists, self.titles, self.links, self.images = [], [], [], []
+
+        # Text of every <a> that's open (None for the ones that aren't wanted) & index of every <li> that's open
+        self.anchors = []
+        self.lis = []
+
+    def start(self, tag, attrib):
+        if tag == "a":
+            text = None
+            if attrib.get("target") == "_self" and attrib.get("class") == "artist-name ng-binding":
+                text = []
+                self.artists.append(text)
+            elif attrib.get("target") == "_self" and attrib.get("class") == "artwork-name ng-binding":
+                text = []
+                self.titles.append(text)
+                self.links.append(attrib['href'])
+            self.anchors.append(text)
+
+        elif tag == "li":
+            wanted = "ng-scope" in attrib.get("class", "").split()
+            if wanted:
+                self.images.append(None)
+            self.lis.append(len(self.images) - 1 if wanted else None)
+
+        elif tag == "img":
+            # First img in each li (that doesn't have one yet)
+            for index in self.lis:
+                if index is not None and self.images[index] is None:
+                    self.images[index] = attrib['ng-src']
+
+    def end(self, tag):
+        if tag == "a" and self.anchors:
+            self.anchors.pop()
+        elif tag == "li" and self.lis:
+            self.lis.pop()
+
+    def data(self, text):
+        for anchor in self.anchors:
+            if anchor is not None:
+                anchor.append(text)
+
+    def close(self):
+        artists = ["".join(artist) for artist in self.artists]
+        titles = ["".join(title) for title in self.titles]
+
+        return {'artists': [artist[:artist.find('\xa0•')].strip() for artist in artists],
+                'titles': [title.strip() for title in titles],
+                'links': self.links,
+                'images': [image[image.rfind("/") + 1:] for image in self.images]}
+
+
+def wikiart_sculpture_list(path):
+    """
+    See scrape_wikiart.parse_sculpture_list
+
+    :param path: Path of the saved page
+
+    :return: Dict - artists, titles, links, images
+    """
+    with open(path, "rb") as file:
+        return parse_events(WikiArtList(), file, encoding="utf-8")
+
+
+def wikiart_sculpture_page(content):
+    """
+    Style & link to the original image of a WikiArt sculpture page
+
+    :param content: bytes of the page
+
+    :return: style, image url
+    """
+    tree = html.fromstring(decode(content))
+
+    style = tree.xpath(f"(//li[{has_class('dictionary-values')}])[1]")[0].text_content()
+    style = style[style.find(":") + 1:].strip()
+
+    image_links = tree.xpath("(//main[@ng-controller='ArtworkViewCtrl'])[1]/@ng-init")[0]
+
+    # Dict of different types of images...there's a semicolon at the end
+    image_dict = json.loads(image_links[image_links.find("=") + 2:-1])
+
+    # We want the image marked 'original'
+    original = [url for url in image_dict["ImageThumbnailsModel"][0]["Thumbnails"] if url['Name'] == 'Original'][0]
+
+    return style, original['Url']
+
+
+def wga_sculpture_page(content):
+    """
+    Artist & link to the image of a WGA sculpture page
+
+    :param content: bytes of the page
+
+    :return: name, image link (relative to https://www.wga.hu)
+    """
+    tree = html.fromstring(decode(content))
+
+    name = tree.xpath(f"(//div[{has_class('INDEX2')}])[1]")[0].text_content()
+
+    # Only one matching td tag
+    td = tree.xpath("(//td[@width='30%'])[1]")[0]
+
+    return name, td.xpath("(.//a)[1]/@href")[0]
+
+
+def nga_sculptures(content):
+    """
+    <li class="art"> of every sculpture on an NGA results page
+
+    :param content: html of the page
+
+    :return: list of lxml elements
+    """
+    if not content:
+        return []
+    return html.fromstring(decode(content)).xpath(f"//li[{has_class('art')}]")
+
+
+def nga_sculpture(sculpt):
+    """
+    Name, title & image of one NGA sculpture (an element from nga_sculptures)
+
+    :return: name, title, image_url (as on the page)
+    """
+    dt_tags = sculpt.xpath(".//dt")
+    return dt_tags[0].text_content(), dt_tags[1].text_content(), sculpt.xpath("(.//img)[1]/@src")[0]
@@ -0,0 +1,182 @@
+"""
+On-disk cache of the pages the scrapers get (used by helpers.get_page & crawler.get_page).
+
+- Every url is kept as a gzipped body & a small json w/ when it was fetched, its ETag & Last-Modified
+- Younger than TTL -> used as is (no request at all)
+- Older -> asked for again w/ If-None-Match/If-Modified-Since. A 304 costs the site (and us) next to nothing and
+  the body on disk is used.
+- CACHE_ONLY -> never go to the site. Anything not cached is treated as a failed request.
+
+Only successful (200) pages are kept. Images aren't cached (they're saved anyway).
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "sculpture_data", "http_cache")
+
+# Turn the cache off altogether
+ENABLED = True
+
+# Seconds a page is used w/o asking the site again (None -> forever)
+TTL = 7 * 24 * 60 * 60
+
+# Offline -> only use what's cached
+CACHE_ONLY = False
+
+# Headers kept w/ the body
+KEPT_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class HTTPCache:
+    def __init__(self, cache_dir=CACHE_DIR, ttl=TTL, cache_only=CACHE_ONLY):
+        """
+        :param cache_dir: Where it's kept
+        :param ttl: Seconds before a page is revalidated (None -> never)
+        :param cache_only: Never send a request
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.cache_only = cache_only
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        folder = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(folder, key + ".json"), os.path.join(folder, key + ".gz")
+
+    def lookup(self, url):
+        """
+        :param url: Link to the page
+
+        :return: dict of the entry (None if it isn't cached)
+        """
+        meta_file, body_file = self._paths(url)
+        try:
+            with open(meta_file, "r") as file:
+                entry = json.load(file)
+            with gzip.open(body_file, "rb") as file:
+                entry['body'] = file.read()
+        except (OSError, EOFError, ValueError):
+            return None
+
+        # Same hash, different url
+        return entry if entry['url'] == url else None
+
+    def usable(self, entry):
+        """
+        If the entry can be used w/o asking the site
+        """
+        return self.cache_only or self.ttl is None or time.time() - entry['fetched_at'] < self.ttl
+
+    def conditional_headers(self, entry):
+        """
+        Headers that make the site answer w/ a 304 if the page didn't change
+        """
+        headers = {}
+        if entry is not None:
+            if entry['headers'].get("ETag"):
+                headers['If-None-Match'] = entry['headers']["ETag"]
+            if entry['headers'].get("Last-Modified"):
+                headers['If-Modified-Since'] = entry['headers']["Last-Modified"]
+
+        return headers
+
+    def response(self, entry):
+        """
+        :return: requests.Response made from the entry
+        """
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = entry['body']
+        response.from_cache = True
+
+        return response
+
+    def store(self, url, response):
+        meta_file, body_file = self._paths(url)
+        if not os.path.exists(os.path.dirname(meta_file)):
+            os.makedirs(os.path.dirname(meta_file), exist_ok=True)
+
+        entry = {"url": url, "fetched_at": time.time(),
+                 "headers": {header: response.headers[header] for header in KEPT_HEADERS if header in response.headers}}
+
+        # Body first & then the json -> an entry is only there once both are whole
+        with gzip.open(body_file + ".tmp", "wb") as file:
+            file.write(response.content)
+        os.replace(body_file + ".tmp", body_file)
+
+        with open(meta_file + ".tmp", "w") as file:
+            json.dump(entry, file)
+        os.replace(meta_file + ".tmp", meta_file)
+
+    def refresh(self, url, entry, response):
+        # 304 -> Body is the same. The site can send new validators though.
+        entry = dict(entry, fetched_at=time.time())
+        entry['headers'] = dict(entry['headers'], **{header: response.headers[header] for header in KEPT_HEADERS
+                                                     if header in response.headers and header != "Content-Type"})
+        meta_file, _ = self._paths(url)
+        body = entry.pop('body')
+
+        with open(meta_file + ".tmp", "w") as file:
+            json.dump(entry, file)
+        os.replace(meta_file + ".tmp", meta_file)
+
+        entry['body'] = body
+        return entry
+
+    def update(self, url, response, entry):
+        """
+        Deal with what came back from the site
+
+        :param url: Link to the page
+        :param response: response from the (conditional) request
+        :param entry: What was cached before (or None)
+
+        :return: response to use
+        """
+        if response.status_code == 304 and entry is not None:
+            return self.response(self.refresh(url, entry, response))
+        if response.status_code == 200:
+            self.store(url, response)
+
+        return response
+
+    def get(self, url, fetch):
+        """
+        Get a page through the cache
+
+        :param url: Link to the page
+        :param fetch: Function that sends the request -> fetch(extra_headers) returns a response (or None)
+
+        :return: response object (None if it failed or isn't cached in cache-only mode)
+        """
+        entry = self.lookup(url)
+        if entry is not None and self.usable(entry):
+            return self.response(entry)
+        if self.cache_only:
+            print("Not in the cache ", url)
+            return None
+
+        response = fetch(self.conditional_headers(entry))
+        return self.update(url, response, entry) if response is not None else None
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    The cache used by get_page (None if it's turned off)
+    """
+    global _cache
+    if ENABLED and _cache is None:
+        _cache = HTTPCache()
+
+    return _cache if ENABLED else None
@@ -0,0 +1,261 @@
+"""
+Saving the scraped images.
+
+- The body of the response is streamed to disk in chunks as is -> never decoded & encoded again
+- Before it's kept it's checked w/o decoding it: the size matches Content-Length, it starts like an image & (for JPEGs
+  and PNGs) it isn't cut short
+- A working copy no bigger than THUMBNAIL_SIZE on its longest edge is made on a pool of threads. JPEGs are decoded in
+  draft mode -> the decoder only does the work for a small version. clean_data uses the working copies when there
+  are some, so nothing after this has to decode the full size images again.
+
+Backfill the working copies (and check) the images already scraped:
+
+python image_ingest.py [--db wga wikiart nga] [--workers 8]
+"""
+import argparse
+import os
+import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+
+IMAGE_DIR = "../../sculpture_data/{db}/sculpture_images"
+THUMBNAIL_DIR = "../../sculpture_data/{db}/sculpture_thumbnails"
+
+# Longest edge of the working copies. The models only see 299x299 -> leaves room for the augmentation's zoom/shifts.
+THUMBNAIL_SIZE = 600
+THUMBNAIL_QUALITY = 90
+THUMBNAIL_WORKERS = 4
+
+CHUNK_SIZE = 64 * 1024
+
+SIGNATURES = {b"\xff\xd8\xff": "jpeg", b"\x89PNG\r\n\x1a\n": "png", b"GIF87a": "gif", b"GIF89a": "gif",
+              b"BM": "bmp", b"II*\x00": "tiff", b"MM\x00*": "tiff"}
+
+ERROR_LOG = "../url_error_log.txt"
+
+
+def image_path(file_name, db):
+    return os.path.join(IMAGE_DIR.format(db=db), file_name)
+
+
+def thumbnail_path(file_name, db):
+    return os.path.join(THUMBNAIL_DIR.format(db=db), file_name)
+
+
+def image_format(head):
+    """
+    :param head: First bytes of the file
+
+    :return: Format going by the bytes (None if it doesn't look like an image)
+    """
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+
+    return next((image_type for signature, image_type in SIGNATURES.items() if head.startswith(signature)), None)
+
+
+def check_image(path, expected_size=None):
+    """
+    Cheap check the file is a whole image -> Only looks at the size, the first and the last bytes
+
+    :param path: Path of the file
+    :param expected_size: # of bytes it should be (e.g. Content-Length)
+
+    :return: What's wrong with it (None if nothing)
+    """
+    size = os.path.getsize(path)
+    if expected_size is not None and size != expected_size:
+        return f"{size} bytes instead of {expected_size}"
+
+    with open(path, "rb") as file:
+        head = file.read(16)
+        file.seek(max(size - 1024, 0))
+        tail = file.read()
+
+    image_type = image_format(head)
+    if image_type is None:
+        return "not an image"
+
+    # Cut short -> the end marker is missing (some JPEGs have a bit of junk after it)
+    if image_type == "jpeg" and b"\xff\xd9" not in tail:
+        return "truncated jpeg"
+    if image_type == "png" and b"IEND" not in tail[-12:]:
+        return "truncated png"
+
+    return None
+
+
+def _keep(part, path, expected_size):
+    problem = check_image(part, expected_size)
+    if problem is not None:
+        os.remove(part)
+        return problem
+
+    # Only a file that passed ever has the real name
+    os.replace(part, path)
+    return None
+
+
+def _log_error(url, problem):
+    print(f"Bad image from {url}: {problem}")
+    with open(ERROR_LOG, "a") as file:
+        file.write(url + "\n")
+
+
+def ingest(response, file_name, db):
+    """
+    Stream the body of a response (made w/ stream=True) to disk & check it
+
+    :param response: requests response
+    :param file_name: Name of file
+    :param db: wikiart, nga, or wga
+
+    :return: Path of the image (None if it was no good)
+    """
+    path = image_path(file_name, db)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Content-Length is of the compressed body if there's a Content-Encoding -> can't check it then
+    expected_size = None
+    if "Content-Length" in response.headers and "Content-Encoding" not in response.headers:
+        expected_size = int(response.headers["Content-Length"])
+
+    try:
+        with open(path + ".part", "wb") as file:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                file.write(chunk)
+    finally:
+        response.close()
+
+    problem = _keep(path + ".part", path, expected_size)
+    if problem is not None:
+        _log_error(response.url, problem)
+        return None
+
+    return path
+
+
+def save_bytes(content, file_name, db):
+    """
+    Same as ingest but for a body that's already in memory
+
+    :return: Path of the image (None if it was no good)
+    """
+    path = image_path(file_name, db)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + ".part", "wb") as file:
+        file.write(content)
+
+    problem = _keep(path + ".part", path, None)
+    if problem is not None:
+        _log_error(file_name, problem)
+        return None
+
+    return path
+
+
+def make_thumbnail(source, destination, size=THUMBNAIL_SIZE):
+    """
+    Make the working copy of an image. Images that are small enough already are just linked.
+
+    :param source: Path of the image
+    :param destination: Path of the working copy
+    :param size: Max length of the longest edge
+
+    :return: What was done
+    """
+    if not os.path.exists(os.path.dirname(destination)):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+    with Image.open(source) as img:
+        if max(img.size) <= size and img.format == "JPEG":
+            try:
+                os.link(source, destination)
+            except FileExistsError:
+                pass
+            except OSError:
+                # e.g. another drive
+                shutil.copyfile(source, destination)
+            return "linked"
+
+        # Decoder only makes a version (1/2, 1/4 or 1/8 scale) at least as big as the thumbnail. Does nothing for
+        # non-JPEGs.
+        scale = size / max(img.size)
+        img.draft("RGB", (int(img.size[0] * scale + 1), int(img.size[1] * scale + 1)))
+        img = img.convert("RGB")
+        img.thumbnail((size, size), Image.LANCZOS)
+
+        img.save(destination + ".part", "JPEG", quality=THUMBNAIL_QUALITY)
+        os.replace(destination + ".part", destination)
+
+    return "thumbnail"
+
+
+_pool = None
+
+
+def thumbnail_pool():
+    """
+    Pool the working copies are made on. PIL lets go of the GIL while decoding/resizing so threads are enough.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _pool
+
+
+def submit_thumbnail(file_name, db):
+    """
+    Make the working copy of a scraped image in the background
+
+    :return: concurrent.futures.Future
+    """
+    return thumbnail_pool().submit(make_thumbnail, image_path(file_name, db), thumbnail_path(file_name, db))
+
+
+def backfill(file_name, db):
+    """
+    Check an image already scraped & make its working copy if it doesn't have one
+
+    :return: What was done (or what's wrong w/ it)
+    """
+    path = image_path(file_name, db)
+    problem = check_image(path)
+    if problem is not None:
+        return problem
+
+    if os.path.isfile(thumbnail_path(file_name, db)):
+        return "exists"
+
+    try:
+        return make_thumbnail(path, thumbnail_path(file_name, db))
+    except OSError as e:
+        return str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the scraped images & make their working copies")
+    parser.add_argument("--db", nargs="+", default=["wga", "wikiart", "nga"])
+    parser.add_argument("--workers", type=int, default=None, help="# of processes. Default -> # of cpus")
+    args = parser.parse_args()
+
+    todo = [(file, db) for db in args.db for file in sorted(os.listdir(IMAGE_DIR.format(db=db)))
+            if not file.endswith(".part")]
+
+    done = Counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = executor.map(backfill, [file for file, _ in todo], [db for _, db in todo], chunksize=32)
+        for (file, db), result in zip(todo, results):
+            done[result] += 1
+            if result not in ["exists", "linked", "thumbnail"]:
+                print(f"{db}/{file}: {result}")
+
+    print(dict(done))
+
+
+if __name__ == "__main__":
+    main()
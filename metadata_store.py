@@ -0,0 +1,310 @@
+"""
+Metadata of every sculpture from the three sources in one SQLite file (STORE_FILE).
+
+- sources    -> Which have been written & when
+- artists    -> WGA artists & their period (what was wga_artists.csv)
+- sculptures -> One row per image. Kept as scraped & normalised (see fix_text) -> the normalising is done once when
+                a source is written, not every time the data is read.
+
+There are indexes on the file, the author & the normalised (author, title) -> The WGA artist lookup and putting the
+sources together for clean_data.get_data (one period filter, GROUP BY & ORDER BY) are queries that use them instead
+of reading & merging the csvs again.
+
+The scrapers still write their csvs to look at. Sources that were scraped before the store existed are read in from
+those the first time they're needed (see import_missing).
+"""
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "sculpture_data")
+STORE_FILE = os.path.join(DATA_DIR, "metadata.sqlite")
+
+# Written by the scrapers before the store -> read in if the source isn't in the store yet
+PERIOD_CSVS = {db: os.path.join(DATA_DIR, db, "sculptures", f"{db}_sculpture_periods.csv")
+               for db in ["wga", "wikiart", "nga"]}
+ARTIST_CSV = os.path.join(DATA_DIR, "wga", "sculptures", "wga_artists.csv")
+
+# Order the sources are put together in -> For a duplicate (same normalised author & title) the last one is kept
+SOURCES = ["wga", "wikiart", "nga"]
+RANK_STEP = 10 ** 9
+
+PERIODS = ["BAROQUE", "EARLY RENAISSANCE", "MEDIEVAL", "NEOCLASSICISM", "HIGH RENAISSANCE", "MINIMALISM", "REALISM",
+           "IMPRESSIONISM", "ROCOCO", "SURREALISM", "MANNERISM", "ROMANTICISM"]
+
+# Max # of ?s in one query (SQLite's limit is 999)
+MAX_VARIABLES = 900
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    rows INTEGER,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS artists (
+    source TEXT,
+    name TEXT,
+    period TEXT
+);
+CREATE TABLE IF NOT EXISTS sculptures (
+    file TEXT PRIMARY KEY,
+    source TEXT,
+    rank INTEGER,
+    author_raw TEXT,
+    author TEXT,
+    title TEXT,
+    url TEXT,
+    period_raw TEXT,
+    author_fixed TEXT,
+    title_fixed TEXT,
+    period TEXT
+);
+CREATE INDEX IF NOT EXISTS artists_name ON artists (source, name);
+CREATE INDEX IF NOT EXISTS sculptures_source ON sculptures (source);
+CREATE INDEX IF NOT EXISTS sculptures_author ON sculptures (author);
+CREATE INDEX IF NOT EXISTS sculptures_fixed ON sculptures (author_fixed, title_fixed, period);
+"""
+
+
+def fold_accents(text):
+    """
+    Get rid of the accents -> e.g. 'Cánova' & 'Canova' then match
+
+    :param text: Some string
+
+    :return: Same string w/o the accents
+    """
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn')
+
+
+def fix_name_nga(artists):
+    """
+    Fix the names for NGA -> Cut off everything from 'sculptor' on
+
+    :param artists: Series of artist names
+
+    :return: Fixed names
+    """
+    return artists.str.partition("sculptor")[0].str.strip()
+
+
+def fix_name_wiki(artists):
+    """
+    Fix the names for WikiArt
+
+    :param artists: Series of artist names
+
+    :return: Fixed names
+    """
+    return pd.Series(np.select([artists.str.contains("Alonzo Cano", regex=False, na=False),
+                                artists.str.contains("Michelangelo", regex=False, na=False)],
+                               ["Alonso Cano", "Michelangelo Buonarroti"], artists),
+                     index=artists.index)
+
+
+def fix_name_wga(artists):
+    """
+    Fix the names for WGA -> 'Last, First' to 'First Last'
+
+    :param artists: Series of artist names
+
+    :return: Fixed names
+    """
+    parts = artists.str.partition(",")
+
+    return (parts[2].str.strip() + " " + parts[0].str.strip()).where(parts[1] == ",", artists)
+
+
+NAME_FIXES = {"wga": fix_name_wga, "wikiart": fix_name_wiki, "nga": fix_name_nga}
+
+
+def fix_text(texts):
+    """
+    By 'fix' I mean deal with encoding, get rid of newlines, convert to uppercase, and strip of leading/trailing
+
+    Only the values with something that isn't ASCII can have accents. Each distinct one of those is folded once and
+    looked up for the rest.
+
+    :param texts: Series of titles or artist names
+
+    :return: 'Fixed' texts
+    """
+    non_ascii = texts.str.contains(r'[^\x00-\x7f]', na=False)
+    if non_ascii.any():
+        codes, uniques = pd.factorize(texts[non_ascii])
+        folded = np.array([fold_accents(text) for text in uniques], dtype=object)
+        texts = texts.copy()
+        texts[non_ascii] = folded[codes]
+
+    return texts.str.replace('\n', '', regex=False).str.upper().str.strip()
+
+
+def fix_period(periods):
+    """
+    Uppercase & every kind of surrealism is just SURREALISM
+
+    :param periods: Series of periods
+
+    :return: Fixed periods
+    """
+    periods = periods.str.upper()
+    return periods.where(~periods.str.contains("SURREALISM", regex=False, na=False), "SURREALISM")
+
+
+def _rows(df, columns):
+    # NaN -> NULL
+    df = df[columns].astype(object)
+    return df.where(pd.notnull(df), None).values.tolist()
+
+
+class MetadataStore:
+    def __init__(self, path=STORE_FILE):
+        """
+        :param path: SQLite file
+        """
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def sources(self):
+        """
+        :return: Set of the sources that have been written
+        """
+        return {name for name, in self.conn.execute("SELECT name FROM sources")}
+
+    def write_artists(self, source, df):
+        """
+        Replace the artists of a source
+
+        :param source: e.g. wga
+        :param df: DataFrame w/ Artist & Period (like wga_artists.csv)
+
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM artists WHERE source = ?", (source,))
+            self.conn.executemany("INSERT INTO artists VALUES (?, ?, ?)",
+                                  [[source] + row for row in _rows(df, ['Artist', 'Period'])])
+
+    def artist_periods(self, source, names):
+        """
+        Period of each artist -> The first one listed for an artist that's listed more than once
+
+        :param source: e.g. wga
+        :param names: Names as in the artist listing
+
+        :return: dict of name -> period (artists that aren't there are left out)
+        """
+        names = list(names)
+        periods = {}
+        for start in range(0, len(names), MAX_VARIABLES):
+            chunk = names[start:start + MAX_VARIABLES]
+            rows = self.conn.execute(f"SELECT name, period FROM artists WHERE source = ? AND name IN "
+                                     f"({', '.join('?' * len(chunk))}) ORDER BY rowid", [source] + chunk)
+            for name, period in rows:
+                periods.setdefault(name, period)
+
+        return periods
+
+    def write_sculptures(self, source, df):
+        """
+        Replace the sculptures of a source. The names, titles & periods are normalised here.
+
+        :param source: wga, wikiart, or nga
+        :param df: DataFrame w/ Author, title, file, url & Period (like the *_sculpture_periods.csv)
+
+        :return: None
+        """
+        df = df[['Author', 'title', 'file', 'url', 'Period']].reset_index(drop=True)
+        df['author_raw'], df['period_raw'] = df['Author'], df['Period']
+        df['Author'] = NAME_FIXES[source](df['Author'])
+        df['author_fixed'] = fix_text(df['Author'])
+        df['title_fixed'] = fix_text(df['title'])
+        df['Period'] = fix_period(df['Period'])
+        df['source'] = source
+        df['rank'] = SOURCES.index(source) * RANK_STEP + df.index
+
+        columns = ['file', 'source', 'rank', 'author_raw', 'Author', 'title', 'url', 'period_raw', 'author_fixed',
+                   'title_fixed', 'Period']
+        with self.conn:
+            self.conn.execute("DELETE FROM sculptures WHERE source = ?", (source,))
+            self.conn.executemany(f"INSERT INTO sculptures VALUES ({', '.join('?' * len(columns))})",
+                                  _rows(df, columns))
+            self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (source, len(df), time.time()))
+
+    def import_missing(self, period_csvs=PERIOD_CSVS, artist_csv=ARTIST_CSV):
+        """
+        Read in the csvs of the sources that were scraped before the store
+
+        :return: List of what was read in
+        """
+        imported = []
+
+        for source, csv_file in period_csvs.items():
+            if source not in self.sources() and os.path.isfile(csv_file):
+                self.write_sculptures(source, pd.read_csv(csv_file, index_col=0))
+                imported.append(csv_file)
+
+        if self.conn.execute("SELECT 1 FROM artists LIMIT 1").fetchone() is None and os.path.isfile(artist_csv):
+            self.write_artists("wga", pd.read_csv(artist_csv, index_col=0))
+            imported.append(artist_csv)
+
+        for csv_file in imported:
+            print(f"Read '{csv_file}' into '{self.path}'")
+
+        return imported
+
+    def sculptures(self, periods=PERIODS):
+        """
+        Every sculpture in one of the periods. Sculptures w/ the same normalised author & title are only there once
+        (the last one -> see SOURCES).
+
+        :param periods: Normalised periods wanted
+
+        :return: DataFrame sorted by the normalised author & title
+        """
+        # SQLite fills in the bare columns from the row w/ the MAX
+        query = f"""
+            SELECT author AS Author, period AS Period, file, title, url, author_fixed AS Author_Fixed, title_fixed,
+                   MAX(rank) AS rank
+            FROM sculptures
+            WHERE period IN ({', '.join('?' * len(periods))})
+            GROUP BY author_fixed, title_fixed
+            ORDER BY author_fixed IS NULL, author_fixed, title_fixed IS NULL, title_fixed
+        """
+        df = pd.read_sql_query(query, self.conn, params=list(periods)).drop(columns=['rank'])
+
+        # NULL -> NaN like read_csv
+        return df.where(pd.notnull(df), np.nan)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    The store shared by the scrapers & clean_data
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MetadataStore()
+
+    return _store
@@ -0,0 +1,120 @@
+"""
+Different ways of running the fine-tuned model. They all have the same predict(x, batch_size) as the keras model.
+
+- keras  -> predict_image.create_model (float32)
+- frozen -> frozen_model.FrozenModel - the graph from export_model.py (float32)
+- tflite -> TFLiteModel - a model from export_tflite.py run by the TFLite interpreter (float32, float16 or int8)
+"""
+import numpy as np
+import tensorflow as tf
+import frozen_model
+
+BACKENDS = ["keras", "frozen", "tflite"]
+QUANTIZATIONS = ["float32", "float16", "int8"]
+
+TFLITE_FILE = "../models/xception_finetune_12_reg_75_block4_{}.tflite"
+
+
+def tflite_file(quantization):
+    return TFLITE_FILE.format(quantization)
+
+
+def lite_module():
+    # Moved out of contrib in 1.13
+    return tf.lite if hasattr(tf, "lite") else tf.contrib.lite
+
+
+class TFLiteModel:
+    """
+    Wrap the TFLite interpreter so it can be used like the keras model (just predict).
+
+    The interpreter is resized whenever the batch size changes, so it's fastest fed batches of the same size.
+    """
+    def __init__(self, model_file):
+        self.model_file = model_file
+        self.interpreter = lite_module().Interpreter(model_path=model_file)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = self.input['shape'][0]
+
+    def _resize(self, batch_size):
+        if batch_size != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input['index'], [batch_size] + list(self.input['shape'][1:]))
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch_size
+
+    def _run(self, x):
+        self._resize(len(x))
+
+        # Only if the input/output were quantized too (the default keeps them float)
+        scale, zero_point = self.input['quantization']
+        if scale:
+            x = np.round(x / scale + zero_point)
+        self.interpreter.set_tensor(self.input['index'], x.astype(self.input['dtype']))
+        self.interpreter.invoke()
+
+        preds = self.interpreter.get_tensor(self.output['index'])
+        scale, zero_point = self.output['quantization']
+        if scale:
+            preds = (preds.astype("float32") - zero_point) * scale
+
+        return preds
+
+    def predict(self, x, batch_size=None):
+        """
+        Get the class probabilities
+
+        :param x: (# images, 299, 299, 3) array
+        :param batch_size: Run in chunks of this size. Default -> all at once
+
+        :return: (# images, # classes) array
+        """
+        batch_size = batch_size or len(x)
+
+        return np.concatenate([self._run(x[start:start + batch_size]) for start in range(0, len(x), batch_size)])
+
+
+def model_file(backend, quantization="float32"):
+    """
+    Default file for a backend
+
+    :param backend: keras, frozen or tflite
+    :param quantization: Only for tflite
+
+    :return: path
+    """
+    if backend == "keras":
+        # Keras comes with helpers -> only imported when it's used
+        import helpers
+        return helpers.head_file_name(helpers.WEIGHTS_FILE)
+    elif backend == "frozen":
+        return frozen_model.FROZEN_FILE
+    elif backend == "tflite":
+        return tflite_file(quantization)
+
+    raise ValueError(f"Unknown backend '{backend}'")
+
+
+def load(backend, file=None, quantization="float32"):
+    """
+    Load the model for a backend
+
+    :param backend: keras, frozen or tflite
+    :param file: Weights/graph/tflite file. Default -> model_file(backend, quantization)
+    :param quantization: Which tflite file to use when none is given
+
+    :return: model
+    """
+    file = file or model_file(backend, quantization)
+
+    if backend == "keras":
+        # Keras is only imported when it's used - most of the start up time of the other backends otherwise
+        import predict_image
+        return predict_image.create_model(file)
+    elif backend == "frozen":
+        return frozen_model.FrozenModel(file)
+    elif backend == "tflite":
+        return TFLiteModel(file)
+
+    raise ValueError(f"Unknown backend '{backend}'")
@@ -0,0 +1,109 @@
+"""
+Compare the backends (see backends.py) side by side:
+- latency  -> median ms for one image & ms per image in batches of predict_test.BATCH_SIZE
+- memory   -> peak resident memory of the process & how much of it came from loading the model
+- accuracy -> accuracy & top-k accuracy on the test set
+
+Every backend runs in its own python process so the memory of one doesn't count towards the next.
+
+python benchmark_backends.py [--backends keras frozen tflite:float32 tflite:float16 tflite:int8] [--runs 50]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+DEFAULT_BACKENDS = ["keras", "frozen", "tflite:float32", "tflite:float16", "tflite:int8"]
+
+
+def peak_memory():
+    # ru_maxrss is in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(backend, runs):
+    """
+    Run in the new process -> benchmark one backend and print the results as json
+
+    :param backend: backend or tflite:<quantization>
+    :param runs: # of single image predictions to time
+
+    :return: None
+    """
+    import backends
+    import pipeline
+    import predict_test
+
+    name, _, quantization = backend.partition(":")
+    batch_x, _ = predict_test.test_generator[0]
+
+    memory_before = peak_memory()
+    model = backends.load(name, quantization=quantization or "float32")
+    model.predict(batch_x[:1])
+    results = {"load_mb": peak_memory() - memory_before}
+
+    latencies = []
+    for pos in range(runs):
+        start = time.perf_counter()
+        model.predict(batch_x[pos % len(batch_x)][None])
+        latencies.append(time.perf_counter() - start)
+    results['single_ms'] = np.median(latencies) * 1000
+
+    probs, seconds = [], 0
+    for batch_x, _ in pipeline.iterate(predict_test.test_generator):
+        start = time.perf_counter()
+        probs.append(model.predict(batch_x))
+        seconds += time.perf_counter() - start
+    probs = np.concatenate(probs)
+
+    metrics = predict_test.get_metrics(probs, predict_test.test_generator.classes)
+    results.update({"batch_ms": seconds * 1000 / len(probs), "acc": metrics['acc'], "top_k_acc": metrics['top_k_acc'],
+                    "peak_mb": peak_memory()})
+
+    print(json.dumps(results))
+
+
+def run(backend, runs):
+    """
+    Start a new process for the backend
+
+    :return: dict of results
+    """
+    output = subprocess.check_output([sys.executable, os.path.realpath(__file__), "--child", backend,
+                                      "--runs", str(runs)], stderr=subprocess.DEVNULL, universal_newlines=True)
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the inference backends")
+    parser.add_argument("--backends", nargs="+", default=DEFAULT_BACKENDS)
+    parser.add_argument("--runs", type=int, default=50, help="# of single image predictions to time")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.runs)
+        return
+
+    print('{:16s} {:>10s} {:>10s} {:>9s} {:>9s} {:>8s} {:>8s}'.format("Backend", "1 img ms", "Batch ms", "Load MB",
+                                                                      "Peak MB", "Acc%", "Top-k%"))
+    print("-" * 76)
+    for backend in args.backends:
+        try:
+            results = run(backend, args.runs)
+        except subprocess.CalledProcessError:
+            print('{:16s} failed (is the model exported?)'.format(backend))
+            continue
+
+        print('{:16s} {:10.2f} {:10.2f} {:9.0f} {:9.0f} {:7.2f}% {:7.2f}%'.format(
+            backend, results['single_ms'], results['batch_ms'], results['load_mb'], results['peak_mb'],
+            results['acc'] * 100, results['top_k_acc'] * 100))
+
+
+if __name__ == "__main__":
+    main()
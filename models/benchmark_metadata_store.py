@@ -0,0 +1,135 @@
+"""
+Check the metadata store gives the same master DataFrame as reading the three *_sculpture_periods.csv & merging them
+(the old clean_data.get_data) & the same WGA periods as merging w/ wga_artists.csv (the old merge_sculpture_artist).
+Also compares how long each takes.
+
+Everything is made up (see benchmark_clean_data.make_catalogue) & written to a temporary folder.
+
+python benchmark_metadata_store.py [--rows 200000] [--artists 20000]
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import metadata_store
+from benchmark_clean_data import make_catalogue
+
+
+##### The old way ######
+
+def old_get_data(csvs):
+    wga_df, wikiart_df, nga_df = [pd.read_csv(csvs[db], index_col=0) for db in ["wga", "wikiart", "nga"]]
+
+    wga_df['Author'] = metadata_store.fix_name_wga(wga_df['Author'])
+    wikiart_df['Author'] = metadata_store.fix_name_wiki(wikiart_df['Author'])
+    nga_df['Author'] = metadata_store.fix_name_nga(nga_df['Author'])
+
+    df = pd.concat([wga_df, wikiart_df, nga_df], ignore_index=True, sort=True)
+
+    df['Author_Fixed'] = metadata_store.fix_text(df['Author'])
+    df['title_fixed'] = metadata_store.fix_text(df['title'])
+    df['Period'] = metadata_store.fix_period(df['Period'])
+
+    df = df[(df['Period'].isin(metadata_store.PERIODS))]
+    df = df.sort_values(['Author_Fixed', 'title_fixed'])
+    df = df.drop_duplicates(subset=['Author_Fixed', 'title_fixed'], keep='last')
+
+    return df.reset_index(drop=True)
+
+
+def old_merge(sculpture_df, artist_csv):
+    artist_df = pd.read_csv(artist_csv, index_col=0)
+    artist_df = artist_df.rename(index=str, columns={"Artist": "Author"})
+
+    df = pd.merge(sculpture_df, artist_df, how="left", on="Author")
+    df = df.drop_duplicates(subset=['file'])
+    df['Period'] = df.apply(lambda row: "Medieval" if "MEDIEVAL" in row['Author'] else row['Period'], axis=1)
+
+    return df.reset_index(drop=True)
+
+
+def new_merge(sculpture_df, store):
+    df = sculpture_df.drop_duplicates(subset=['file']).copy()
+    df['Period'] = df['Author'].map(store.artist_periods("wga", df['Author'].dropna().unique()))
+    df['Period'] = df['Period'].where(~df['Author'].str.contains("MEDIEVAL", regex=False, na=False), "Medieval")
+
+    return df.reset_index(drop=True)
+
+
+def make_source(db, rows, seed):
+    """
+    Sculptures of one source w/ the columns of its csv. The sources share authors & titles -> there are duplicates.
+    """
+    df = make_catalogue(rows, seed)
+    df['file'] = [f"{db}_{i:06d}.jpg" for i in range(rows)]
+    df['url'] = "https://example.org/" + df['file']
+
+    return df[['Author', 'title', 'file', 'url', 'Period']]
+
+
+def make_artists(rows, seed=7):
+    """
+    WGA artist listing. Some artists are listed under more than one period.
+    """
+    random_state = np.random.RandomState(seed)
+    df = make_catalogue(rows, seed)
+
+    names = df['Author'] + " " + pd.Series(random_state.randint(rows // 2 + 1, size=rows)).astype(str)
+    names[::50] = "MEDIEVAL MASTER"
+
+    return pd.DataFrame({'Artist': names, 'Period': df['Period']})
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the metadata store against the csvs")
+    parser.add_argument("--rows", type=int, default=200000, help="Sculptures per source")
+    parser.add_argument("--artists", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        csvs = {db: os.path.join(folder, f"{db}_sculpture_periods.csv") for db in metadata_store.SOURCES}
+        for seed, db in enumerate(metadata_store.SOURCES):
+            make_source(db, args.rows, seed).to_csv(csvs[db], sep=',')
+
+        artist_csv = os.path.join(folder, "wga_artists.csv")
+        artists = make_artists(args.artists)
+        artists.to_csv(artist_csv, sep=',')
+
+        with metadata_store.MetadataStore(os.path.join(folder, "metadata.sqlite")) as store:
+            _, write_seconds = timed(store.import_missing, csvs, artist_csv)
+
+            ##### Master DataFrame #####
+            old_df, old_seconds = timed(old_get_data, csvs)
+            new_df, new_seconds = timed(store.sculptures, metadata_store.PERIODS)
+            pd.testing.assert_frame_equal(old_df.astype(object), new_df.astype(object))
+
+            print(f"Rows:               {3 * args.rows:,} ({len(new_df):,} after the filter & duplicates)")
+            print(f"Writing the store:  {write_seconds:.2f}s (once per scrape)")
+            print(f"get_data - csvs:    {old_seconds:.2f}s")
+            print(f"get_data - store:   {new_seconds:.2f}s ({old_seconds / new_seconds:.1f}x)")
+
+            ##### WGA periods #####
+            sculptures = make_source("wga", args.rows, 0)
+            sculptures['Author'] = artists['Artist'].sample(args.rows, replace=True, random_state=3).values
+            sculptures = sculptures.drop(columns=['Period'])
+
+            old_wga, old_seconds = timed(old_merge, sculptures, artist_csv)
+            new_wga, new_seconds = timed(new_merge, sculptures, store)
+            pd.testing.assert_frame_equal(old_wga.astype(object), new_wga.astype(object))
+
+            print(f"WGA periods - csv:  {old_seconds:.2f}s")
+            print(f"WGA periods - store:{new_seconds:.2f}s ({old_seconds / new_seconds:.1f}x)")
+
+    print("Outputs match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compare how long it takes to get from process start to the first prediction for:
+- keras  -> predict_image.create_model (build Xception layer by layer + load_weights)
+- frozen -> frozen_model.FrozenModel (read the file made by export_model.py)
+
+Every run is a brand new python process so imports, graph building, etc. all count.
+
+python benchmark_startup.py [image] [--runs 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+FILE_PATH = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_IMAGE = os.path.join(FILE_PATH, "../../", "examples", "BAROQUE.jpg")
+
+
+def child(path, image_file):
+    """
+    Run in the new process -> time each step up to the first prediction and print it as json
+
+    :param path: keras or frozen
+    :param image_file: Image to predict
+
+    :return: None
+    """
+    times = {}
+    start = time.perf_counter()
+
+    if path == "keras":
+        import predict_image
+        times['import'] = time.perf_counter() - start
+        model = predict_image.create_model()
+        times['load'] = time.perf_counter() - start - times['import']
+        pic = predict_image.load(image_file)
+    else:
+        import frozen_model
+        times['import'] = time.perf_counter() - start
+        model = frozen_model.FrozenModel()
+        times['load'] = time.perf_counter() - start - times['import']
+        pic = frozen_model.load_image(image_file)
+
+    predict_start = time.perf_counter()
+    model.predict(pic)
+    times['predict'] = time.perf_counter() - predict_start
+
+    print(json.dumps(times))
+
+
+def run(path, image_file):
+    """
+    Start a new process for the given path and time it
+
+    :return: dict of times
+    """
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, os.path.realpath(__file__), image_file, "--child", path],
+                                     stderr=subprocess.DEVNULL, universal_newlines=True)
+    total = time.perf_counter() - start
+
+    times = json.loads(output.strip().splitlines()[-1])
+    times['total'] = total
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the time to the first prediction")
+    parser.add_argument("image", nargs="?", default=DEFAULT_IMAGE)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", choices=["keras", "frozen"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.image)
+        return
+
+    print('{:8s} {:>9s} {:>9s} {:>9s} {:>9s}'.format("Path", "Import", "Load", "Predict", "Total"))
+    print("----------------------------------------------")
+    for path in ["keras", "frozen"]:
+        runs = [run(path, args.image) for _ in range(args.runs)]
+        medians = {key: np.median([times[key] for times in runs]) for key in runs[0]}
+        print('{:8s} {:8.2f}s {:8.2f}s {:8.2f}s {:8.2f}s'.format(path, medians['import'], medians['load'],
+                                                                 medians['predict'], medians['total']))
+
+
+if __name__ == "__main__":
+    main()
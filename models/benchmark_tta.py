@@ -0,0 +1,65 @@
+"""
+Compare test time augmentation settings on the test set -> accuracy, top-k accuracy & ms per image for each.
+
+Only the time spent in predict (making the variants + the model) is counted. Decoding the images is the same for
+every setting so it's left out.
+
+python benchmark_tta.py [--variants identity flip,zoom_0.8 ...]
+"""
+import argparse
+import time
+import numpy as np
+import pipeline
+import predict_test
+import tta
+
+# Every set is a comma separated list of variants
+DEFAULT_SETS = ["identity", "identity,flip", ",".join(tta.DEFAULT_VARIANTS), ",".join(tta.ALL_VARIANTS)]
+
+
+def run(model, variants):
+    """
+    Predict the whole test set with the given variants
+
+    :param model: Cnn
+    :param variants: List of variants
+
+    :return: probabilities, seconds spent predicting
+    """
+    tta_model = tta.TTAModel(model, variants)
+    probs, seconds = [], 0
+
+    for batch_x, _ in pipeline.iterate(predict_test.test_generator):
+        start = time.perf_counter()
+        probs.append(tta_model.predict(batch_x))
+        seconds += time.perf_counter() - start
+
+    return np.concatenate(probs), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark test time augmentation")
+    parser.add_argument("--variants", nargs="+", default=DEFAULT_SETS, help="Comma separated sets of variants")
+    args = parser.parse_args()
+
+    model = predict_test.create_model()
+    trues = predict_test.test_generator.classes
+
+    # Warm up so the first set doesn't pay for building the graph
+    batch_x, _ = predict_test.test_generator[0]
+    model.predict(batch_x[:1])
+
+    results = []
+    for variant_set in args.variants:
+        probs, seconds = run(model, variant_set.split(","))
+        metrics = predict_test.get_metrics(probs, trues)
+        results.append((variant_set, metrics['acc'], metrics['top_k_acc'], seconds * 1000 / len(probs)))
+
+    print('{:60s} {:>8s} {:>8s} {:>9s}'.format("Variants", "Acc%", f"Top-{predict_test.TOP_K}%", "ms/image"))
+    print("-" * 88)
+    for variant_set, acc, top_k_acc, ms in results:
+        print('{:60s} {:7.2f}% {:7.2f}% {:9.2f}'.format(variant_set, acc * 100, top_k_acc * 100, ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Cache the output of a frozen (part of a) network on disk so whatever sits on top of it can be trained without
+running the frozen layers again every epoch.
+
+The store is just a directory with:
+- features.npy -> (variants, # images, *feature shape) - Read back memory mapped
+- labels.npy   -> (# images,) class index for each image
+- meta.json    -> filenames, class indices, etc.
+
+Each 'variant' is one full pass over the images through the given ImageDataGenerator. So for the training set we
+can keep the shear/zoom/flip augmentation by storing a few augmented copies of every image and cycling through
+them by epoch.
+"""
+import json
+import os
+import numpy as np
+from keras import backend as K
+from keras import layers
+from keras import models
+from keras.utils import Sequence, to_categorical
+import helpers
+import pipeline
+
+
+def store_files(store_dir):
+    """
+    Paths of the files that make up a store
+
+    :param store_dir: Directory of the store
+
+    :return: features file, labels file, meta file
+    """
+    return (os.path.join(store_dir, "features.npy"),
+            os.path.join(store_dir, "labels.npy"),
+            os.path.join(store_dir, "meta.json"))
+
+
+def load_meta(store_dir):
+    """
+    Load the meta info for a store
+
+    :param store_dir: Directory of the store
+
+    :return: Dict of info or None if the store was never finished
+    """
+    meta_file = store_files(store_dir)[2]
+
+    if not os.path.isfile(meta_file):
+        return None
+
+    with open(meta_file, 'r') as file:
+        return json.load(file)
+
+
+def split_model(model, cut):
+    """
+    Split the model in two at layer index 'cut' -> A prefix (layers [0, cut)) and a suffix (layers [cut, end)) that
+    takes the output of the prefix as its input. The suffix re-uses the same layers (and weights) as the model so
+    training it trains the model.
+
+    Everything after the cut can only depend on the output of layer cut - 1. For Xception that's true at the start of
+    each block (the layer before is the 'add' at the end of the last block).
+
+    :param model: Full model
+    :param cut: Index of the first layer of the suffix
+
+    :return: prefix model, suffix model
+    """
+    cut_tensor = model.layers[cut - 1].get_output_at(0)
+    prefix = models.Model(inputs=model.input, outputs=cut_tensor)
+
+    # Follow the graph from the cut and call every layer again on the new tensors
+    suffix_input = layers.Input(shape=K.int_shape(cut_tensor)[1:])
+    tensors = {cut_tensor.name: suffix_input}
+
+    for layer in model.layers[cut:]:
+        layer_inputs = layer.get_input_at(0)
+        try:
+            if isinstance(layer_inputs, list):
+                new_inputs = [tensors[tensor.name] for tensor in layer_inputs]
+            else:
+                new_inputs = tensors[layer_inputs.name]
+        except KeyError:
+            raise Exception(f"Can't cut the model at {cut}: '{layer.name}' needs something from before the cut")
+
+        tensors[layer.get_output_at(0).name] = layer(new_inputs)
+
+    suffix = models.Model(inputs=suffix_input, outputs=tensors[model.output.name])
+
+    return prefix, suffix
+
+
+def directory_generator(datagen, directory, batch_size=16):
+    """
+    Get a function that makes an un-shuffled flow_from_directory iterator for some seed
+
+    :param datagen: ImageDataGenerator to run the images through
+    :param directory: Directory of images
+    :param batch_size: Batch size
+
+    :return: function - seed -> iterator
+    """
+    def make_generator(seed):
+        generator = datagen.flow_from_directory(
+            directory=directory,
+            target_size=helpers.IMG_DIMENSIONS,
+            batch_size=batch_size,
+            color_mode="rgb",
+            class_mode="categorical",
+            shuffle=False,
+            seed=seed)
+        generator.fingerprint = pipeline.split_fingerprint(directory)
+
+        return generator
+
+    return make_generator
+
+
+def extract_features(model, make_generator, source, store_dir, variants=1, seed=42, dtype="float32"):
+    """
+    Run the model over every image & write the output to a memory-mapped store. The meta file is only written at
+    the very end so a partial store never looks finished.
+
+    If a finished store with the same settings already exists we don't bother doing it again. That includes the
+    fingerprint of the images (see pipeline.split_fingerprint) when the generator has one -> a split that changed
+    since (e.g. build_model_data added images) gets new features.
+
+    :param model: Frozen model whose output we want to cache
+    :param make_generator: Function - seed -> un-shuffled iterator/Sequence over the images (see directory_generator
+                           and shards.split_generator)
+    :param source: Name of where the images come from. Only used to tell if an existing store is still valid.
+    :param store_dir: Directory to put the store in
+    :param variants: # of passes over the images (only > 1 makes sense if the generator augments)
+    :param seed: Seed of the first pass. Pass i uses seed + i.
+    :param dtype: dtype the features are stored as. 'float16' halves the size on disk.
+
+    :return: Meta info for the store
+    """
+    # No shuffling -> Row i is always the same image for every variant
+    generator = make_generator(seed)
+
+    settings = {"source": source, "variants": variants, "seed": seed, "dtype": dtype,
+                "fingerprint": getattr(generator, "fingerprint", None)}
+
+    meta = load_meta(store_dir)
+    if meta is not None and all(meta.get(key) == value for key, value in settings.items()):
+        print(f"Using cached features in '{store_dir}'")
+        return meta
+
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    features_file, labels_file, meta_file = store_files(store_dir)
+
+    # Don't want an old store hanging around looking finished if we die half way through
+    if os.path.isfile(meta_file):
+        os.remove(meta_file)
+
+    features = None
+    for variant in range(variants):
+        if variant > 0:
+            generator = make_generator(seed + variant)
+
+        start = 0
+        for batch in range(len(generator)):
+            batch_images, _ = generator[batch]
+            batch_features = model.predict_on_batch(batch_images)
+
+            # Only now do we know the shape of the features
+            if features is None:
+                features = np.lib.format.open_memmap(features_file, mode="w+", dtype=dtype,
+                                                     shape=(variants, generator.n) + batch_features.shape[1:])
+
+            features[variant, start:start + batch_features.shape[0]] = batch_features
+            start += batch_features.shape[0]
+
+        print(f"Finished variant {variant + 1} of {variants} for '{source}'")
+
+    features.flush()
+    del features
+
+    np.save(labels_file, np.array(generator.classes, dtype="int32"))
+
+    meta = dict(settings, filenames=generator.filenames, class_indices=generator.class_indices)
+    with open(meta_file, "w+") as file:
+        json.dump(meta, file)
+
+    return meta
+
+
+def load_features(store_dir):
+    """
+    Load a store. The features aren't read into memory, they're memory mapped.
+
+    :param store_dir: Directory of the store
+
+    :return: features, labels, meta
+    """
+    meta = load_meta(store_dir)
+    if meta is None:
+        raise Exception(f"No finished feature store in '{store_dir}'. Run extract_features first.")
+
+    features_file, labels_file, _ = store_files(store_dir)
+
+    return np.load(features_file, mmap_mode='r'), np.load(labels_file), meta
+
+
+class FeatureSequence(Sequence):
+    """
+    Feed batches of cached features (and one-hot labels) to fit_generator/evaluate_generator.
+
+    Epoch i uses variant i % variants of the features. When shuffling, the order for each epoch only depends on the
+    seed and the epoch # so the runs are repeatable.
+    """
+    def __init__(self, store_dir, batch_size, shuffle=False, seed=42):
+        self.store_dir = store_dir
+        self.features, self.labels, self.meta = load_features(store_dir)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.set_epoch(0)
+
+    # A memmap gets pickled as a full copy of the data -> Other processes just map the file again
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['features']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.features = np.load(store_files(self.store_dir)[0], mmap_mode='r')
+
+    @property
+    def feature_shape(self):
+        return self.features.shape[2:]
+
+    @property
+    def variants(self):
+        return self.features.shape[0]
+
+    def set_epoch(self, epoch):
+        """
+        Go to the order & variant of an epoch (e.g. the one a resumed run starts at)
+
+        :param epoch: Epoch #
+
+        :return: None
+        """
+        self.epoch = epoch
+        if self.shuffle:
+            self.index_array = np.random.RandomState(self.seed + epoch).permutation(len(self.labels))
+        else:
+            self.index_array = np.arange(len(self.labels))
+
+    def __len__(self):
+        return int(np.ceil(len(self.labels) / self.batch_size))
+
+    def __getitem__(self, idx):
+        # Sorting makes the reads off disk sequential -> order within a batch doesn't matter
+        batch_index = np.sort(self.index_array[idx * self.batch_size:(idx + 1) * self.batch_size])
+        batch_features = np.asarray(self.features[self.epoch % self.variants, batch_index], dtype="float32")
+
+        return batch_features, to_categorical(self.labels[batch_index], helpers.CLASSES)
+
+    def on_epoch_end(self):
+        self.set_epoch(self.epoch + 1)
@@ -3,11 +3,15 @@
 - Also save all the model data -> Split into: Training, Validation, & Testing sets
 """
 import pandas as pd
-import unicodedata
 from sklearn.model_selection import train_test_split
 from PIL import Image
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
-import numpy as np
+import shutil
+import image_ingest
+import metadata_store
 
 # Duplicate sculptures to be deleted from master
 # This was done informally by me...I'm pretty sure I caught a vast majority of it though
@@ -33,144 +37,290 @@ DUP_SCULPTURES = ["wikiart_0551.jpg", "wikiart_0411.jpg", "wga_3788.jpg", "wga_1
                   "wikiart_0082.jpg"
                   ]
 
+MODEL_DATA_DIR = '../../sculpture_data/model_data/classes_12'
 
-def fix_name_nga(artist):
+# How save_model_data puts the images in MODEL_DATA_DIR -> hardlink, symlink, or copy (of the raw bytes)
+LINK_MODE = "hardlink"
+
+# build_model_data -> Every image's source, content hash, period & split. The split comes from the hash so an image
+# never changes split when others are added/removed.
+MANIFEST_FILE = os.path.join(MODEL_DATA_DIR, "manifest.csv")
+SPLITS = [("train", 0.6), ("validation", 0.8), ("test", 1.0)]
+
+# Drop the near-duplicates found by dedupe.py (keeping one of each) instead of the DUP_SCULPTURES above
+AUTO_DEDUPE = False
+
+# Put the working copies from image_ingest.py (max THUMBNAIL_SIZE on a side) in the model data instead of the full size
+# images when there are some -> every epoch decodes a lot less
+USE_THUMBNAILS = True
+
+
+def get_data(dedupe=True):
     """
-    Fix the name for NGA 
+    Merge All the datasets into one
 
-    :param artist: artist name
+    :param dedupe: Drop the duplicate sculptures (DUP_SCULPTURES or dedupe.py - see AUTO_DEDUPE)
 
-    :return: Fixed name
+    :return: Master DataFrame
     """
-    if "sculptor" in artist:
-        return artist[:artist.find("sculptor")].strip()
+    # Sources scraped before the store are read in from their csvs the first time
+    store = metadata_store.get_store()
+    store.import_missing()
+
+    # Names, titles & periods were normalised when each source was written -> Filter on the periods, sort & drop the
+    # duplicates (same normalised author & title) in one query
+    df = store.sculptures(metadata_store.PERIODS)
+
+    # Drop Duplicate Sculptures
+    if dedupe and AUTO_DEDUPE:
+        import dedupe as near_dupes
+        df = df[~df['file'].isin(near_dupes.duplicates(df['file'].tolist()))].reset_index(drop=True)
+    elif dedupe:
+        df = df[~df['file'].isin(DUP_SCULPTURES)].reset_index(drop=True)
     else:
-        return artist.strip()
+        df = df.reset_index(drop=True)
+
+    print(df['Period'].value_counts())
+
+    return df
 
 
-def fix_name_wiki(artist):
+def image_source(file):
     """
-    Fix the name for WikiArt 
+    Image that goes in the model data for a file -> Its working copy if there is one (see USE_THUMBNAILS)
 
-    :param artist: artist name
+    :param file: File name (e.g. wga_0001.jpg)
 
-    :return: Fixed name
+    :return: path
     """
-    if "Alonzo Cano" in artist:
-        return "Alonso Cano"
-    if "Michelangelo" in artist:
-        return "Michelangelo Buonarroti"
-    return artist
+    db = file[:file.find("_")]
+    if USE_THUMBNAILS and os.path.isfile(image_ingest.thumbnail_path(file, db)):
+        return image_ingest.thumbnail_path(file, db)
+
+    return image_ingest.image_path(file, db)
 
 
-def fix_name_wga(artist):
+def split_files(df):
     """
-    Fix the name for WGA
+    Where every image goes. Only file names - nothing is opened.
 
-    :param artist: artist name
+    Each style is split on its own into Train/Validation/Test - 60/20/20. train_test_split only looks at the # of
+    images so it's the same split as when the images themselves were split.
 
-    :return: Fixed name
+    :param df: Master DataFrame
+
+    :return: Generator of (source path, destination path)
     """
-    comma = artist.find(",")
+    for style, files in df.groupby('Period', sort=False)['file']:
+        files = files.tolist()
+        train, test = train_test_split(files, test_size=.2, random_state=42)
+        train, val = train_test_split(train, test_size=.25, random_state=42)
+
+        for pic_type, pics in [["train", train], ["validation", val], ["test", test]]:
+            for pic, file in enumerate(pics):
+                yield (image_source(file),
+                       os.path.join(MODEL_DATA_DIR, pic_type, style, style + format(pic, '03d') + ".jpg"))
 
-    return " ".join([artist[comma + 1:].strip(), artist[:comma].strip()]) if comma != -1 else artist
 
+def is_jpeg(path):
+    # Go by the bytes and not the extension -> some of the scraped '.jpg's aren't
+    with open(path, 'rb') as file:
+        return file.read(3) == b"\xff\xd8\xff"
 
-def fix_text(text):
+
+def materialise(source, destination, mode=LINK_MODE):
     """
-    By 'fix' I mean deal with encoding, get rid of newlines, convert to uppercase, and strip of leading/trailing 
+    Put one image in the model data. JPEGs are linked/copied as is (never re-encoded). Anything else is converted.
 
-    :param text: Title or Artist name
+    :param source: Path of the scraped image
+    :param destination: Path in the model data
+    :param mode: hardlink, symlink or copy. A hardlink that can't be made (e.g. another drive) is copied instead.
 
-    :return: 'Fixed' text
+    :return: What was done
     """
-    ''.join((c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn'))
-    text = text.replace('\n', '')
-    text = text.upper()
+    if os.path.isfile(destination):
+        return "exists"
+
+    if not is_jpeg(source):
+        with Image.open(source) as img:
+            img.convert('RGB').save(destination, "JPEG", quality=95)
+        return "converted"
+
+    if mode == "hardlink":
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            pass
+    elif mode == "symlink":
+        os.symlink(os.path.abspath(source), destination)
+        return "symlink"
 
-    return text.strip()
+    shutil.copyfile(source, destination)
+    return "copy"
 
 
-def get_data():
+def save_model_data(mode=LINK_MODE, workers=8):
     """
-    Merge All the datasets into one
+    Save all the data used to create the model in the matter I want it
 
-    :return: Master DataFrame
+    The images are linked/copied on a pool of threads. Only a bounded # of them are in flight at once so memory stays
+    the same whatever the size of the corpus.
+
+    :param mode: hardlink, symlink or copy
+    :param workers: # of threads
+
+    :return: Counter of what was done
     """
-    wga_df = pd.read_csv('../../sculpture_data/wga/sculptures/wga_sculpture_periods.csv', index_col=0)
-    wikiart_df = pd.read_csv('../../sculpture_data/wikiart/sculptures/wikiart_sculpture_periods.csv', index_col=0)
-    nga_df = pd.read_csv('../../sculpture_data/nga/sculptures/nga_sculpture_periods.csv', index_col=0)
+    print("Getting the training, validation, and testing sets...")
+    df = get_data()
 
-    ######## Fix name for WGA and WikiaRt ###########
-    wga_df['Author'] = wga_df.apply(lambda x: fix_name_wga(x['Author']), axis=1)
-    wikiart_df['Author'] = wikiart_df.apply(lambda x: fix_name_wiki(x['Author']), axis=1)
-    nga_df['Author'] = nga_df.apply(lambda x: fix_name_nga(x['Author']), axis=1)
+    # The splits won't be the ones in the manifest anymore -> the caches made from them go by the files instead (see
+    # pipeline.split_fingerprint)
+    if os.path.isfile(MANIFEST_FILE):
+        os.remove(MANIFEST_FILE)
 
-    df = pd.concat([wga_df, wikiart_df, nga_df], ignore_index=True, sort=True)
+    # Create dirs if needed
+    for pic_type in ['train', 'validation', 'test']:
+        for style in df['Period'].unique():
+            if not os.path.exists(os.path.join(MODEL_DATA_DIR, pic_type, style)):
+                os.makedirs(os.path.join(MODEL_DATA_DIR, pic_type, style))
 
-    df['Author_Fixed'] = df.apply(lambda x: fix_text(x['Author']), axis=1)
-    df['title_fixed'] = df.apply(lambda x: fix_text(x['title']), axis=1)
+    done = Counter(bounded_map(lambda paths: materialise(*paths, mode), split_files(df), workers))
+    print(dict(done))
 
-    periods = ["BAROQUE", "EARLY RENAISSANCE", "MEDIEVAL", "NEOCLASSICISM", "HIGH RENAISSANCE", "MINIMALISM", "REALISM",
-               "IMPRESSIONISM",
-               "ROCOCO", "SURREALISM",
-               "MANNERISM", "ROMANTICISM",
-               ]
-    df['Period'] = df.apply(lambda row: row['Period'].upper(), axis=1)
+    return done
 
-    # Get Desired Periods
-    df['Period'] = df.apply(lambda x: "SURREALISM" if "SURREALISM" in x['Period'] else x['Period'], axis=1)
-    df = df[(df['Period'].isin(periods))]
-    df = df.sort_values(['Author_Fixed', 'title_fixed'])
 
-    #print("Combined Drop Rows:", df.shape[0] - df.drop_duplicates(subset=['Author_Fixed', 'title_fixed']).shape[0])
+def bounded_map(func, items, workers=8):
+    """
+    Like executor.map on a pool of threads but only 4 * workers items are in flight at once -> memory stays the same
+    however many items there are. Keeps the order.
 
-    df = df.drop_duplicates(subset=['Author_Fixed', 'title_fixed'], keep='last')
+    :param func: Function of one item
+    :param items: Iterable
+    :param workers: # of threads
 
-    # Drop Duplicate Sculptures
-    df = df[~df['file'].isin(DUP_SCULPTURES)].reset_index(drop=True)
+    :return: Generator of results
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 4 * workers:
+                yield pending.popleft().result()
 
-    print(df['Period'].value_counts())
+        while pending:
+            yield pending.popleft().result()
 
-    return df
 
+def file_hash(path):
+    """
+    sha256 of the contents of a file
 
-def save_model_data():
+    :param path: path
+
+    :return: hex digest
     """
-    Save all the data used to create the model in the matter I want it
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
 
-    :return: None
+
+def hash_split(content_hash):
+    """
+    Split an image goes in -> The first 8 hex digits of its hash as a fraction of 16^8 against SPLITS (60/20/20)
+
+    :param content_hash: hex digest
+
+    :return: train, validation, or test
+    """
+    fraction = int(content_hash[:8], 16) / 16 ** 8
+    return next(split for split, upper in SPLITS if fraction < upper)
+
+
+def load_manifest(manifest_file=MANIFEST_FILE):
+    if not os.path.isfile(manifest_file):
+        return pd.DataFrame(columns=["file", "Period", "sha256", "split", "path", "size", "mtime_ns", "source"])
+    return pd.read_csv(manifest_file)
+
+
+def build_model_data(mode=LINK_MODE, workers=8, manifest_file=MANIFEST_FILE):
+    """
+    Incremental version of save_model_data
+
+    Each image goes to {split}/{Period}/{source file name} where the split comes from the hash of its contents. The
+    manifest of the last build says what's there already, so only new/changed images are hashed (going by size &
+    modification time) and written, and anything that's no longer wanted is deleted. The images that are already
+    there never move. An image is written again when the file it comes from changes (see image_source).
+
+    NOTE: The split is not the same as the one from save_model_data (train_test_split)
+
+    :param mode: hardlink, symlink or copy
+    :param workers: # of threads hashing & writing
+    :param manifest_file: Where the manifest is kept
+
+    :return: New manifest
     """
-    print("Getting the training, validation, and testing sets...")
     df = get_data()
+    old = load_manifest(manifest_file)
+    known = {row['file']: row for row in old.to_dict("records")}
+
+    def describe(pic):
+        # Hash of the scraped image decides the split -> Making a working copy later doesn't move it
+        db = pic['file'][:pic['file'].find('_')]
+        source = image_ingest.image_path(pic['file'], db)
+        stat = os.stat(source)
+
+        # Same size & modification time -> Same contents
+        previous = known.get(pic['file'])
+        if previous is not None and (previous['size'], previous['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            content_hash = previous['sha256']
+        else:
+            content_hash = file_hash(source)
+
+        split = hash_split(content_hash)
+        return {"file": pic['file'], "Period": pic['Period'], "sha256": content_hash, "split": split,
+                "path": os.path.join(split, pic['Period'], pic['file']), "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns, "source": image_source(pic['file'])}
+
+    manifest = pd.DataFrame(list(bounded_map(describe, df[['file', 'Period']].to_dict("records"), workers)))
+
+    # Anything in the splits that isn't wanted (anymore), whose contents changed or that comes from another image now
+    # (e.g. its working copy was made since or USE_THUMBNAILS was flipped)
+    wanted = dict(zip(manifest['path'], zip(manifest['sha256'], manifest['source'])))
+    unchanged = {row['path'] for row in known.values()
+                 if wanted.get(row['path']) == (row['sha256'], row.get('source'))}
+    removed = 0
+    for split, _ in SPLITS:
+        for root, _, files in os.walk(os.path.join(MODEL_DATA_DIR, split)):
+            for file in files:
+                path = os.path.relpath(os.path.join(root, file), MODEL_DATA_DIR)
+                if path not in unchanged:
+                    os.remove(os.path.join(MODEL_DATA_DIR, path))
+                    removed += 1
+
+    todo = manifest[~manifest['path'].isin(unchanged)]
+    for directory in todo['path'].map(os.path.dirname).unique():
+        if not os.path.exists(os.path.join(MODEL_DATA_DIR, directory)):
+            os.makedirs(os.path.join(MODEL_DATA_DIR, directory))
+
+    written = Counter(bounded_map(lambda row: materialise(row['source'], os.path.join(MODEL_DATA_DIR, row['path']),
+                                                          mode),
+                                  todo.to_dict("records"), workers))
+
+    manifest.to_csv(manifest_file + ".tmp", index=False)
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+    print(f"{len(manifest) - len(todo)} unchanged, {removed} removed, written: {dict(written)}")
+    print(manifest.groupby(['split']).size().to_dict())
+
+    return manifest
 
-    # First read in & group by type
-    image_styles = {key: [] for key in df['Period'].unique()}
-    for pic in df.to_dict("records"):
-        db = pic['file'][:pic['file'].find("_")]
-        image_styles[pic['Period']].append(Image.open(f"../../sculpture_data/{db}/sculpture_images/{pic['file']}"))
-
-    # Split each type up...not just the whole thing
-    for style in image_styles.keys():
-        # Split into Train/Validation/Test - 60/20/20
-        feats, labels = image_styles[style], [style] * len(image_styles[style])
-        feat_train, feat_test, label_train, label_test = train_test_split(feats, labels, test_size=.2, random_state=42)
-        feat_train, feat_val, label_train, label_val = train_test_split(feat_train, label_train, test_size=.25, random_state=42)
-
-        # Create dirs if needed
-        for pic_type in ['train', 'validation', 'test']:
-            if not os.path.exists(f"../../sculpture_data/model_data/classes_12/{pic_type}/{style}"):
-                os.makedirs(f"../../sculpture_data/model_data/classes_12/{pic_type}/{style}/")
-
-        # Save in train/validation/test folders
-        for style_type_pics in [["train", feat_train], ["validation", feat_val], ["test", feat_test]]:
-            for pic in range(len(style_type_pics[1])):
-                file_name = style + format(pic, '03d') + ".jpg"
-                if not os.path.isfile(f"../../sculpture_data/model_data/classes_12/{style_type_pics[0]}/{style}/{file_name}"):
-                    style_type_pics[1][pic].save(f"../../sculpture_data/model_data/classes_12/{style_type_pics[0]}/{style}/{file_name}")
-
-        print(style)
 
 if __name__ == "__main__":
-    save_model_data()
-    #get_data()
\ No newline at end of file
+    build_model_data()
+    #get_data()
@@ -0,0 +1,130 @@
+"""
+Compare the heads (see helpers.HEADS) on top of the fine-tuned Xception:
+- FLOPs of the head alone (2 per multiply-add)
+- ms per image for the head alone & for the full model (Xception + head)
+- test accuracy & top-k accuracy
+
+Rows:
+- dense_first             -> The original fine-tuned model
+- pool_first (warm start) -> The dense_first weights as is in a pool_first head (no retraining)
+- pool_first              -> After retrain_head.py (skipped if it hasn't been run)
+
+The accuracy comes from the test set features cached by retrain_head.py -> Xception is the same for every row.
+
+python compare_heads.py [--runs 20]
+"""
+import argparse
+import os
+import time
+import numpy as np
+from keras import backend as K
+import bottleneck_features
+import helpers
+import predict_test
+import retrain_head
+
+
+def head_flops(head, feature_shape=(10, 10, 2048), units=128, classes=helpers.CLASSES):
+    """
+    FLOPs of one image through the head
+
+    :param head: dense_first or pool_first
+    :param feature_shape: Shape of the Xception output
+    :param units: # of units in the first dense layer
+    :param classes: # of classes
+
+    :return: int
+    """
+    height, width, channels = feature_shape
+    positions = height * width
+
+    if head == "dense_first":
+        # Dense (+ relu) at every position & then pool the 128 channels
+        flops = positions * (2 * channels * units + 2 * units) + positions * units
+    elif head == "pool_first":
+        # Pool the 2048 channels & then one Dense (+ relu)
+        flops = positions * channels + 2 * channels * units + 2 * units
+    else:
+        raise ValueError(f"Unknown head '{head}'")
+
+    return flops + 2 * units * classes
+
+
+def time_predict(model, x, runs):
+    """
+    Median ms per image
+
+    :return: float
+    """
+    model.predict(x, batch_size=len(x))
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(x, batch_size=len(x))
+        times.append(time.perf_counter() - start)
+
+    return np.median(times) * 1000 / len(x)
+
+
+def compare(head, weights_file, test_features, test_labels, images, runs):
+    """
+    Benchmark one head
+
+    :param head: dense_first or pool_first
+    :param weights_file: Full model weights
+    :param test_features: Cached Xception output of the test set
+    :param test_labels: Class of every test image
+    :param images: Batch of images to time the full model with
+    :param runs: # of times to time each
+
+    :return: dict
+    """
+    model, _, head_model = retrain_head.load(head, weights_file)
+
+    probs = head_model.predict(test_features, batch_size=predict_test.BATCH_SIZE)
+    metrics = predict_test.get_metrics(probs, test_labels)
+
+    results = {"flops": head_flops(head, test_features.shape[1:]), "acc": metrics['acc'],
+               "top_k_acc": metrics['top_k_acc'], "full_ms": time_predict(model, images, runs),
+               "head_ms": time_predict(head_model, test_features[:len(images)], runs)}
+
+    K.clear_session()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the heads of the fine-tuned model")
+    parser.add_argument("--runs", type=int, default=20, help="# of times to time each model")
+    args = parser.parse_args()
+
+    # Makes sure the test features are cached
+    _, base_model, _ = retrain_head.load("dense_first", helpers.WEIGHTS_FILE)
+    stores = retrain_head.cache_features(base_model)
+    K.clear_session()
+
+    features, labels, _ = bottleneck_features.load_features(stores['test'])
+    test_features = np.asarray(features[0], dtype="float32")
+    images, _ = predict_test.test_generator[0]
+
+    rows = [("dense_first", "dense_first", helpers.WEIGHTS_FILE),
+            ("pool_first (warm start)", "pool_first", helpers.WEIGHTS_FILE)]
+    retrained = helpers.head_file_name(helpers.WEIGHTS_FILE, "pool_first")
+    if os.path.exists(retrained):
+        rows.append(("pool_first", "pool_first", retrained))
+    else:
+        print(f"No '{retrained}' -> run retrain_head.py to compare the retrained pool_first head")
+
+    print('{:24s} {:>12s} {:>9s} {:>9s} {:>8s} {:>8s}'.format("Head", "Head FLOPs", "Head ms", "Full ms", "Acc%",
+                                                              f"Top-{predict_test.TOP_K}%"))
+    print("-" * 75)
+    for name, head, weights_file in rows:
+        results = compare(head, weights_file, test_features, labels, images, args.runs)
+        print('{:24s} {:12,d} {:9.3f} {:9.2f} {:7.2f}% {:7.2f}%'.format(
+            name, results['flops'], results['head_ms'], results['full_ms'], results['acc'] * 100,
+            results['top_k_acc'] * 100))
+
+
+if __name__ == "__main__":
+    main()
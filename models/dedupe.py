@@ -0,0 +1,332 @@
+"""
+Find near-duplicate images in the corpus automatically (instead of adding to clean_data.DUP_SCULPTURES by hand).
+
+1. Every image gets a perceptual hash (pHash) and a difference hash (dHash) - 64 bits each. The hashes are computed on
+   a pool of processes & kept in HASH_FILE keyed by file, size & modification time, so only new/changed images are
+   hashed again.
+2. Near-duplicates are pairs whose pHashes are within PHASH_DISTANCE bits and dHashes within DHASH_DISTANCE bits.
+   Pairs are found with a BK-tree on the pHashes -> each image only looks at the part of the tree within range
+   instead of comparing every pair.
+3. Optionally, pairs with a cosine similarity of their embeddings (see embeddings.py) >= EMBEDDING_SIMILARITY count too.
+4. Pairs are merged into clusters (union-find). The keeper of each cluster is the image with the most pixels.
+
+Clusters are written to CLUSTER_FILE. Set clean_data.AUTO_DEDUPE to use this in get_data.
+
+python dedupe.py [--workers 8] [--embeddings]
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from PIL import Image
+import embeddings
+
+DEDUPE_DIR = '../../sculpture_data/dedupe'
+HASH_FILE = os.path.join(DEDUPE_DIR, "hashes.csv")
+CLUSTER_FILE = os.path.join(DEDUPE_DIR, "clusters.csv")
+
+PHASH_DISTANCE = 8
+DHASH_DISTANCE = 12
+EMBEDDING_SIMILARITY = 0.97
+
+HASH_SIZE = 8
+PHASH_SIZE = 32
+
+
+def _dct_matrix(size):
+    # Orthonormal DCT-II -> dct(x) = D @ x
+    k, n = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+    matrix[0] /= np.sqrt(2)
+
+    return matrix
+
+
+DCT = _dct_matrix(PHASH_SIZE)
+
+
+def bits_to_int(bits):
+    return int("".join("1" if bit else "0" for bit in bits.flatten()), 2)
+
+
+def dhash(img):
+    """
+    Difference hash -> Is each pixel brighter than the one to its right (on a 9x8 grayscale version)
+
+    :param img: PIL image
+
+    :return: 64 bit int
+    """
+    pixels = np.asarray(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype="float32")
+    return bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(img):
+    """
+    Perceptual hash -> Is each of the 8x8 lowest frequencies of the DCT (of a 32x32 grayscale version) above their
+    median
+
+    :param img: PIL image
+
+    :return: 64 bit int
+    """
+    pixels = np.asarray(img.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype="float32")
+    low = (DCT @ pixels @ DCT.T)[:HASH_SIZE, :HASH_SIZE]
+
+    # DC term is just the overall brightness -> not used for the median
+    return bits_to_int(low > np.median(low.flatten()[1:]))
+
+
+def hash_image(path):
+    """
+    Hash one image. Errors are returned instead of raised so one bad file doesn't stop everything.
+
+    :param path: Path of image
+
+    :return: dict of phash, dhash, width, height (or the exception)
+    """
+    try:
+        with Image.open(path) as img:
+            # Hashes only need a small image -> let the decoder skip most of the work for jpegs
+            width, height = img.size
+            img.draft("L", (PHASH_SIZE * 2, PHASH_SIZE * 2))
+            img = img.convert("L")
+            return {"phash": phash(img), "dhash": dhash(img), "width": width, "height": height}
+    except Exception as e:
+        return e
+
+
+def load_hashes(hash_file=HASH_FILE):
+    if not os.path.isfile(hash_file):
+        return pd.DataFrame(columns=["file", "size", "mtime_ns", "phash", "dhash", "width", "height"])
+
+    # Hashes are stored as hex -> 64 bit ints don't fit in pandas' int64
+    hashes = pd.read_csv(hash_file)
+    for column in ["phash", "dhash"]:
+        hashes[column] = hashes[column].apply(lambda x: int(x, 16))
+
+    return hashes
+
+
+def save_hashes(hashes, hash_file=HASH_FILE):
+    if not os.path.exists(os.path.dirname(hash_file)):
+        os.makedirs(os.path.dirname(hash_file))
+
+    hashes = hashes.copy()
+    for column in ["phash", "dhash"]:
+        hashes[column] = hashes[column].apply(lambda x: format(x, "016x"))
+
+    # Write somewhere else & move it over -> never a half written file
+    hashes.to_csv(hash_file + ".tmp", index=False)
+    os.replace(hash_file + ".tmp", hash_file)
+
+
+def update_hashes(files, hash_file=HASH_FILE, workers=None):
+    """
+    Hash every image that's new or changed since the last time
+
+    :param files: File names in the corpus (e.g. wga_0001.jpg)
+    :param hash_file: Where the hashes are kept
+    :param workers: # of processes. Default -> # of cpus
+
+    :return: DataFrame of the hashes for the given files
+    """
+    hashes = load_hashes(hash_file)
+    known = {row['file']: (row['size'], row['mtime_ns'])
+             for row in hashes[["file", "size", "mtime_ns"]].to_dict("records")}
+
+    todo, stats = [], {}
+    for file in files:
+        try:
+            stat = os.stat(embeddings.image_path(file))
+        except OSError:
+            print(f"Missing {file}")
+            continue
+
+        stats[file] = (stat.st_size, stat.st_mtime_ns)
+        if known.get(file) != stats[file]:
+            todo.append(file)
+
+    print(f"Hashing {len(todo)} new/changed of {len(stats)} images")
+
+    new_rows = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            paths = [embeddings.image_path(file) for file in todo]
+            for file, result in zip(todo, executor.map(hash_image, paths, chunksize=32)):
+                if isinstance(result, Exception):
+                    print(f"Couldn't hash {file}: {result}")
+                    continue
+                new_rows.append(dict(result, file=file, size=stats[file][0], mtime_ns=stats[file][1]))
+
+    if new_rows:
+        hashes = hashes[~hashes['file'].isin([row['file'] for row in new_rows])]
+        hashes = pd.concat([hashes, pd.DataFrame(new_rows)], ignore_index=True, sort=False)
+        save_hashes(hashes, hash_file)
+
+    return hashes[hashes['file'].isin(list(stats))].reset_index(drop=True)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over hamming distance. Every child of a node is keyed by its distance to the node, so a
+    search for everything within d of x only has to go down the children whose key is within d of dist(x, node).
+    """
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            if distance not in current[2]:
+                current[2][distance] = node
+                return
+            current = current[2][distance]
+
+    def search(self, value, max_distance):
+        """
+        :return: List of (distance, item) within max_distance of value
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.append((distance, item))
+
+            stack.extend(child for key, child in children.items() if abs(key - distance) <= max_distance)
+
+        return found
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+
+def hash_pairs(hashes, phash_distance=PHASH_DISTANCE, dhash_distance=DHASH_DISTANCE):
+    """
+    Every pair of rows close enough on both hashes
+
+    :return: List of (row, row)
+    """
+    tree = BKTree()
+    for row, value in enumerate(hashes['phash']):
+        tree.add(value, row)
+
+    dhashes = hashes['dhash'].tolist()
+    pairs = []
+    for row, value in enumerate(hashes['phash']):
+        for _, other in tree.search(value, phash_distance):
+            if other > row and hamming(dhashes[row], dhashes[other]) <= dhash_distance:
+                pairs.append((row, other))
+
+    return pairs
+
+
+def embedding_pairs(files, min_similarity=EMBEDDING_SIMILARITY, k=10):
+    """
+    Every pair of images whose embeddings are at least min_similarity (only the k most similar to each are checked)
+
+    :param files: Files in the order of the rows
+    :param min_similarity: Cosine similarity
+
+    :return: List of (row, row)
+    """
+    index = embeddings.EmbeddingIndex()
+    rows = {file: row for row, file in enumerate(files)}
+    present = [file for file in files if file in index.positions]
+
+    positions, scores = index.search(index.embeddings[[index.positions[file] for file in present]], k + 1)
+
+    pairs = []
+    for file, row_positions, row_scores in zip(present, positions, scores):
+        for position, score in zip(row_positions, row_scores):
+            other = index.index['file'].iat[position]
+            if score >= min_similarity and other != file and other in rows:
+                pairs.append((rows[file], rows[other]))
+
+    return pairs
+
+
+def find_clusters(files, workers=None, use_embeddings=False):
+    """
+    Hash (incrementally) & cluster the near-duplicates among some files
+
+    :param files: File names in the corpus
+    :param workers: # of processes hashing
+    :param use_embeddings: Also use the embeddings from embeddings.py
+
+    :return: DataFrame - file, cluster, keeper, width, height. Only images with at least one duplicate are in it.
+    """
+    hashes = update_hashes(files, workers=workers)
+
+    pairs = hash_pairs(hashes)
+    if use_embeddings:
+        pairs += embedding_pairs(hashes['file'].tolist())
+
+    union_find = UnionFind(len(hashes))
+    for a, b in pairs:
+        union_find.union(a, b)
+
+    hashes['cluster'] = [union_find.find(row) for row in range(len(hashes))]
+    clusters = hashes[hashes.groupby('cluster')['file'].transform('count') > 1].copy()
+
+    # Keep the biggest image. Ties -> first file name
+    clusters['pixels'] = clusters['width'] * clusters['height']
+    clusters = clusters.sort_values(['cluster', 'pixels', 'file'], ascending=[True, False, True])
+    clusters['keeper'] = ~clusters.duplicated('cluster')
+    clusters['cluster'] = clusters.groupby('cluster', sort=False).ngroup()
+
+    return clusters[['cluster', 'file', 'keeper', 'width', 'height']].reset_index(drop=True)
+
+
+def duplicates(files, workers=None, use_embeddings=False):
+    """
+    Everything that should be dropped from some files -> All but the keeper of each cluster
+
+    :return: set of files
+    """
+    clusters = find_clusters(files, workers, use_embeddings)
+    return set(clusters.loc[~clusters['keeper'], 'file'])
+
+
+def main():
+    import clean_data
+
+    parser = argparse.ArgumentParser(description="Find near-duplicate images in the corpus")
+    parser.add_argument("--workers", type=int, default=None, help="# of processes hashing. Default -> # of cpus")
+    parser.add_argument("--embeddings", action="store_true", help="Also use the embeddings from embeddings.py")
+    args = parser.parse_args()
+
+    # Every image before DUP_SCULPTURES/the near-duplicates are dropped
+    files = clean_data.get_data(dedupe=False)['file'].tolist()
+    clusters = find_clusters(files, args.workers, args.embeddings)
+
+    clusters.to_csv(CLUSTER_FILE, index=False)
+    print(f"{clusters['cluster'].nunique()} clusters, {(~clusters['keeper']).sum()} duplicates -> '{CLUSTER_FILE}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Embed every sculpture in the corpus (clean_data.get_data) with the fine-tuned model & search them for similar ones.
+
+The embedding of an image is the 128-d activation right before the Dropout of the head (the penultimate layer). The
+store is a directory with:
+- embeddings.npy -> (# images, 128) float32 - Read back memory mapped
+- index.csv      -> Row i is the file/author/title/period of row i of embeddings.npy
+- meta.json      -> Weights & head used. Only written once everything else is done.
+
+Searching:
+- EmbeddingIndex -> Exact cosine top-k. One matrix product for a whole batch of queries. Plenty for ~4k images.
+- IVFPQIndex     -> Approximate. For corpora way bigger than ours. Only the few closest clusters are searched and the
+                    vectors are compressed to a few bytes each (product quantization). Optionally re-ranked exactly.
+
+python embeddings.py extract [--batch-size 32]
+python embeddings.py query <file in the corpus or image> [--k 10] [--ivfpq]
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+EMBEDDING_DIR = '../../sculpture_data/embeddings'
+IMAGE_DIR = '../../sculpture_data/{db}/sculpture_images'
+INDEX_COLUMNS = ['file', 'Author_Fixed', 'title_fixed', 'Period']
+
+
+def store_files(store_dir):
+    """
+    :return: embeddings, index, meta & ivfpq file
+    """
+    return (os.path.join(store_dir, "embeddings.npy"), os.path.join(store_dir, "index.csv"),
+            os.path.join(store_dir, "meta.json"), os.path.join(store_dir, "ivfpq.npz"))
+
+
+def image_path(file):
+    """
+    Where an image from the corpus is -> db is the bit of the name before the '_'
+
+    :param file: e.g. wga_0001.jpg
+
+    :return: path
+    """
+    return os.path.join(IMAGE_DIR.format(db=file[:file.find("_")]), file)
+
+
+def embedding_model(model):
+    """
+    Model from the same input to the input of the head's Dropout
+
+    :param model: Full keras model (any head)
+
+    :return: model
+    """
+    from keras import layers
+    from keras import models
+
+    dropout = [layer for layer in model.layers if isinstance(layer, layers.Dropout)][-1]
+    return models.Model(inputs=model.input, outputs=dropout.input)
+
+
+def extract(store_dir=EMBEDDING_DIR, weights_file=None, batch_size=32, workers=4):
+    """
+    Embed every image in the corpus & write the store
+
+    :param store_dir: Directory for the store
+    :param weights_file: Fine-tuned weights. Default -> helpers.WEIGHTS_FILE for helpers.HEAD
+    :param batch_size: # of images through the model at once
+    :param workers: # of threads decoding images
+
+    :return: None
+    """
+    import clean_data
+    import helpers
+    import predict_image
+
+    weights_file = weights_file or helpers.head_file_name(helpers.WEIGHTS_FILE)
+    model = embedding_model(predict_image.create_model(weights_file))
+
+    df = clean_data.get_data()[INDEX_COLUMNS].reset_index(drop=True)
+
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    embeddings_file, index_file, meta_file, _ = store_files(store_dir)
+    if os.path.isfile(meta_file):
+        os.remove(meta_file)
+
+    embeddings = np.lib.format.open_memmap(embeddings_file, mode="w+", dtype="float32",
+                                           shape=(len(df), model.output_shape[-1]))
+    ok = np.zeros(len(df), dtype=bool)
+
+    # Same as predict_image.predict_batches -> decode on threads, predict in batches
+    paths = [image_path(file) for file in df['file']]
+    rows, batch = [], []
+    for row, (path, img) in enumerate(predict_image.decode_stream(paths, workers, queue_size=4 * batch_size)):
+        if isinstance(img, Exception):
+            print(f"Skipping {path}: {img}", file=sys.stderr)
+        else:
+            rows.append(row)
+            batch.append(img)
+
+        if len(batch) == batch_size or (row == len(paths) - 1 and batch):
+            embeddings[rows] = model.predict(np.stack(batch), batch_size=len(batch))
+            ok[rows] = True
+            rows, batch = [], []
+
+    embeddings.flush()
+    del embeddings
+
+    # Images that couldn't be read stay in the index (so rows line up) but are never returned
+    df['ok'] = ok
+    df.to_csv(index_file, index=False)
+
+    with open(meta_file, "w+") as file:
+        json.dump({"weights": os.path.abspath(weights_file), "head": helpers.HEAD, "images": int(ok.sum())}, file)
+
+    print(f"Embedded {ok.sum()} of {len(df)} images into '{store_dir}'")
+
+
+def normalize(x):
+    """
+    Scale every row to unit length -> dot products are then cosine similarities
+    """
+    x = np.asarray(x, dtype="float32")
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def top_k(scores, k):
+    """
+    Positions & scores of the k highest scores in each row, highest first. Only the top k get sorted.
+
+    :param scores: (# queries, # candidates) array
+    :param k: # to keep
+
+    :return: positions, scores
+    """
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+class EmbeddingIndex:
+    """
+    Exact cosine similarity search over the store. The normalized embeddings are kept in memory (~0.5KB per image).
+    """
+    def __init__(self, store_dir=EMBEDDING_DIR):
+        embeddings_file, index_file, meta_file, _ = store_files(store_dir)
+        if not os.path.isfile(meta_file):
+            raise Exception(f"No finished embeddings in '{store_dir}'. Run 'embeddings.py extract' first.")
+
+        with open(meta_file, 'r') as file:
+            self.meta = json.load(file)
+
+        index = pd.read_csv(index_file)
+        self.rows = np.flatnonzero(index['ok'].values)
+        self.index = index.iloc[self.rows].reset_index(drop=True)
+        self.embeddings = normalize(np.load(embeddings_file, mmap_mode='r')[self.rows])
+        self.positions = {file: pos for pos, file in enumerate(self.index['file'])}
+
+    def search(self, queries, k=10):
+        """
+        Most similar images for a batch of embeddings
+
+        :param queries: (# queries, 128) array
+        :param k: # of results for each
+
+        :return: positions in self.index, cosine similarities -> both (# queries, k)
+        """
+        return top_k(normalize(np.atleast_2d(queries)) @ self.embeddings.T, k)
+
+    def similar(self, files, k=10):
+        """
+        Most similar images to some images already in the corpus. An image isn't returned as similar to itself.
+
+        :param files: List of file names (e.g. wga_0001.jpg)
+        :param k: # of results for each
+
+        :return: List of DataFrames (self.index rows + a 'similarity' column)
+        """
+        queries = self.embeddings[[self.positions[file] for file in files]]
+        positions, scores = self.search(queries, k + 1)
+
+        results = []
+        for file, row_positions, row_scores in zip(files, positions, scores):
+            keep = row_positions != self.positions[file]
+            results.append(self.results(row_positions[keep][:k], row_scores[keep][:k]))
+
+        return results
+
+    def results(self, positions, scores):
+        return self.index.iloc[positions].assign(similarity=scores).reset_index(drop=True)
+
+
+def kmeans(x, num_clusters, iterations=20, seed=42):
+    """
+    Plain k-means (Lloyd's)
+
+    :param x: (# points, dim) array
+    :param num_clusters: k
+    :param iterations: # of iterations
+    :param seed: seed for the starting centroids
+
+    :return: (num_clusters, dim) centroids, cluster of each point
+    """
+    random_state = np.random.RandomState(seed)
+    centroids = x[random_state.choice(len(x), num_clusters, replace=len(x) < num_clusters)].copy()
+
+    for _ in range(iterations):
+        assignments = nearest(x, centroids)
+        for cluster in range(num_clusters):
+            members = x[assignments == cluster]
+            # Empty cluster -> restart it at a random point
+            centroids[cluster] = members.mean(axis=0) if len(members) else x[random_state.randint(len(x))]
+
+    return centroids, nearest(x, centroids)
+
+
+def nearest(x, centroids):
+    # |x - c|^2 = |x|^2 - 2x.c + |c|^2 -> |x|^2 doesn't change the argmin
+    return np.argmin((centroids ** 2).sum(axis=1) - 2 * x @ centroids.T, axis=1)
+
+
+class IVFPQIndex:
+    """
+    Approximate cosine search - inverted file (IVF) w/ product quantization (PQ)
+
+    - The normalized embeddings are split into num_lists clusters. A query only looks at the nprobe closest ones.
+    - What's left after subtracting the cluster center is cut into num_subvectors pieces and each piece is replaced
+      by the closest of 256 centroids -> 1 byte per piece.
+    - Distances to the compressed vectors come from a small table per query (asymmetric distance), and the best
+      'rerank' of those can be re-scored exactly with the full (normalized) embeddings.
+    """
+    def __init__(self, coarse, codebooks, codes, lists, rows, embeddings=None):
+        self.coarse = coarse
+        self.codebooks = codebooks
+        self.codes = codes
+        self.lists = lists
+        self.rows = rows
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, embeddings, num_lists=64, num_subvectors=16, num_centroids=256, seed=42):
+        """
+        :param embeddings: (# images, dim) normalized array
+        :param num_lists: # of clusters in the inverted file
+        :param num_subvectors: # of pieces each vector is cut into. Has to divide dim.
+        :param num_centroids: # of centroids for each piece (<= 256 so a code is 1 byte)
+        :param seed: seed for k-means
+
+        :return: IVFPQIndex
+        """
+        num_lists = min(num_lists, len(embeddings))
+        coarse, assignments = kmeans(embeddings, num_lists, seed=seed)
+        residuals = embeddings - coarse[assignments]
+
+        pieces = np.split(residuals, num_subvectors, axis=1)
+        codebooks, codes = [], []
+        for piece in pieces:
+            codebook, code = kmeans(piece, min(num_centroids, len(embeddings)), seed=seed)
+            codebooks.append(codebook)
+            codes.append(code.astype("uint8"))
+
+        # Rows sorted by cluster -> each list is a contiguous slice
+        order = np.argsort(assignments, kind="stable")
+        lists = np.searchsorted(assignments[order], np.arange(num_lists + 1))
+
+        return cls(coarse, np.stack(codebooks), np.stack(codes, axis=1)[order], lists, order)
+
+    def save(self, file):
+        np.savez(file, coarse=self.coarse, codebooks=self.codebooks, codes=self.codes, lists=self.lists,
+                 rows=self.rows)
+
+    @classmethod
+    def load(cls, file, embeddings=None):
+        data = np.load(file)
+        return cls(data['coarse'], data['codebooks'], data['codes'], data['lists'], data['rows'], embeddings)
+
+    def search(self, queries, k=10, nprobe=8, rerank=100):
+        """
+        :param queries: (# queries, dim) array
+        :param k: # of results for each
+        :param nprobe: # of clusters to look in
+        :param rerank: # of best approximate results to re-score exactly (needs the embeddings). 0 -> Don't
+
+        :return: rows of the embeddings, cosine similarities -> both (# queries, k). Padded with -1 if there are less
+                 than k in the clusters looked at.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        num_subvectors, _, sub_dim = self.codebooks.shape
+        probes = top_k(queries @ self.coarse.T, nprobe)[0]
+
+        all_rows = np.full((len(queries), k), -1)
+        all_scores = np.full((len(queries), k), -np.inf, dtype="float32")
+        for query_num, (query, query_probes) in enumerate(zip(queries, probes)):
+            # query . (center + residual) -> query . center + a lookup in this table for every piece of the residual
+            table = np.einsum("sd,scd->sc", query.reshape(num_subvectors, sub_dim), self.codebooks)
+
+            candidates, scores = [], []
+            for cluster in query_probes:
+                start, end = self.lists[cluster], self.lists[cluster + 1]
+                if start == end:
+                    continue
+
+                codes = self.codes[start:end]
+                scores.append(query @ self.coarse[cluster] + table[np.arange(num_subvectors), codes].sum(axis=1))
+                candidates.append(self.rows[start:end])
+
+            if not candidates:
+                continue
+
+            candidates, scores = np.concatenate(candidates), np.concatenate(scores)
+            if rerank and self.embeddings is not None:
+                candidates = candidates[top_k(scores[None], rerank)[0][0]]
+                scores = self.embeddings[candidates] @ query
+
+            best, best_scores = top_k(scores[None], k)
+            all_rows[query_num, :best.shape[1]] = candidates[best[0]]
+            all_scores[query_num, :best.shape[1]] = best_scores[0]
+
+        return all_rows, all_scores
+
+
+def build_ivfpq(store_dir=EMBEDDING_DIR, **kwargs):
+    """
+    Build & save the approximate index for a store
+
+    :return: IVFPQIndex
+    """
+    index = EmbeddingIndex(store_dir)
+    ivfpq = IVFPQIndex.build(index.embeddings, **kwargs)
+    ivfpq.embeddings = index.embeddings
+    ivfpq.save(store_files(store_dir)[3])
+
+    return ivfpq
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed the corpus & find similar sculptures")
+    subparsers = parser.add_subparsers(dest="command")
+
+    extract_parser = subparsers.add_parser("extract")
+    extract_parser.add_argument("--batch-size", type=int, default=32)
+    extract_parser.add_argument("--weights", default=None)
+    extract_parser.add_argument("--ivfpq", action="store_true", help="Also build the approximate index")
+
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("query", help="File name in the corpus (e.g. wga_0001.jpg) or path of any image")
+    query_parser.add_argument("--k", type=int, default=10)
+    query_parser.add_argument("--ivfpq", action="store_true", help="Use the approximate index")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        extract(weights_file=args.weights, batch_size=args.batch_size)
+        if args.ivfpq:
+            build_ivfpq()
+        return
+    elif args.command != "query":
+        parser.print_help()
+        return
+
+    index = EmbeddingIndex()
+    if args.query in index.positions and not args.ivfpq:
+        print(index.similar([args.query], args.k)[0].to_string())
+        return
+
+    if args.query in index.positions:
+        query = index.embeddings[index.positions[args.query]]
+    else:
+        import predict_image
+        model = embedding_model(predict_image.create_model(index.meta['weights']))
+        query = model.predict(predict_image.load(args.query))[0]
+
+    if args.ivfpq:
+        ivfpq_file = store_files(EMBEDDING_DIR)[3]
+        ivfpq = IVFPQIndex.load(ivfpq_file, index.embeddings) if os.path.isfile(ivfpq_file) else build_ivfpq()
+        positions, scores = ivfpq.search(query, args.k)
+    else:
+        positions, scores = index.search(query, args.k)
+
+    print(index.results(positions[0][positions[0] >= 0], scores[0][positions[0] >= 0]).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Export the fine-tuned model to a single inference ready file -> A frozen GraphDef with the weights folded in as
+constants and nothing used only for training (Dropout, the learning phase switch, BatchNorm updates...).
+
+Load it with frozen_model.FrozenModel.
+
+python export_model.py [weights file] [frozen file]
+"""
+import json
+import sys
+import tensorflow as tf
+from keras import backend as K
+import frozen_model
+import helpers
+
+
+def export(weights_file=None, frozen_file=frozen_model.FROZEN_FILE):
+    """
+    Build the model in inference mode, load the weights, and freeze it
+
+    :param weights_file: Weights of the fine-tuned model. Default -> helpers.WEIGHTS_FILE for the head (helpers.HEAD)
+    :param frozen_file: Where to put the frozen graph. The input/output names go in frozen_file + '.json'.
+
+    :return: None
+    """
+    # Has to be set before the model is built -> Dropout is then left out of the graph entirely and BatchNorm only
+    # has the inference branch
+    K.set_learning_phase(0)
+    weights_file = weights_file or helpers.head_file_name(helpers.WEIGHTS_FILE)
+
+    from predict_image import create_model
+    model = create_model(weights_file)
+
+    session = K.get_session()
+    graph_def = tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(),
+                                                             [model.output.op.name])
+    graph_def = tf.graph_util.remove_training_nodes(graph_def)
+
+    with open(frozen_file, 'wb') as file:
+        file.write(graph_def.SerializeToString())
+
+    with open(frozen_model.meta_file(frozen_file), "w+") as file:
+        json.dump({"input": model.input.name, "output": model.output.name, "weights": weights_file}, file)
+
+    print(f"Exported '{weights_file}' to '{frozen_file}' ({len(graph_def.node)} nodes)")
+
+
+if __name__ == "__main__":
+    export(*sys.argv[1:3])
@@ -0,0 +1,113 @@
+"""
+Convert the frozen graph from export_model.py to TFLite for CPU inference. One file for each quantization:
+- float32 -> Plain conversion
+- float16 -> Weights stored as float16 (half the size). Run in float32 on CPU.
+- int8    -> Post-training quantization of the weights & activations. The ranges of the activations come from running
+             a random sample of classes_12/train through the model (calibration).
+
+Run them with backends.TFLiteModel (or --backend tflite in predict_image.py/predict_test.py).
+
+python export_tflite.py [--quantize float32 float16 int8] [--calibration 200]
+"""
+import argparse
+import json
+import os
+import numpy as np
+import tensorflow as tf
+import backends
+import frozen_model
+import pipeline
+
+CALIBRATION_IMAGES = 200
+
+
+def calibration_data(num_images=CALIBRATION_IMAGES, seed=42):
+    """
+    Random sample of the training images, preprocessed like at test time
+
+    :param num_images: # of images
+    :param seed: seed for the sample
+
+    :return: Generator of [(1, 299, 299, 3) array]
+    """
+    train_dir = os.path.join(pipeline.DATA_DIR, "train")
+    filenames, _, _ = pipeline.list_images(train_dir)
+    sample = np.random.RandomState(seed).permutation(len(filenames))[:num_images]
+
+    for index in sample:
+        yield [frozen_model.load_image(os.path.join(train_dir, filenames[index]))]
+
+
+def make_converter(frozen_file):
+    """
+    Converter for the frozen graph. Uses whatever this version of tensorflow has.
+
+    :param frozen_file: File from export_model.py
+
+    :return: converter
+    """
+    with open(frozen_model.meta_file(frozen_file), 'r') as file:
+        meta = json.load(file)
+
+    # Converter wants op names & a fixed input shape. TFLiteModel resizes the batch dimension later.
+    input_name, output_name = meta['input'].split(":")[0], meta['output'].split(":")[0]
+    lite = backends.lite_module()
+    converter_class = getattr(lite, "TFLiteConverter", None) or lite.TocoConverter
+
+    return converter_class.from_frozen_graph(frozen_file, [input_name], [output_name],
+                                             input_shapes={input_name: [1, 299, 299, 3]})
+
+
+def convert(quantization, frozen_file=frozen_model.FROZEN_FILE, num_calibration=CALIBRATION_IMAGES):
+    """
+    Convert & save one quantization
+
+    :param quantization: float32, float16 or int8
+    :param frozen_file: File from export_model.py
+    :param num_calibration: # of images to calibrate the int8 ranges with
+
+    :return: Path of tflite file
+    """
+    converter = make_converter(frozen_file)
+    lite = backends.lite_module()
+
+    if quantization == "float16":
+        if not hasattr(lite, "Optimize"):
+            raise RuntimeError(f"float16 quantization needs tensorflow >= 1.14 (have {tf.__version__})")
+        converter.optimizations = [lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if hasattr(converter, "representative_dataset"):
+            converter.optimizations = [lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: calibration_data(num_calibration)
+        elif hasattr(converter, "post_training_quantize"):
+            # 1.11 - 1.13 -> No calibration, so only the weights are int8
+            print(f"Tensorflow {tf.__version__} can't calibrate -> only quantizing the weights")
+            converter.post_training_quantize = True
+        else:
+            raise RuntimeError(f"int8 quantization needs tensorflow >= 1.11 (have {tf.__version__})")
+    elif quantization != "float32":
+        raise ValueError(f"Unknown quantization '{quantization}'")
+
+    output_file = backends.tflite_file(quantization)
+    with open(output_file, 'wb') as file:
+        file.write(converter.convert())
+
+    print(f"Exported '{frozen_file}' to '{output_file}' ({os.path.getsize(output_file) / 2 ** 20:.1f} MB)")
+
+    return output_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the frozen model to TFLite")
+    parser.add_argument("--quantize", nargs="+", choices=backends.QUANTIZATIONS, default=backends.QUANTIZATIONS)
+    parser.add_argument("--frozen", default=frozen_model.FROZEN_FILE, help="File from export_model.py")
+    parser.add_argument("--calibration", type=int, default=CALIBRATION_IMAGES, help="# of images for int8")
+    args = parser.parse_args()
+
+    for quantization in args.quantize:
+        convert(quantization, args.frozen, args.calibration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Load & run the frozen (inference only) version of the fine-tuned model made by export_model.py.
+
+This purposely doesn't touch keras. Importing keras and building the Xception graph layer by layer before loading the
+weights is most of the start up time for predict_image. Here it's just reading one GraphDef (with the weights folded
+in as constants) into a session.
+"""
+import json
+import numpy as np
+from PIL import Image
+import tensorflow as tf
+
+FROZEN_FILE = "../models/xception_finetune_12_reg_75_block4.pb"
+
+
+def meta_file(frozen_file):
+    return frozen_file + ".json"
+
+
+def load_image(filename):
+    """
+    Same as predict_image.load without needing keras -> (1, 299, 299, 3) float32 in [0, 1]
+
+    :param filename: Path of image
+
+    :return: Rank 4 tensor
+    """
+    img = Image.open(filename).convert('RGB')
+
+    # keras.preprocessing.image.load_img resizes with nearest by default
+    if img.size != (299, 299):
+        img = img.resize((299, 299), Image.NEAREST)
+
+    return np.expand_dims(np.asarray(img, dtype='float32') / 255, axis=0)
+
+
+class FrozenModel:
+    """
+    Wrap the frozen graph so it can be used like the keras model (just predict)
+    """
+    def __init__(self, frozen_file=FROZEN_FILE, config=None):
+        with open(meta_file(frozen_file), 'r') as file:
+            self.meta = json.load(file)
+
+        graph_def = tf.GraphDef()
+        with open(frozen_file, 'rb') as file:
+            graph_def.ParseFromString(file.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+
+        self.session = tf.Session(graph=self.graph, config=config)
+        self.input = self.graph.get_tensor_by_name(self.meta['input'])
+        self.output = self.graph.get_tensor_by_name(self.meta['output'])
+
+    def predict(self, x, batch_size=None):
+        """
+        Get the class probabilities
+
+        :param x: (# images, 299, 299, 3) array
+        :param batch_size: Run in chunks of this size. Default -> all at once
+
+        :return: (# images, # classes) array
+        """
+        batch_size = batch_size or len(x)
+
+        return np.concatenate([self.session.run(self.output, {self.input: x[start:start + batch_size]})
+                               for start in range(0, len(x), batch_size)])
+
+    def close(self):
+        self.session.close()
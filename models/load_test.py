@@ -0,0 +1,90 @@
+"""
+Load generator for serve.py. Sends the same image from a bunch of threads at once and reports the throughput and
+latency percentiles.
+
+python load_test.py [image] [--url http://127.0.0.1:8000/predict] [--requests 500] [--concurrency 16]
+"""
+import argparse
+import os
+import threading
+import time
+import urllib.request
+import numpy as np
+
+FILE_PATH = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_IMAGE = os.path.join(FILE_PATH, "../../", "examples", "BAROQUE.jpg")
+
+
+def send(url, body):
+    """
+    Send one image
+
+    :return: latency in seconds
+    """
+    start = time.perf_counter()
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+    return time.perf_counter() - start
+
+
+def run(url, body, num_requests, concurrency):
+    """
+    Send num_requests requests from 'concurrency' threads
+
+    :return: latencies, # of errors, total seconds
+    """
+    latencies, errors = [], []
+    counter = iter(range(num_requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            try:
+                latency = send(url, body)
+                with lock:
+                    latencies.append(latency)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, len(errors), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the prediction server")
+    parser.add_argument("image", nargs="?", default=DEFAULT_IMAGE)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/predict")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10, help="# of requests sent first & not counted")
+    args = parser.parse_args()
+
+    with open(args.image, 'rb') as file:
+        body = file.read()
+
+    run(args.url, body, args.warmup, min(args.concurrency, args.warmup) or 1)
+    latencies, errors, seconds = run(args.url, body, args.requests, args.concurrency)
+
+    latencies = np.array(latencies) * 1000
+    print(f"Requests:    {len(latencies)} ok, {errors} errors")
+    print(f"Concurrency: {args.concurrency}")
+    print(f"Throughput:  {len(latencies) / seconds:.1f} req/s")
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"Latency:     p50 {p50:.1f}ms | p95 {p95:.1f}ms | p99 {p99:.1f}ms | max {latencies.max():.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Sequence based loaders for training/testing. These replace the flow_from_directory iterators so that keras can spread
+the decoding & augmentation over a pool of processes (fit_generator with workers/use_multiprocessing) and keep a
+bounded # of batches ready ahead of the model (max_queue_size).
+
+Everything random about an epoch (the order of the images & how each image is transformed) comes from the seed and
+the epoch # alone. Batch i is the same no matter which worker makes it or how many workers there are.
+
+NOTE: Pass shuffle=False to fit_generator when using these. Keras would otherwise shuffle the batch order itself
+with an un-seeded RNG. The sequences already shuffle the images.
+"""
+import csv
+import hashlib
+import os
+import numpy as np
+from keras.preprocessing import image
+from keras.utils import OrderedEnqueuer, Sequence, to_categorical
+import helpers
+
+DATA_DIR = '../../sculpture_data/model_data/classes_12'
+
+# Written next to the splits by clean_data.build_model_data
+MANIFEST_NAME = "manifest.csv"
+
+# Same as flow_from_directory
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'bmp', 'ppm', 'tif', 'tiff')
+
+
+def list_images(directory):
+    """
+    Get every image in the directory along with its class. Ordered the same way flow_from_directory orders them.
+
+    :param directory: Directory w/ a sub-directory for each class
+
+    :return: filenames (relative to directory), labels, class_indices
+    """
+    class_names = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    class_indices = {name: index for index, name in enumerate(class_names)}
+
+    filenames, labels = [], []
+    for class_name in class_names:
+        for root, _, files in sorted(os.walk(os.path.join(directory, class_name))):
+            for file in sorted(files):
+                if file.lower().endswith(IMAGE_EXTENSIONS):
+                    filenames.append(os.path.relpath(os.path.join(root, file), directory))
+                    labels.append(class_indices[class_name])
+
+    return filenames, labels, class_indices
+
+
+def split_fingerprint(directory):
+    """
+    Hash of what's in a split -> The caches made from a split (features, shards) are only valid for the same one.
+
+    Comes from the rows of the manifest for the split (see clean_data.build_model_data) -> changes when an image is
+    added, removed, its contents change or it's swapped for its working copy. W/o a manifest (e.g. save_model_data)
+    it's the name, size & modification time of every image instead.
+
+    :param directory: Directory of one split (e.g. DATA_DIR/train)
+
+    :return: hex digest
+    """
+    directory = os.path.normpath(directory)
+    manifest_file = os.path.join(os.path.dirname(directory), MANIFEST_NAME)
+    split = os.path.basename(directory)
+
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, newline="") as file:
+            rows = sorted((row['path'], row['sha256'], row.get('source') or "")
+                          for row in csv.DictReader(file) if row['split'] == split)
+    else:
+        filenames, _, _ = list_images(directory)
+        rows = []
+        for filename in filenames:
+            stat = os.stat(os.path.join(directory, filename))
+            rows.append((filename, str(stat.st_size), str(stat.st_mtime_ns)))
+
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(("\t".join(row) + "\n").encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+class AugmentedSequence(Sequence):
+    """
+    Base for the loaders. Sub-classes just need to say how to load the raw images for some positions (load).
+
+    The images go through the given ImageDataGenerator the same way flow_from_directory does it - random transform
+    and then standardize. Has the same attributes as the directory iterator (n, classes, filenames, class_indices,
+    reset) so it can be used anywhere the iterator was.
+    """
+    def __init__(self, filenames, classes, class_indices, image_data_generator, batch_size, shuffle=False, seed=42):
+        self.filenames = filenames
+        self.classes = np.array(classes, dtype="int32")
+        self.class_indices = class_indices
+        self.image_data_generator = image_data_generator
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.set_epoch(0)
+
+    @property
+    def n(self):
+        return len(self.classes)
+
+    def set_epoch(self, epoch):
+        """
+        Go to the order & transforms of an epoch (e.g. the one a resumed run starts at)
+
+        :param epoch: Epoch #
+
+        :return: None
+        """
+        self.epoch = epoch
+        random_state = np.random.RandomState(self.seed + epoch)
+        self.index_array = random_state.permutation(self.n) if self.shuffle else np.arange(self.n)
+        self.transform_seeds = random_state.randint(0, 2 ** 31 - 1, size=self.n)
+
+    def load(self, index_array):
+        """
+        Load the images at the given positions
+
+        :param index_array: Array of positions
+
+        :return: float32 array - (len(index_array), 299, 299, 3)
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        return int(np.ceil(self.n / self.batch_size))
+
+    def __getitem__(self, idx):
+        index_array = self.index_array[idx * self.batch_size:(idx + 1) * self.batch_size]
+        batch_x = self.load(index_array)
+
+        for pos, index in enumerate(index_array):
+            x = self.image_data_generator.random_transform(batch_x[pos], seed=self.transform_seeds[index])
+            batch_x[pos] = self.image_data_generator.standardize(x)
+
+        return batch_x, to_categorical(self.classes[index_array], helpers.CLASSES)
+
+    def on_epoch_end(self):
+        self.set_epoch(self.epoch + 1)
+
+    def reset(self):
+        self.set_epoch(0)
+
+
+class DirectorySequence(AugmentedSequence):
+    """
+    Decode the images straight from a directory laid out the way flow_from_directory wants it
+    """
+    def __init__(self, directory, image_data_generator, batch_size, shuffle=False, seed=42):
+        self.directory = directory
+        self.fingerprint = split_fingerprint(directory)
+        filenames, classes, class_indices = list_images(directory)
+        super().__init__(filenames, classes, class_indices, image_data_generator, batch_size, shuffle, seed)
+
+    def load(self, index_array):
+        batch_x = np.empty((len(index_array),) + helpers.IMG_DIMENSIONS + (3,), dtype="float32")
+        for pos, index in enumerate(index_array):
+            img = image.load_img(os.path.join(self.directory, self.filenames[index]),
+                                 target_size=helpers.IMG_DIMENSIONS)
+            batch_x[pos] = image.img_to_array(img)
+
+        return batch_x
+
+
+def split_generator(split, image_data_generator, batch_size, shuffle=False, seed=42):
+    """
+    Get the DirectorySequence for one of the splits
+
+    :param split: train, validation, or test
+    :param image_data_generator: ImageDataGenerator to run the images through
+    :param batch_size: Batch size
+    :param shuffle: Shuffle every epoch
+    :param seed: seed
+
+    :return: DirectorySequence
+    """
+    return DirectorySequence(os.path.join(DATA_DIR, split), image_data_generator, batch_size,
+                             shuffle=shuffle, seed=seed)
+
+
+def fit_kwargs():
+    """
+    Keyword args for fit_generator/evaluate_generator/predict_generator to run one of the sequences over a process
+    pool. See helpers.WORKERS & helpers.MAX_QUEUE_SIZE.
+
+    :return: dict
+    """
+    return {"workers": helpers.WORKERS, "use_multiprocessing": helpers.WORKERS > 0,
+            "max_queue_size": helpers.MAX_QUEUE_SIZE}
+
+
+def iterate(sequence):
+    """
+    Go through one pass of a sequence in order with the batches made on the process pool (same as fit_kwargs). For
+    when the batches aren't going straight into a keras *_generator method.
+
+    :param sequence: Sequence
+
+    :return: Generator of batches
+    """
+    if helpers.WORKERS == 0:
+        for idx in range(len(sequence)):
+            yield sequence[idx]
+        return
+
+    enqueuer = OrderedEnqueuer(sequence, use_multiprocessing=True, shuffle=False)
+    enqueuer.start(workers=helpers.WORKERS, max_queue_size=helpers.MAX_QUEUE_SIZE)
+    try:
+        output = enqueuer.get()
+        for _ in range(len(sequence)):
+            yield next(output)
+    finally:
+        enqueuer.stop()
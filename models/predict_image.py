@@ -1,15 +1,35 @@
 """
-Code to predict a single image
+Code to predict a single image - or a whole lot of them
+
+python predict_image.py BAROQUE -> Predict the example for a style
+python predict_image.py [files, directories, globs, or - for a list on stdin] [--batch-size 32] [--top-k 3]
+                        [--format jsonl/csv] [--output file] [--frozen] [--cache [--cache-dir dir]]
+                        [--tta [--tta-variants flip,...]]
 """
 from keras import models
-from keras import layers
 from keras.applications import Xception
-from keras import regularizers
 import numpy as np
 from keras.preprocessing import image
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import csv
+import glob
+import json
 import os
 import sys
 import warnings
+import backends
+import helpers
+import prediction_cache
+import tta
+
+classes = ["BAROQUE", "EARLY-RENAISSANCE", "HIGH-RENAISSANCE", "IMPRESSIONISM", "MANNERISM",
+           "MEDIEVAL", "MINIMALISM", "NEOCLASSICISM",  "REALISM", "ROCOCO",
+           "ROMANTICISM", "SURREALISM"
+           ]
+
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'bmp', 'ppm', 'tif', 'tiff')
 
 
 def load(filename):
@@ -26,24 +46,20 @@ def load(filename):
     return np_image
 
 
-def create_model():
+def create_model(weights_file=None):
     """
     Create our fine-tuned model & load the weights
+
+    :param weights_file: Weights to load. Default -> helpers.WEIGHTS_FILE for the head (helpers.HEAD)
     """
     base_model = Xception(include_top=False, weights=None)
 
     # Add Custom FC
-    x = base_model.output
-    x = layers.Dense(128,
-                     activation='relu',
-                     kernel_regularizer=regularizers.l2(0.0075))(x)
-    x = layers.GlobalAveragePooling2D()(x)
-    x = layers.Dropout(0.5)(x)
-    predictions = layers.Dense(12, activation='softmax')(x)
+    predictions = helpers.add_head(base_model.output)
 
     # Turn into model & load the weights
     model = models.Model(inputs=base_model.input, outputs=predictions)
-    model.load_weights("../models/xception_finetune_12_reg_75_block4.h5")
+    model.load_weights(weights_file or helpers.head_file_name(helpers.WEIGHTS_FILE))
 
     return model
 
@@ -60,11 +76,6 @@ def predict_image(pic_style):
 
     :return None
     """
-    classes = ["BAROQUE", "EARLY-RENAISSANCE", "HIGH-RENAISSANCE", "IMPRESSIONISM", "MANNERISM",
-               "MEDIEVAL", "MINIMALISM", "NEOCLASSICISM",  "REALISM", "ROCOCO",
-               "ROMANTICISM", "SURREALISM"
-               ]
-
     if pic_style.upper() in classes:
         pic = load(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../../", "examples", pic_style + ".jpg") )
         model = create_model()
@@ -85,9 +96,218 @@ def predict_image(pic_style):
         print('{:17s} | {:7.2f}%'.format(pred[0], pred[1]*100, 2))
 
 
+def iter_paths(inputs):
+    """
+    Go through every image given. Each input can be a file, a directory (searched recursively), a glob, or '-' for a
+    newline delimited list of any of those on stdin.
+
+    :param inputs: List of inputs
+
+    :return: Generator of file paths
+    """
+    for arg in inputs:
+        if arg == "-":
+            yield from iter_paths(line.strip() for line in sys.stdin if line.strip())
+        elif os.path.isdir(arg):
+            for root, dirs, files in os.walk(arg):
+                dirs.sort()
+                for file in sorted(files):
+                    if file.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, file)
+        elif glob.has_magic(arg):
+            yield from iter_paths(sorted(glob.iglob(arg, recursive=True)))
+        else:
+            yield arg
+
+
+def decode_image(filename):
+    """
+    Load the image for the model. Errors are returned instead of raised so one bad file doesn't stop everything.
+
+    :param filename: Path of image
+
+    :return: (299, 299, 3) array or the exception
+    """
+    try:
+        return load(filename)[0]
+    except Exception as e:
+        return e
+
+
+def decode_stream(paths, workers=4, queue_size=64):
+    """
+    Decode the images on a pool of threads. At most 'queue_size' images are being decoded/waiting at once so memory
+    stays bounded no matter how many paths there are. Keeps the order of the paths.
+
+    :param paths: Iterable of paths
+    :param workers: # of threads decoding
+    :param queue_size: Max # of decoded images waiting
+
+    :return: Generator of (path, array or exception)
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append((path, executor.submit(decode_image, path)))
+            if len(pending) >= queue_size:
+                path, future = pending.popleft()
+                yield path, future.result()
+
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def top_k(preds, k):
+    """
+    Get the top k classes for each row of probabilities
+
+    :param preds: (# images, # classes) array of probabilities
+    :param k: # of classes to keep
+
+    :return: List of lists of (style, probability) - most likely first
+    """
+    top = np.argsort(-preds, axis=1)[:, :k]
+    return [[(classes[i], float(row[i])) for i in row_top] for row, row_top in zip(preds, top)]
+
+
+class ResultWriter:
+    """
+    Write the predictions as they come in (jsonl or csv). Flushed after every batch.
+    """
+    def __init__(self, file, output_format, k):
+        self.file = file
+        self.output_format = output_format
+
+        if output_format == "csv":
+            self.writer = csv.writer(file)
+            header = ["file", "error"]
+            for rank in range(1, k + 1):
+                header += [f"style_{rank}", f"probability_{rank}"]
+            self.writer.writerow(header)
+
+    def write(self, filename, preds=None, error=None):
+        if self.output_format == "csv":
+            row = [filename, error or ""]
+            for style, prob in preds or []:
+                row += [style, f"{prob:.6f}"]
+            self.writer.writerow(row)
+        else:
+            result = {"file": filename}
+            if error is not None:
+                result["error"] = error
+            else:
+                result["predictions"] = [{"style": style, "probability": prob} for style, prob in preds]
+            self.file.write(json.dumps(result) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+
+def predict_batches(model, paths, writer, batch_size=32, k=3, workers=4, queue_size=None):
+    """
+    Stream the images through the model in batches and write the results as each batch finishes
+
+    :param model: Model (only needs a predict method)
+    :param paths: Iterable of paths
+    :param writer: ResultWriter
+    :param batch_size: # of images per batch
+    :param k: # of classes to write for each image
+    :param workers: # of threads decoding
+    :param queue_size: Max # of decoded images waiting. Default -> 2 batches
+
+    :return: # of images predicted
+    """
+    num_predicted = 0
+    batch_files, batch_images = [], []
+
+    def run_batch():
+        preds = model.predict(np.stack(batch_images), batch_size=len(batch_images))
+        for filename, file_preds in zip(batch_files, top_k(preds, k)):
+            writer.write(filename, file_preds)
+        writer.flush()
+
+    for path, img in decode_stream(paths, workers, queue_size or 2 * batch_size):
+        if isinstance(img, Exception):
+            writer.write(path, error=str(img))
+            continue
+
+        batch_files.append(path)
+        batch_images.append(img)
+
+        if len(batch_images) == batch_size:
+            run_batch()
+            num_predicted += len(batch_images)
+            batch_files, batch_images = [], []
+
+    if batch_images:
+        run_batch()
+        num_predicted += len(batch_images)
+
+    writer.flush()
+
+    return num_predicted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict the style of sculpture images")
+    parser.add_argument("inputs", nargs="*",
+                        help="Files, directories, globs, or - for a newline delimited list on stdin (the default when "
+                             "something is piped in)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--output", default="-", help="File to write to. Default -> stdout")
+    parser.add_argument("--workers", type=int, default=4, help="# of threads decoding images")
+    parser.add_argument("--backend", choices=backends.BACKENDS, default="keras")
+    parser.add_argument("--quantization", choices=backends.QUANTIZATIONS, default="float32",
+                        help="Which model from export_tflite.py to use with --backend tflite")
+    parser.add_argument("--model-file", default=None, help="Weights/graph/tflite file for the backend")
+    parser.add_argument("--frozen", action="store_true",
+                        help="Same as --backend frozen (give its path w/ --model-file)")
+    parser.add_argument("--cache", action="store_true", help="Cache the predictions on disk")
+    parser.add_argument("--cache-dir", default=prediction_cache.CACHE_DIR, help="Where --cache keeps them")
+    parser.add_argument("--tta", action="store_true", help="Average over variants of each image")
+    parser.add_argument("--tta-variants", default=",".join(tta.DEFAULT_VARIANTS),
+                        help=f"Variants for --tta - comma separated from {tta.ALL_VARIANTS}")
+    args = parser.parse_args()
+
+    # Only wait on stdin when something is piped in (or - is given)
+    if not args.inputs:
+        if sys.stdin.isatty():
+            parser.print_usage()
+            sys.exit(2)
+        args.inputs = ["-"]
+
+    if args.frozen:
+        args.backend = "frozen"
+    model_file = args.model_file or backends.model_file(args.backend, args.quantization)
+
+    model = backends.load(args.backend, model_file)
+    if args.tta:
+        model = tta.TTAModel(model, args.tta_variants.split(","))
+    if args.cache:
+        cache = prediction_cache.PredictionCache(model_file, args.cache_dir,
+                                                 tag=f"tta={args.tta_variants}" if args.tta else "")
+        model = prediction_cache.CachedModel(model, cache)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        writer = ResultWriter(output, args.format, args.top_k)
+        num_predicted = predict_batches(model, iter_paths(args.inputs), writer, args.batch_size, args.top_k,
+                                        args.workers)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"Predicted {num_predicted} images", file=sys.stderr)
+    if args.cache:
+        print(f"Cache: {cache.stats()}", file=sys.stderr)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Please supply a command line argument in the form of one of the styles")
-    else:
+    # Old usage -> Just a style name
+    if len(sys.argv) == 2 and sys.argv[1].upper() in classes and not os.path.exists(sys.argv[1]):
         predict_image(sys.argv[1])
-
+    else:
+        main()
@@ -1,37 +1,54 @@
 """
 Run evaluation of the test set
+
+One batched pass over the test set gets the probabilities for every image. Everything else comes from those:
+- loss, accuracy, top-k accuracy, & accuracy for each class (printed)
+- test_probs.npz -> probabilities, true class & predicted class keyed by filename
+- test_preds.txt -> predicted & true class for each image
+- test_confusion.txt -> confusion matrix (rows are the true class) used by viz/test_heatmap.py
 """
+from keras import backend as K
 from keras import models
-from keras import layers
 from keras.applications import Xception
 from keras.preprocessing.image import ImageDataGenerator
-from keras import regularizers
-from keras import optimizers
+import json
 import numpy as np
+import backends
+import helpers
+import pipeline
+import shards
+import tta
 
 
-# Batch = 1 to cover every test image
-BATCH_SIZE = 1
+# Every image is covered whatever the batch size -> the last batch is just smaller
+BATCH_SIZE = 32
 img_dimensions = (299, 299)
 NUM_EPOCHS = 50
 CLASSES = 12
+TOP_K = 3
 
 train_images = 2387
 test_images = 804
 
+# Read the pre-decoded shards (see shards.py) instead of decoding every jpg again
+USE_SHARDS = False
+
+# What runs the model (see backends.py) -> keras, frozen or tflite. QUANTIZATION picks the tflite model.
+BACKEND = "keras"
+QUANTIZATION = "float32"
+
+# Test time augmentation -> List of variants (see tta.py) to average over. None -> Off
+TTA = None
 
 test_datagen = ImageDataGenerator(
     rescale=1./255
 )
 
-test_generator = test_datagen.flow_from_directory(
-        directory='../../sculpture_data/model_data/classes_12/test',
-        target_size=img_dimensions,
-        color_mode="rgb",
-        batch_size=BATCH_SIZE,
-        class_mode="categorical",
-        shuffle=False,
-        seed=42)
+# Never shuffled -> row i of the predictions is test_generator.filenames[i]
+if USE_SHARDS:
+    test_generator = shards.split_generator("test", test_datagen, BATCH_SIZE, seed=42)
+else:
+    test_generator = pipeline.split_generator("test", test_datagen, BATCH_SIZE, seed=42)
 
 
 def create_model():
@@ -41,63 +58,123 @@ def create_model():
     base_model = Xception(include_top=False, weights=None)
 
     # Add Custom FC
-    x = base_model.output
-    x = layers.Dense(128,
-                     activation='relu',
-                     kernel_regularizer=regularizers.l2(0.0075))(x)
-    x = layers.GlobalAveragePooling2D()(x)
-    x = layers.Dropout(0.5)(x)
-    predictions = layers.Dense(12, activation='softmax')(x)
+    predictions = helpers.add_head(base_model.output)
 
     # Turn into model & load the weights
     model = models.Model(inputs=base_model.input, outputs=predictions)
-    model.load_weights("../models/xception_finetune_12_reg_75_block4.h5")
-
-    model.compile(loss="categorical_crossentropy",
-                  optimizer=optimizers.SGD(lr=1e-4, momentum=0.9),
-                  metrics=["accuracy"])
+    model.load_weights(helpers.head_file_name("../models/xception_finetune_12_reg_75_block4.h5"))
 
     return model
 
 
-def total_eval(model):
+def get_probs(model):
     """
-    Get total accuracy & loss
-    
+    Run the whole test set through the model once
+
     :param model: Cnn
-    
-    :return None
+
+    :return: (# test images, # classes) array of probabilities
     """
-    test_loss, test_acc = model.evaluate_generator(test_generator, steps=test_images // BATCH_SIZE, verbose=True)
-    print('test acc:', test_acc)
-    print("test loss:", test_loss)
+    if TTA:
+        model = tta.TTAModel(model, TTA)
+
+    # Anything that isn't a keras model (other backends, TTA) just gets fed the batches
+    if TTA or not hasattr(model, "predict_generator"):
+        return np.concatenate([model.predict(batch_x) for batch_x, _ in pipeline.iterate(test_generator)])
 
+    return model.predict_generator(test_generator, steps=len(test_generator), verbose=1, **pipeline.fit_kwargs())
 
-def get_ind_preds(model):
+
+def regularization_loss(model):
     """
-    Get individual predictions
-    
+    The L2 penalty on the weights - evaluate_generator includes it in the loss so we do too. Only the keras backend has
+    it -> 0 for the others.
+
     :param model: Cnn
-    
-    :return: Matrix of preds vs. True
+
+    :return: float
     """
-    predictions = model.predict_generator(test_generator, steps=test_images // BATCH_SIZE, verbose=1)
-    test_preds = np.argmax(predictions, axis=1)
-    test_trues = test_generator.classes
+    return float(sum(K.batch_get_value(model.losses))) if getattr(model, "losses", None) else 0.
 
-    # Save Preds
-    test_predictions = []
-    for foo, bar in zip(test_preds, test_trues):
-        test_predictions.append([foo, bar])
-    np.savetxt('test_preds.txt', np.array(test_predictions), fmt='%d')
 
+def get_metrics(probs, trues, k=TOP_K):
+    """
+    Compute all the metrics from the probabilities
 
-if __name__ == "__main__":
-    cnn_model = create_model()
-    total_eval(cnn_model)
+    :param probs: (# images, # classes) array of probabilities
+    :param trues: True class for each image
+    :param k: k for top-k accuracy
+
+    :return: dict of metrics
+    """
+    trues = np.asarray(trues)
+    preds = np.argmax(probs, axis=1)
+    num_classes = probs.shape[1]
+
+    # Categorical cross-entropy (same clipping as keras)
+    true_probs = np.clip(probs[np.arange(len(trues)), trues], K.epsilon(), 1 - K.epsilon())
+
+    # Rows are the true class & columns are the predicted class
+    confusion = np.bincount(trues * num_classes + preds, minlength=num_classes ** 2).reshape(num_classes, num_classes)
+
+    # Is the true class in the top k?
+    true_rank = (probs > probs[np.arange(len(trues)), trues][:, None]).sum(axis=1)
+
+    return {"loss": float(-np.mean(np.log(true_probs))),
+            "acc": float(np.mean(preds == trues)),
+            "top_k_acc": float(np.mean(true_rank < k)),
+            "class_acc": np.diag(confusion) / np.maximum(confusion.sum(axis=1), 1),
+            "confusion": confusion,
+            "preds": preds}
 
-    # Must reset first!!!! Otherwise the results won't make sense
-    test_generator.reset()
-    get_ind_preds(cnn_model)
 
+def save_results(probs, metrics):
+    """
+    Save the probabilities, predictions, and confusion matrix
+
+    :param probs: (# images, # classes) array of probabilities
+    :param metrics: dict from get_metrics
+
+    :return: None
+    """
+    np.savez_compressed('test_probs.npz',
+                        filenames=np.array(test_generator.filenames),
+                        probs=probs.astype('float32'),
+                        trues=np.asarray(test_generator.classes, dtype='int32'),
+                        preds=metrics['preds'].astype('int32'),
+                        class_indices=json.dumps(test_generator.class_indices))
+
+    np.savetxt('test_preds.txt', np.column_stack([metrics['preds'], test_generator.classes]), fmt='%d')
+    np.savetxt('test_confusion.txt', metrics['confusion'], fmt='%d')
+
+
+def evaluate(model):
+    """
+    Evaluate the model on the test set in a single pass
+
+    :param model: Cnn
+
+    :return: dict of metrics
+    """
+    probs = get_probs(model)
+    metrics = get_metrics(probs, test_generator.classes)
+    metrics['loss'] += regularization_loss(model)
+
+    print('test acc:', metrics['acc'])
+    print("test loss:", metrics['loss'])
+    print(f"test top-{TOP_K} acc:", metrics['top_k_acc'])
+
+    print("\n")
+    print('{:18s} {:8}'.format("Style", "Accuracy%"))
+    print("-------------------------------")
+    for style, index in sorted(test_generator.class_indices.items(), key=lambda x: x[1]):
+        print('{:17s} | {:7.2f}%'.format(style, metrics['class_acc'][index] * 100))
 
+    save_results(probs, metrics)
+
+    return metrics
+
+
+if __name__ == "__main__":
+    cnn_model = create_model() if BACKEND == "keras" else backends.load(BACKEND, quantization=QUANTIZATION)
+    evaluate(cnn_model)
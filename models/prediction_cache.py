@@ -0,0 +1,207 @@
+"""
+Cache for predictions so the same image (e.g. David, Clodion...) doesn't go through Xception again.
+
+Entries are keyed by a hash of the decoded & resized image tensor plus the identity of the weights (a hash of the
+weights file). Changing the weights file changes every key so old entries are never used again - they just get
+evicted eventually.
+
+Two tiers:
+- memory -> LRU with a max # of entries
+- disk   -> .npy file for each entry. Oldest used are deleted once the total size goes over a limit.
+
+Wrap a model with CachedModel to use it.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+CACHE_DIR = "../../sculpture_data/prediction_cache"
+
+_weights_ids = {}
+
+
+def weights_identity(weights_file):
+    """
+    Hash of the contents of the weights file. Only re-hashed when the file's size or modification time changes.
+
+    :param weights_file: Path of weights
+
+    :return: hex digest
+    """
+    path = os.path.abspath(weights_file)
+    stat = os.stat(path)
+    file_key = (path, stat.st_size, stat.st_mtime_ns)
+
+    if file_key not in _weights_ids:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        _weights_ids[file_key] = digest.hexdigest()
+
+    return _weights_ids[file_key]
+
+
+class PredictionCache:
+    """
+    Memory (LRU) & disk cache of class probabilities
+    """
+    def __init__(self, weights_file, cache_dir=CACHE_DIR, max_items=1024, max_disk_bytes=256 * 1024 * 1024, tag=""):
+        """
+        :param weights_file: Weights the predictions come from
+        :param cache_dir: Directory for the disk tier. None -> memory only
+        :param max_items: Max # of entries in memory
+        :param max_disk_bytes: Max total size of the disk tier
+        :param tag: Anything else that changes the predictions (e.g. the TTA variants). Part of every key.
+        """
+        self.weights_id = weights_identity(weights_file) + tag
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = self.disk_hits = self.misses = 0
+
+        # Everything on disk - oldest used first
+        self.disk = OrderedDict()
+        self.disk_bytes = 0
+        if cache_dir is not None:
+            self._scan_disk()
+
+    def _scan_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".npy"):
+                    stat = os.stat(os.path.join(root, file))
+                    entries.append((stat.st_mtime, file[:-4], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+
+    def key(self, img):
+        """
+        Key for an image
+
+        :param img: Decoded & resized image tensor
+
+        :return: hex digest
+        """
+        img = np.ascontiguousarray(img)
+        digest = hashlib.sha256(self.weights_id.encode())
+        digest.update(f"{img.dtype}{img.shape}".encode())
+        digest.update(img.data)
+
+        return digest.hexdigest()
+
+    def _disk_file(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def get(self, key):
+        """
+        Look for the key in memory & then on disk
+
+        :param key: key
+
+        :return: probabilities or None
+        """
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+
+            if key in self.disk:
+                try:
+                    preds = np.load(self._disk_file(key))
+                except (IOError, ValueError):
+                    # Deleted by someone else or half written
+                    self.disk_bytes -= self.disk.pop(key)
+                else:
+                    os.utime(self._disk_file(key))
+                    self.disk.move_to_end(key)
+                    self._put_memory(key, preds)
+                    self.disk_hits += 1
+                    return preds
+
+            self.misses += 1
+            return None
+
+    def put(self, key, preds):
+        """
+        Add to both tiers
+
+        :param key: key
+        :param preds: probabilities
+
+        :return: None
+        """
+        preds = np.asarray(preds, dtype="float32")
+        with self.lock:
+            self._put_memory(key, preds)
+            if self.cache_dir is not None and key not in self.disk:
+                self._put_disk(key, preds)
+
+    def _put_memory(self, key, preds):
+        self.memory[key] = preds
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def _put_disk(self, key, preds):
+        file = self._disk_file(key)
+        if not os.path.exists(os.path.dirname(file)):
+            os.makedirs(os.path.dirname(file))
+
+        # Write somewhere else & move it over -> never a half written entry
+        with open(file + ".tmp", 'wb') as tmp:
+            np.save(tmp, preds)
+        os.replace(file + ".tmp", file)
+
+        self.disk[key] = os.path.getsize(file)
+        self.disk_bytes += self.disk[key]
+
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+            old_key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self._disk_file(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        Hit/miss counters
+
+        :return: dict
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.,
+                "memory_items": len(self.memory), "disk_items": len(self.disk), "disk_bytes": self.disk_bytes}
+
+
+class CachedModel:
+    """
+    Put the cache in front of a model. Only the images not in the cache go through the model.
+    """
+    def __init__(self, model, cache):
+        self.model = model
+        self.cache = cache
+
+    def predict(self, x, batch_size=None):
+        keys = [self.cache.key(img) for img in x]
+        preds = [self.cache.get(key) for key in keys]
+
+        missing = [pos for pos, pred in enumerate(preds) if pred is None]
+        if missing:
+            new_preds = self.model.predict(x[missing], batch_size=batch_size)
+            for pos, pred in zip(missing, new_preds):
+                self.cache.put(keys[pos], pred)
+                preds[pos] = pred
+
+        return np.stack(preds)
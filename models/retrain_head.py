@@ -0,0 +1,146 @@
+"""
+Swap the head (see helpers.HEADS) of the fine-tuned model without fine-tuning Xception all over again.
+
+Xception is kept exactly as it was fine-tuned with the dense_first head. Its output is cached for each split (see
+bottleneck_features.py) and only the new head is trained off of the cache. Both heads have weights of the same shape
+so the new one starts from the dense_first weights.
+
+The full model (fine-tuned Xception + new head) is saved to helpers.head_file_name(helpers.WEIGHTS_FILE, head) where
+predict_image/predict_test/export_model look for it when helpers.HEAD is set to that head.
+
+python retrain_head.py [--head pool_first] [--epochs 10]
+"""
+import argparse
+import os
+from keras import layers
+from keras import models
+from keras.applications import Xception
+import bottleneck_features
+import helpers
+import pipeline
+import shards
+
+BATCH_SIZE = 32
+NUM_EPOCHS = 10
+AUGMENTED_VARIANTS = 5
+FEATURE_DIR = '../../sculpture_data/model_data/finetune_features'
+
+# Read the pre-decoded shards (see shards.py) instead of decoding every jpg again
+USE_SHARDS = False
+
+
+def build(head):
+    """
+    Fine-tuned Xception w/ some head. The head's layers are shared between the full model and one that goes
+    straight from the (cached) Xception output.
+
+    :param head: dense_first or pool_first
+
+    :return: full model, Xception alone, head alone
+    """
+    base_model = Xception(include_top=False, weights=None)
+    head_layers = helpers.head_layers(head)
+
+    def apply_head(x):
+        for head_layer in head_layers:
+            x = head_layer(x)
+        return x
+
+    feature_input = layers.Input(shape=base_model.output_shape[1:])
+    model = models.Model(inputs=base_model.input, outputs=apply_head(base_model.output))
+    head_model = models.Model(inputs=feature_input, outputs=apply_head(feature_input))
+
+    return model, models.Model(inputs=base_model.input, outputs=base_model.output), head_model
+
+
+def load(head, weights_file):
+    """
+    Build the model for the head & load some full model weights
+
+    :param head: dense_first or pool_first
+    :param weights_file: Weights of a full model. Any head works - they're the same shapes.
+
+    :return: full model, Xception alone, head alone
+    """
+    model, base_model, head_model = build(head)
+    model.load_weights(weights_file)
+
+    return model, base_model, head_model
+
+
+def cache_features(base_model, weights_file=helpers.WEIGHTS_FILE):
+    """
+    Run the fine-tuned Xception over every split once
+
+    :param base_model: Xception (w/ the fine-tuned weights)
+    :param weights_file: Where those weights came from -> The caches are only valid for them
+
+    :return: dict - split -> store directory
+    """
+    weights_id = f"{os.path.abspath(weights_file)}@{os.path.getmtime(weights_file)}"
+    datagens = {"train": helpers.fit_train_image_generator(), "validation": helpers.fit_test_image_generator(),
+                "test": helpers.fit_test_image_generator()}
+
+    def make_generator(split, datagen):
+        if USE_SHARDS:
+            return lambda seed: shards.split_generator(split, datagen, BATCH_SIZE, seed=seed)
+        return lambda seed: pipeline.split_generator(split, datagen, BATCH_SIZE, seed=seed)
+
+    stores = {}
+    for split, datagen in datagens.items():
+        stores[split] = os.path.join(FEATURE_DIR, split)
+        bottleneck_features.extract_features(base_model, make_generator(split, datagen), f"{split}|{weights_id}",
+                                             stores[split], variants=AUGMENTED_VARIANTS if split == "train" else 1)
+
+    return stores
+
+
+def retrain(head, epochs=NUM_EPOCHS):
+    """
+    Train a new head on top of the fine-tuned Xception & save the full model
+
+    :param head: Any head but dense_first (that's what helpers.WEIGHTS_FILE already is)
+    :param epochs: # of epochs
+
+    :return: history dict
+    """
+    if head == "dense_first":
+        raise ValueError("dense_first would overwrite the weights it starts from")
+
+    # Everything but the order of the layers is the same -> the dense_first weights load right in
+    model, base_model, head_model = load(head, helpers.WEIGHTS_FILE)
+    stores = cache_features(base_model)
+
+    train_features = bottleneck_features.FeatureSequence(stores['train'], BATCH_SIZE, shuffle=True, seed=42)
+    validation_features = bottleneck_features.FeatureSequence(stores['validation'], BATCH_SIZE)
+
+    # Same as training the bottleneck head
+    head_model.compile(loss="categorical_crossentropy", optimizer='rmsprop', metrics=["accuracy"])
+    history = head_model.fit_generator(
+                    train_features,
+                    epochs=epochs,
+                    validation_data=validation_features,
+                    shuffle=False,
+                    **pipeline.fit_kwargs()
+                    )
+
+    # Head shares its layers with the full model
+    file_name = helpers.head_file_name(helpers.WEIGHTS_FILE, head)
+    print(f"Saving CNN as '{file_name}'...")
+    model.save(file_name)
+
+    return history.history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the head of the fine-tuned model")
+    parser.add_argument("--head", choices=[head for head in helpers.HEADS if head != "dense_first"],
+                        default="pool_first")
+    parser.add_argument("--epochs", type=int, default=NUM_EPOCHS)
+    args = parser.parse_args()
+
+    retrain(args.head, args.epochs)
+
+
+if __name__ == "__main__":
+    main()
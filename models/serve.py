@@ -0,0 +1,201 @@
+"""
+Long lived local HTTP server for the classifier so the model is only built once.
+
+POST /predict with the raw bytes of an image as the body -> json of every style & its probability, most likely first
+(the same thing predict_image prints). GET /health -> 200 once the model is loaded.
+
+Requests that come in at about the same time are run through the model together. A batch is sent off as soon as it
+has --max-batch images or the first image in it has waited --max-wait ms.
+
+python serve.py [--port 8000] [--max-batch 16] [--max-wait 10] [--frozen] [--model-file file]
+                [--cache [--cache-dir dir]]
+"""
+import argparse
+import json
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+import numpy as np
+import frozen_model
+import helpers
+import prediction_cache
+import predict_image
+
+
+class MicroBatcher:
+    """
+    Collect images from any # of threads into batches and run them through the model on one thread.
+
+    The model is built on the batcher's thread too, so everything tensorflow (graph, session) stays on that thread.
+    """
+    def __init__(self, load_model, max_batch=16, max_wait=0.01):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.images = 0
+
+        self.ready = threading.Event()
+        self.load_error = None
+        self.thread = threading.Thread(target=self._run, args=(load_model,), daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+        if self.load_error is not None:
+            raise self.load_error
+
+    def predict(self, img):
+        """
+        Predict one image. Blocks until the batch it ends up in has been run.
+
+        :param img: (299, 299, 3) array
+
+        :return: (# classes,) array of probabilities
+        """
+        request = {"image": img, "done": threading.Event(), "result": None, "error": None}
+        self.requests.put(request)
+        request['done'].wait()
+
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def _next_batch(self):
+        # Block for the first one and then only wait until its deadline for the rest
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self, load_model):
+        try:
+            model = load_model()
+        except Exception as e:
+            self.load_error = e
+            return
+        finally:
+            self.ready.set()
+
+        while True:
+            batch = self._next_batch()
+            try:
+                preds = model.predict(np.stack([request['image'] for request in batch]), batch_size=len(batch))
+                for request, pred in zip(batch, preds):
+                    request['result'] = pred
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+
+            self.batches += 1
+            self.images += len(batch)
+            for request in batch:
+                request['done'].set()
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    batcher = None
+    cache = None
+
+    def _send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == "/health":
+            health = {"status": "ok", "batches": self.batcher.batches, "images": self.batcher.images}
+            if self.cache is not None:
+                health['cache'] = self.cache.stats()
+            self._send_json(200, health)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            img = frozen_model.load_image(BytesIO(body))[0]
+        except Exception as e:
+            self._send_json(400, {"error": f"Couldn't read image: {e}"})
+            return
+
+        # Cached images never make it to the batcher
+        key = self.cache.key(img) if self.cache is not None else None
+        pred = self.cache.get(key) if key is not None else None
+
+        if pred is None:
+            try:
+                pred = self.batcher.predict(img)
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+
+            if key is not None:
+                self.cache.put(key, pred)
+
+        preds = predict_image.top_k(np.expand_dims(pred, axis=0), len(predict_image.classes))[0]
+        self._send_json(200, {"predictions": [{"style": style, "probability": prob} for style, prob in preds]})
+
+    # Don't print every request
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    # Default of 5 makes clients wait for a retry of the connection when a lot of them come at once
+    request_queue_size = 128
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the classifier over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=16, help="Max # of images in a batch")
+    parser.add_argument("--max-wait", type=float, default=10, help="Max ms to wait to fill up a batch")
+    parser.add_argument("--frozen", action="store_true", help="Use the frozen model from export_model.py")
+    parser.add_argument("--model-file", default=None,
+                        help="Weights (or the graph w/ --frozen). Default -> the same as predict_image")
+    parser.add_argument("--cache", action="store_true", help="Cache the predictions on disk")
+    parser.add_argument("--cache-dir", default=prediction_cache.CACHE_DIR, help="Where --cache keeps them")
+    args = parser.parse_args()
+
+    model_file = args.model_file or (frozen_model.FROZEN_FILE if args.frozen else helpers.WEIGHTS_FILE)
+
+    if args.cache:
+        PredictionHandler.cache = prediction_cache.PredictionCache(model_file, args.cache_dir)
+
+    def load_model():
+        return frozen_model.FrozenModel(model_file) if args.frozen else predict_image.create_model(args.model_file)
+
+    PredictionHandler.batcher = MicroBatcher(load_model, args.max_batch, args.max_wait / 1000)
+
+    server = ThreadingHTTPServer((args.host, args.port), PredictionHandler)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
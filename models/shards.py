@@ -0,0 +1,190 @@
+"""
+Pre-decode the classes_12 data-set into fixed size uint8 tensor shards so training/testing doesn't have to decode &
+resize every jpg every epoch.
+
+Layout for each split (train/validation/test):
+- images_000.npy, images_001.npy, ... -> (<= SHARD_SIZE, 299, 299, 3) uint8
+- index.json -> filenames, labels, class indices, shard size & the fingerprint of the split they were built from
+  (see pipeline.split_fingerprint). Shards whose split has changed since (e.g. build_model_data added images) aren't
+  used.
+
+The shards are read back memory mapped so nothing gets copied until a batch is actually used (and several runs
+reading the same shards share the page cache).
+
+To build -> python shards.py (only the splits that changed are built again)
+"""
+import json
+import os
+import numpy as np
+from keras.preprocessing import image
+import helpers
+from pipeline import AugmentedSequence, DATA_DIR, list_images, split_fingerprint
+
+SHARD_DIR = '../../sculpture_data/model_data/classes_12_shards'
+SPLITS = ['train', 'validation', 'test']
+
+# 256 images -> ~68MB per shard
+SHARD_SIZE = 256
+
+
+def shard_file(shard_dir, shard_num):
+    return os.path.join(shard_dir, f"images_{shard_num:03d}.npy")
+
+
+def build_shards(directory, shard_dir, shard_size=SHARD_SIZE):
+    """
+    Decode & resize every image in the directory once and write them to shards. The index is written last so a
+    partially built split is never used.
+
+    :param directory: Directory of images for one split
+    :param shard_dir: Where to put the shards
+    :param shard_size: # of images per shard
+
+    :return: None
+    """
+    filenames, labels, class_indices = list_images(directory)
+    fingerprint = split_fingerprint(directory)
+
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+
+    index_file = os.path.join(shard_dir, "index.json")
+    if os.path.isfile(index_file):
+        os.remove(index_file)
+
+    num_shards = int(np.ceil(len(filenames) / shard_size))
+    for shard_num in range(num_shards):
+        shard_files = filenames[shard_num * shard_size:(shard_num + 1) * shard_size]
+        shard = np.lib.format.open_memmap(shard_file(shard_dir, shard_num), mode="w+", dtype="uint8",
+                                          shape=(len(shard_files),) + helpers.IMG_DIMENSIONS + (3,))
+
+        # Same decoding flow_from_directory does
+        for pos, file in enumerate(shard_files):
+            img = image.load_img(os.path.join(directory, file), target_size=helpers.IMG_DIMENSIONS)
+            shard[pos] = image.img_to_array(img).astype("uint8")
+
+        shard.flush()
+        del shard
+
+    with open(index_file, "w+") as file:
+        json.dump({"filenames": filenames, "labels": labels, "class_indices": class_indices,
+                   "shard_size": shard_size, "num_shards": num_shards, "source": os.path.abspath(directory),
+                   "fingerprint": fingerprint}, file)
+
+    print(f"Wrote {len(filenames)} images to {num_shards} shards in '{shard_dir}'")
+
+
+def load_index(shard_dir):
+    """
+    :param shard_dir: Shards of one split
+
+    :return: dict of the index (None if they were never finished)
+    """
+    index_file = os.path.join(shard_dir, "index.json")
+    if not os.path.isfile(index_file):
+        return None
+
+    with open(index_file, 'r') as file:
+        return json.load(file)
+
+
+def is_stale(index):
+    """
+    If the split the shards were built from has changed since. Shards from before the fingerprint was kept count as
+    stale.
+    """
+    source = index.get('source')
+    return source is None or not os.path.isdir(source) or index.get('fingerprint') != split_fingerprint(source)
+
+
+class ShardDataset:
+    """
+    Read access to the shards of one split. Shards are only opened (memory mapped) when first needed and are never
+    pickled, so a copy sent to another process just maps them itself.
+    """
+    def __init__(self, shard_dir):
+        index = load_index(shard_dir)
+        if index is None:
+            raise Exception(f"No shards found in '{shard_dir}'. Build them first by running shards.py")
+        if is_stale(index):
+            raise Exception(f"The shards in '{shard_dir}' are out of date w/ the images they were built from. Build "
+                            f"them again by running shards.py")
+
+        self.shard_dir = shard_dir
+        self.filenames = index['filenames']
+        self.classes = np.array(index['labels'], dtype="int32")
+        self.class_indices = index['class_indices']
+        self.shard_size = index['shard_size']
+        self.num_shards = index['num_shards']
+        self.fingerprint = index['fingerprint']
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def shard(self, shard_num):
+        if shard_num not in self._shards:
+            self._shards[shard_num] = np.load(shard_file(self.shard_dir, shard_num), mmap_mode='r')
+        return self._shards[shard_num]
+
+    def get(self, indices):
+        """
+        Get the images at the given positions
+
+        :param indices: Array of positions in the split
+
+        :return: uint8 array - (len(indices), 299, 299, 3)
+        """
+        images = np.empty((len(indices),) + helpers.IMG_DIMENSIONS + (3,), dtype="uint8")
+        for pos, index in enumerate(indices):
+            images[pos] = self.shard(index // self.shard_size)[index % self.shard_size]
+
+        return images
+
+
+class ShardSequence(AugmentedSequence):
+    """
+    Drop in for the flow_from_directory iterator that reads from the shards (see pipeline.AugmentedSequence)
+    """
+    def __init__(self, shard_dir, image_data_generator, batch_size, shuffle=False, seed=42):
+        self.dataset = ShardDataset(shard_dir)
+        self.fingerprint = self.dataset.fingerprint
+        super().__init__(self.dataset.filenames, self.dataset.classes, self.dataset.class_indices,
+                         image_data_generator, batch_size, shuffle, seed)
+
+    def load(self, index_array):
+        return self.dataset.get(index_array).astype("float32")
+
+
+def split_generator(split, image_data_generator, batch_size, shuffle=False, seed=42):
+    """
+    Get the ShardSequence for one of the splits
+
+    :param split: train, validation, or test
+    :param image_data_generator: ImageDataGenerator to run the images through
+    :param batch_size: Batch size
+    :param shuffle: Shuffle every epoch
+    :param seed: seed
+
+    :return: ShardSequence
+    """
+    return ShardSequence(os.path.join(SHARD_DIR, split), image_data_generator, batch_size, shuffle=shuffle, seed=seed)
+
+
+def main():
+    for split in SPLITS:
+        index = load_index(os.path.join(SHARD_DIR, split))
+        if index is not None and not is_stale(index):
+            print(f"Shards for {split} are up to date")
+            continue
+
+        build_shards(os.path.join(DATA_DIR, split), os.path.join(SHARD_DIR, split))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Run the fine-tune block sweep (see xception_fine_tune.py) with each block configuration in its own process.
+
+- Every process gets a budget of threads (for TF and the data loaders) and only as many run at once as fit on the
+  machine.
+- The weights & optimizer state are checkpointed at the end of every epoch. Running the sweep again picks every
+  unfinished configuration back up from its last checkpoint.
+- When everything is done a summary of the whole sweep is written to 'xception_finetune_sweep_summary.csv'.
+
+python sweep.py [--blocks block4 block8 ...] [--threads 4] [--jobs 2]
+"""
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import time
+import pandas as pd
+from keras.callbacks import Callback
+import helpers
+
+SWEEP_DIR = 'finetune_sweep'
+SUMMARY_FILE = 'xception_finetune_sweep_summary.csv'
+
+
+def load_state(block_dir):
+    """
+    Load the checkpoint state for a block
+
+    :param block_dir: Directory for the block
+
+    :return: state dict - a fresh one if we never started
+    """
+    state_file = os.path.join(block_dir, "state.json")
+
+    if not os.path.isfile(state_file):
+        return {"epoch": 0, "history": {}, "weights": None, "optimizer": None, "seconds": 0, "done": False}
+
+    with open(state_file, 'r') as file:
+        return json.load(file)
+
+
+def save_state(block_dir, state):
+    """
+    Write the state to a temporary file first and then move it over -> never left with half a file
+
+    :param block_dir: Directory for the block
+    :param state: state dict
+
+    :return: None
+    """
+    state_file = os.path.join(block_dir, "state.json")
+
+    with open(state_file + ".tmp", "w+") as file:
+        json.dump(state, file)
+    os.replace(state_file + ".tmp", state_file)
+
+
+class EpochCheckpoint(Callback):
+    """
+    Save the weights of the full model & the state of the optimizer at the end of every epoch.
+
+    The files for each epoch get their own name and the state file is only pointed at them once they're written. So
+    if we get killed half way through the last complete checkpoint is still there. When resuming, the optimizer state
+    is put back as soon as training starts (that's the first time the optimizer has any weights).
+    """
+    def __init__(self, block_dir, full_model, state):
+        super().__init__()
+        self.block_dir = block_dir
+        self.full_model = full_model
+        self.state = state
+        self.epoch_start = None
+        self.restored = False
+
+    def on_train_begin(self, logs=None):
+        # Cached prefix training calls fit more than once -> Only restore the first time
+        if self.state['optimizer'] is not None and not self.restored:
+            with open(os.path.join(self.block_dir, self.state['optimizer']), 'rb') as file:
+                self.model.optimizer.set_weights(pickle.load(file))
+            self.restored = True
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        old_files = [self.state['weights'], self.state['optimizer']]
+
+        weights_file, optimizer_file = f"weights_{epoch + 1:03d}.h5", f"optimizer_{epoch + 1:03d}.pkl"
+        self.full_model.save_weights(os.path.join(self.block_dir, weights_file))
+        with open(os.path.join(self.block_dir, optimizer_file), 'wb') as file:
+            pickle.dump(self.model.optimizer.get_weights(), file)
+
+        for metric, value in (logs or {}).items():
+            self.state['history'].setdefault(metric, []).append(float(value))
+
+        self.state.update(epoch=epoch + 1, weights=weights_file, optimizer=optimizer_file,
+                          seconds=self.state['seconds'] + time.time() - self.epoch_start)
+        save_state(self.block_dir, self.state)
+
+        for file in old_files:
+            if file is not None and os.path.isfile(os.path.join(self.block_dir, file)):
+                os.remove(os.path.join(self.block_dir, file))
+
+
+def run_block(block, cut, threads):
+    """
+    Train (or finish training) one block configuration. Meant to be run in its own process.
+
+    :param block: Name of block
+    :param cut: Index of the first trainable layer
+    :param threads: # of threads this process is allowed
+
+    :return: state dict
+    """
+    import tensorflow as tf
+    from keras import backend as K
+
+    K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                   inter_op_parallelism_threads=2)))
+
+    # Data loaders get the same budget
+    helpers.WORKERS = threads
+    helpers.MAX_QUEUE_SIZE = 2 * threads
+    import xception_fine_tune as fine_tune
+
+    block_dir = os.path.join(SWEEP_DIR, block)
+    if not os.path.exists(block_dir):
+        os.makedirs(block_dir)
+
+    state = load_state(block_dir)
+    if state['done']:
+        print(f"{block} is already done")
+        return state
+
+    if state['epoch'] > 0 and state.get('cached_prefix') != fine_tune.CACHED_PREFIX:
+        raise Exception(f"{block} was started with CACHED_PREFIX={state.get('cached_prefix')}. Either switch it back "
+                        f"or delete '{block_dir}' to start over.")
+    state.update(block=block, cut=cut, cached_prefix=fine_tune.CACHED_PREFIX)
+
+    model = fine_tune.create_model(cut)
+    if state['weights'] is not None:
+        print(f"Resuming {block} from epoch {state['epoch']}")
+        model.load_weights(os.path.join(block_dir, state['weights']))
+
+    checkpoint = EpochCheckpoint(block_dir, model, state)
+    fine_tune.train(model, block, cut, initial_epoch=state['epoch'], callbacks=[checkpoint])
+    fine_tune.save_results(model, block, state['history'])
+
+    state['done'] = True
+    save_state(block_dir, state)
+
+    return state
+
+
+def write_summary(blocks):
+    """
+    Combine the results of each block into one CSV
+
+    :param blocks: Names of the blocks
+
+    :return: DataFrame of the summary
+    """
+    rows = []
+    for block in blocks:
+        state = load_state(os.path.join(SWEEP_DIR, block))
+        val_acc = state['history'].get('val_acc', [])
+        val_loss = state['history'].get('val_loss', [])
+        best_epoch = max(range(len(val_acc)), key=lambda epoch: val_acc[epoch]) if val_acc else None
+
+        rows.append({"block": block,
+                     "cut": state.get('cut'),
+                     "done": state['done'],
+                     "epochs": state['epoch'],
+                     "best_epoch": best_epoch + 1 if best_epoch is not None else None,
+                     "best_val_acc": val_acc[best_epoch] if val_acc else None,
+                     "final_val_acc": val_acc[-1] if val_acc else None,
+                     "final_val_loss": val_loss[-1] if val_loss else None,
+                     "minutes": round(state['seconds'] / 60, 1)})
+
+    df = pd.DataFrame(rows, columns=["block", "cut", "done", "epochs", "best_epoch", "best_val_acc", "final_val_acc",
+                                     "final_val_loss", "minutes"])
+    df.to_csv(SUMMARY_FILE, sep=',')
+    print(df.to_string(index=False))
+
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fine-tune block sweep")
+    parser.add_argument("--blocks", nargs="+", default=list(helpers.BLOCKS), choices=list(helpers.BLOCKS))
+    parser.add_argument("--threads", type=int, default=4, help="# of threads for each configuration")
+    parser.add_argument("--jobs", type=int, default=None, help="# of configurations at once. Default -> cpus/threads")
+    args = parser.parse_args()
+
+    jobs = args.jobs or max(1, (os.cpu_count() or 1) // args.threads)
+
+    # Workers are new interpreters -> they pick this up when they import tensorflow
+    os.environ["OMP_NUM_THREADS"] = str(args.threads)
+
+    # Fresh process for every configuration -> nothing (graphs, sessions, memory) carries over. Not a Pool -> its
+    # workers are daemonic & a daemonic process can't start the process pool keras' data loaders need.
+    context = multiprocessing.get_context("spawn")
+    processes, running = {}, []
+    for block in args.blocks:
+        # Only 'jobs' at once -> Wait for one to finish
+        while len(running) >= jobs:
+            multiprocessing.connection.wait([process.sentinel for process in running])
+            running = [process for process in running if process.is_alive()]
+
+        process = context.Process(target=run_block, args=(block, helpers.BLOCKS[block], args.threads), name=block)
+        process.start()
+        processes[block] = process
+        running.append(process)
+
+    for block, process in processes.items():
+        process.join()
+        if process.exitcode == 0:
+            print(f"Finished {block}")
+        else:
+            print(f"{block} failed (exit code {process.exitcode}). Run the sweep again to resume it.")
+
+    write_summary(args.blocks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Test time augmentation -> Predict a few variants of each image and average the probabilities.
+
+The variants are made for a whole batch at once with NumPy indexing (every image in a batch is the same size so each
+variant is just one set of row/column indices) and all of them go through the model together as one big batch.
+
+Variants:
+- identity
+- flip -> horizontal flip
+- crop_center, crop_tl, crop_tr, crop_bl, crop_br -> CROP_FRACTION crop resized back up
+- zoom_0.8, zoom_1.2 -> the ends of zoom_range in helpers.fit_train_image_generator (< 1 zooms in)
+"""
+import numpy as np
+
+CROP_FRACTION = 0.875
+CROP_POSITIONS = {"crop_center": (0.5, 0.5), "crop_tl": (0, 0), "crop_tr": (0, 1), "crop_bl": (1, 0), "crop_br": (1, 1)}
+
+ALL_VARIANTS = ["identity", "flip", "crop_center", "crop_tl", "crop_tr", "crop_bl", "crop_br", "zoom_0.8", "zoom_1.2"]
+DEFAULT_VARIANTS = ["identity", "flip", "zoom_0.8", "zoom_1.2"]
+
+
+def _zoom_index(size, zoom):
+    # Same as keras -> output pixel i samples the input at center + (i - center) * zoom. Edges are repeated.
+    center = (size - 1) / 2
+    return np.clip(np.round(center + (np.arange(size) - center) * zoom), 0, size - 1).astype(int)
+
+
+def _crop_index(size, fraction, start):
+    # 'size' evenly spaced pixels from the 'fraction * size' wide window starting at 'start'
+    crop = fraction * size
+    return np.clip(np.floor(start + (np.arange(size) + 0.5) * crop / size), 0, size - 1).astype(int)
+
+
+def variant_index(variant, height, width):
+    """
+    Rows & columns to sample for a variant
+
+    :param variant: Name of variant
+    :param height: Height of images
+    :param width: Width of images
+
+    :return: row indices, column indices
+    """
+    rows, cols = np.arange(height), np.arange(width)
+
+    if variant == "identity":
+        pass
+    elif variant == "flip":
+        cols = cols[::-1]
+    elif variant.startswith("crop_"):
+        if variant not in CROP_POSITIONS:
+            raise ValueError(f"Unknown crop '{variant}'")
+
+        # Where the window starts as a fraction of the space left over
+        row_pos, col_pos = CROP_POSITIONS[variant]
+        rows = _crop_index(height, CROP_FRACTION, row_pos * (1 - CROP_FRACTION) * height)
+        cols = _crop_index(width, CROP_FRACTION, col_pos * (1 - CROP_FRACTION) * width)
+    elif variant.startswith("zoom_"):
+        zoom = float(variant[len("zoom_"):])
+        rows, cols = _zoom_index(height, zoom), _zoom_index(width, zoom)
+    else:
+        raise ValueError(f"Unknown variant '{variant}'")
+
+    return rows, cols
+
+
+def make_variants(x, variants):
+    """
+    Make every variant of every image
+
+    :param x: (# images, height, width, channels) array
+    :param variants: List of variant names
+
+    :return: (# images * # variants, height, width, channels) - The variants of image i are rows [i * k, (i + 1) * k)
+    """
+    out = np.empty((x.shape[0], len(variants)) + x.shape[1:], dtype=x.dtype)
+
+    for pos, variant in enumerate(variants):
+        rows, cols = variant_index(variant, x.shape[1], x.shape[2])
+        out[:, pos] = x[:, rows[:, None], cols[None, :]]
+
+    return out.reshape((-1,) + x.shape[1:])
+
+
+class TTAModel:
+    """
+    Wrap a model (anything with predict) so predict averages over the variants
+    """
+    def __init__(self, model, variants=DEFAULT_VARIANTS):
+        for variant in variants:
+            variant_index(variant, 2, 2)
+
+        self.model = model
+        self.variants = list(variants)
+
+    def predict(self, x, batch_size=None):
+        """
+        :param x: (# images, height, width, channels) array
+        :param batch_size: # of images (not variants) per batch. Default -> all at once
+
+        :return: (# images, # classes) array of averaged probabilities
+        """
+        k = len(self.variants)
+        batch_size = batch_size or len(x)
+
+        probs = []
+        for start in range(0, len(x), batch_size):
+            batch = make_variants(x[start:start + batch_size], self.variants)
+            batch_probs = self.model.predict(batch, batch_size=len(batch))
+            probs.append(batch_probs.reshape(-1, k, batch_probs.shape[-1]).mean(axis=1))
+
+        return np.concatenate(probs)
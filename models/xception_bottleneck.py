@@ -3,34 +3,31 @@ from keras import layers
 import matplotlib.pyplot as plt
 import numpy as np
 from keras.applications import Xception
-from keras import regularizers
 import os
 import helpers
+import bottleneck_features
+import pipeline
+import shards
 
 BATCH_SIZE = 16
 NUM_EPOCHS = 25
 
+# Run the frozen base once, store the features on disk, and just train the head off of them
+# Each epoch cycles through one of the AUGMENTED_VARIANTS augmented copies of the training set
+CACHED_FEATURES = False
+AUGMENTED_VARIANTS = 5
+FEATURE_DIR = '../../sculpture_data/model_data/bottleneck_features'
+
+# Read the pre-decoded shards (see shards.py) instead of decoding every jpg again
+USE_SHARDS = False
+
+TRAIN_DIR = '../../sculpture_data/model_data/classes_12/train'
+VALIDATION_DIR = '../../sculpture_data/model_data/classes_12/validation'
+
 # Get the image generator for 'adjusting' the images
 train_datagen = helpers.fit_train_image_generator()
 test_datagen = helpers.fit_test_image_generator()
 
-train_generator = train_datagen.flow_from_directory(
-        directory='../../sculpture_data/model_data/classes_12/train',
-        target_size=helpers.IMG_DIMENSIONS,
-        batch_size=BATCH_SIZE,
-        color_mode="rgb",
-        seed=42,
-        shuffle=True,
-        class_mode="categorical")
-
-validation_generator = test_datagen.flow_from_directory(
-        directory='../../sculpture_data/model_data/classes_12/validation',
-        target_size=helpers.IMG_DIMENSIONS,
-        batch_size=BATCH_SIZE,
-        color_mode="rgb",
-        seed=42,
-        class_mode="categorical")
-
 
 base_model = Xception(include_top=False, weights='imagenet')
 
@@ -38,28 +35,80 @@ base_model = Xception(include_top=False, weights='imagenet')
 for layer in base_model.layers:
     layer.trainable = False
 
-# Add Custom FC
-x = base_model.output
-x = layers.Dense(128,
-                 activation='relu',
-                 kernel_regularizer=regularizers.l2(0.0075)
-                 )(x)
-x = layers.GlobalAveragePooling2D()(x)
-x = layers.Dropout(0.5)(x)
-predictions = layers.Dense(helpers.CLASSES, activation='softmax')(x)
-
-model = models.Model(inputs=base_model.input, outputs=predictions)
-
-model.compile(loss="categorical_crossentropy", optimizer='rmsprop', metrics=["accuracy"])
-cnn_model = model.fit_generator(
-                train_generator,
-                epochs=NUM_EPOCHS,
-                steps_per_epoch=helpers.TRAIN_IMAGES // BATCH_SIZE,
-                validation_data=validation_generator,
-                validation_steps=helpers.VALIDATION_IMAGES // BATCH_SIZE,
-                )
-
-file_name = "xception_bottleneck_12_reg_0075"
+# Custom FC (helpers.HEAD picks which one)
+# Kept as layers so the same ones (and weights) can sit on top of either the base or the cached features
+head_layers = helpers.head_layers()
+
+
+def apply_head(x):
+    """
+    Put the custom FC on top of some tensor
+
+    :param x: Output of the base (or input of the cached features)
+
+    :return: predictions
+    """
+    for head_layer in head_layers:
+        x = head_layer(x)
+
+    return x
+
+
+model = models.Model(inputs=base_model.input, outputs=apply_head(base_model.output))
+
+if CACHED_FEATURES:
+    train_store = os.path.join(FEATURE_DIR, "train")
+    validation_store = os.path.join(FEATURE_DIR, "validation")
+
+    if USE_SHARDS:
+        train_source = os.path.join(shards.SHARD_DIR, "train")
+        validation_source = os.path.join(shards.SHARD_DIR, "validation")
+        make_train = lambda seed: shards.split_generator("train", train_datagen, BATCH_SIZE, seed=seed)
+        make_validation = lambda seed: shards.split_generator("validation", test_datagen, BATCH_SIZE, seed=seed)
+    else:
+        train_source = TRAIN_DIR
+        validation_source = VALIDATION_DIR
+        make_train = bottleneck_features.directory_generator(train_datagen, TRAIN_DIR, BATCH_SIZE)
+        make_validation = bottleneck_features.directory_generator(test_datagen, VALIDATION_DIR, BATCH_SIZE)
+
+    bottleneck_features.extract_features(base_model, make_train, os.path.abspath(train_source), train_store,
+                                         variants=AUGMENTED_VARIANTS)
+    bottleneck_features.extract_features(base_model, make_validation, os.path.abspath(validation_source),
+                                         validation_store)
+
+    train_generator = bottleneck_features.FeatureSequence(train_store, BATCH_SIZE, shuffle=True, seed=42)
+    validation_generator = bottleneck_features.FeatureSequence(validation_store, BATCH_SIZE)
+
+    # Only the head gets trained -> it shares its layers with 'model' so that's what gets saved
+    feature_input = layers.Input(shape=train_generator.feature_shape)
+    head_model = models.Model(inputs=feature_input, outputs=apply_head(feature_input))
+
+    head_model.compile(loss="categorical_crossentropy", optimizer='rmsprop', metrics=["accuracy"])
+    cnn_model = head_model.fit_generator(
+                    train_generator,
+                    epochs=NUM_EPOCHS,
+                    validation_data=validation_generator,
+                    shuffle=False,
+                    **pipeline.fit_kwargs()
+                    )
+else:
+    if USE_SHARDS:
+        train_generator = shards.split_generator("train", train_datagen, BATCH_SIZE, shuffle=True, seed=42)
+        validation_generator = shards.split_generator("validation", test_datagen, BATCH_SIZE, seed=42)
+    else:
+        train_generator = pipeline.split_generator("train", train_datagen, BATCH_SIZE, shuffle=True, seed=42)
+        validation_generator = pipeline.split_generator("validation", test_datagen, BATCH_SIZE, seed=42)
+
+    model.compile(loss="categorical_crossentropy", optimizer='rmsprop', metrics=["accuracy"])
+    cnn_model = model.fit_generator(
+                    train_generator,
+                    epochs=NUM_EPOCHS,
+                    validation_data=validation_generator,
+                    shuffle=False,
+                    **pipeline.fit_kwargs()
+                    )
+
+file_name = helpers.head_file_name("xception_bottleneck_12_reg_0075")
 print("Saving CNN as '{}'...".format(file_name + "h5"))
 model.save(file_name + ".h5")
 
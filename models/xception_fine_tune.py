@@ -1,10 +1,14 @@
+import os
 import pandas as pd
+from keras import backend as K
 from keras import models
-from keras import layers
 from keras import optimizers
 from keras.applications import Xception
 from keras.preprocessing.image import ImageDataGenerator
-from keras import regularizers
+import bottleneck_features
+import helpers
+import pipeline
+import shards
 
 BATCH_SIZE = 16
 img_dimensions = (299, 299)
@@ -15,6 +19,18 @@ train_images = 2387
 validation_images = 802
 test_images = 802
 
+BOTTLENECK_WEIGHTS = "xception_bottleneck_12_reg_0075.h5"
+
+# Read the pre-decoded shards (see shards.py) instead of decoding every jpg again
+USE_SHARDS = False
+
+# Cache the output of the frozen layers (for each block) and only run the trainable ones every step
+# REFRESH_EVERY -> Rebuild the cache from a new augmented pass every N epochs. 0 -> Build once w/o augmentation
+# PREFIX_DTYPE -> float16 halves the size of the cache (block4 is ~3.3GB of float32 for the training set)
+CACHED_PREFIX = False
+REFRESH_EVERY = 0
+PREFIX_DIR = '../../sculpture_data/model_data/prefix_features'
+PREFIX_DTYPE = "float32"
 
 # Train & Test Data Generators
 train_datagen = ImageDataGenerator(
@@ -28,35 +44,14 @@ test_datagen = ImageDataGenerator(
     rescale=1./255
 )
 
-train_generator = train_datagen.flow_from_directory(
-        directory='../../sculpture_data/model_data/classes_12/train',
-        target_size=img_dimensions,
-        batch_size=BATCH_SIZE,
-        color_mode="rgb",
-        seed=42,
-        shuffle=True,
-        class_mode="categorical")
-
-validation_generator = test_datagen.flow_from_directory(
-        directory='../../sculpture_data/model_data/classes_12/validation',
-        target_size=img_dimensions,
-        batch_size=BATCH_SIZE,
-        color_mode="rgb",
-        seed=42,
-        class_mode="categorical")
-
-
-# Create and load weights
-base_model = Xception(include_top=False, weights=None)
-
-# Add Custom FC
-x = base_model.output
-x = layers.Dense(128,
-                 activation='relu',
-                 kernel_regularizer=regularizers.l2(0.0075))(x)
-x = layers.GlobalAveragePooling2D()(x)
-x = layers.Dropout(0.5)(x)
-predictions = layers.Dense(CLASSES, activation='softmax')(x)
+# Both are keras Sequences -> decoding & augmentation run on a pool of processes (see pipeline.py)
+if USE_SHARDS:
+    train_generator = shards.split_generator("train", train_datagen, BATCH_SIZE, shuffle=True, seed=42)
+    validation_generator = shards.split_generator("validation", test_datagen, BATCH_SIZE, seed=42)
+else:
+    train_generator = pipeline.split_generator("train", train_datagen, BATCH_SIZE, shuffle=True, seed=42)
+    validation_generator = pipeline.split_generator("validation", test_datagen, BATCH_SIZE, seed=42)
+
 
 # Freeze Layers
 # Block 14 starts at index 126
@@ -72,13 +67,28 @@ predictions = layers.Dense(CLASSES, activation='softmax')(x)
 # Block  4 starts at index  26
 # Block  3 starts at index  16
 
-blocks = {"block14": 126, "block12": 106, "block10": 86, "block8": 66, "block6": 46, "block4": 26}
+blocks = helpers.BLOCKS
+
+
+def create_model(cut):
+    """
+    Create the model, freeze everything before the cut, & load the weights from the bottleneck model.
+
+    If there's no bottleneck model for the head (helpers.HEAD) the dense_first one is loaded instead - same shapes, so
+    it's just a warm start.
+
+    :param cut: Index of the first trainable layer
 
-for block in blocks:
-    file_name = f"xception_finetune_12_reg_75_{block}"
+    :return: model
+    """
+    # Create and load weights
+    base_model = Xception(include_top=False, weights=None)
+
+    # Add Custom FC
+    predictions = helpers.add_head(base_model.output)
 
     for layer in range(len(base_model.layers)):
-        if layer < 26:
+        if layer < cut:
             base_model.layers[layer].trainable = False
         else:
             base_model.layers[layer].trainable = True
@@ -86,32 +96,183 @@ for block in blocks:
     # Combine the base and layer
     # Load all weights from previously trained bottleneck
     model = models.Model(inputs=base_model.input, outputs=predictions)
-    model.load_weights("xception_bottleneck_12_reg_0075.h5")
+    bottleneck_weights = helpers.head_file_name(BOTTLENECK_WEIGHTS)
+    if not os.path.exists(bottleneck_weights):
+        print(f"No '{bottleneck_weights}' -> starting from '{BOTTLENECK_WEIGHTS}'")
+        bottleneck_weights = BOTTLENECK_WEIGHTS
+    model.load_weights(bottleneck_weights)
+
+    return model
+
 
-    # Compile and fit
+def compile_model(model):
+    """
+    Compile for fine tuning
+
+    :param model: model
+
+    :return: None
+    """
     # Look at the optimizer
     model.compile(loss="categorical_crossentropy",
                   optimizer=optimizers.SGD(lr=1e-4, momentum=0.9),
                   metrics=["accuracy"])
 
+
+def train_full(model, initial_epoch=0, callbacks=None):
+    """
+    Train the model on the images -> every step runs the whole network
+
+    :param model: model
+    :param initial_epoch: Epoch to start at (when resuming)
+    :param callbacks: List of keras callbacks
+
+    :return: history dict
+    """
+    compile_model(model)
+
+    # Resuming -> Carry on w/ the shuffle & augmentation of that epoch instead of starting from epoch 0's again
+    train_generator.set_epoch(initial_epoch)
+
     cnn_model = model.fit_generator(
                     train_generator,
+                    initial_epoch=initial_epoch,
                     epochs=NUM_EPOCHS,
-                    steps_per_epoch=train_images // BATCH_SIZE,
+                    callbacks=callbacks,
                     validation_data=validation_generator,
-                    validation_steps=validation_images // BATCH_SIZE,
+                    shuffle=False,
+                    **pipeline.fit_kwargs()
                     )
 
+    return cnn_model.history
+
+
+def train_cached(model, block, cut, initial_epoch=0, callbacks=None):
+    """
+    Only train the layers after the cut. The frozen layers before it are run over the images once and their output
+    is cached on disk (see bottleneck_features.py). The suffix is then trained straight off of the cache.
+
+    If REFRESH_EVERY > 0 the training cache is rebuilt every REFRESH_EVERY epochs from a new augmented pass over the
+    training set. Otherwise it's built once from the un-augmented images.
+
+    NOTE: The cache is made in inference mode so the frozen BatchNormalization layers use their moving stats. In
+    train_full keras runs them with the batch stats.
+
+    :param model: model
+    :param block: Name of block
+    :param cut: Index of the first trainable layer
+    :param initial_epoch: Epoch to start at (when resuming)
+    :param callbacks: List of keras callbacks
+
+    :return: history dict (only for the epochs run here)
+    """
+    prefix_model, suffix_model = bottleneck_features.split_model(model, cut)
+    compile_model(suffix_model)
+
+    train_store = os.path.join(PREFIX_DIR, block, "train")
+    validation_store = os.path.join(PREFIX_DIR, block, "validation")
+
+    # Cache is only valid for these frozen weights
+    weights_id = f"{os.path.abspath(BOTTLENECK_WEIGHTS)}@{os.path.getmtime(BOTTLENECK_WEIGHTS)}"
+
+    def make_generator(split, datagen):
+        if USE_SHARDS:
+            return lambda seed: shards.split_generator(split, datagen, BATCH_SIZE, seed=seed)
+        return lambda seed: pipeline.split_generator(split, datagen, BATCH_SIZE, seed=seed)
+
+    bottleneck_features.extract_features(prefix_model, make_generator("validation", test_datagen),
+                                         f"validation|{weights_id}|{cut}", validation_store, dtype=PREFIX_DTYPE)
+
+    refresh_every = REFRESH_EVERY if REFRESH_EVERY > 0 else NUM_EPOCHS
+    train_datagen_cached = train_datagen if REFRESH_EVERY > 0 else test_datagen
+
+    history = {}
+    for start_epoch in range(0, NUM_EPOCHS, refresh_every):
+        # Already done with this one
+        if start_epoch + refresh_every <= initial_epoch:
+            continue
+
+        # A new seed -> a new augmented pass over the training set
+        bottleneck_features.extract_features(prefix_model, make_generator("train", train_datagen_cached),
+                                             f"train|{weights_id}|{cut}", train_store, seed=42 + start_epoch,
+                                             dtype=PREFIX_DTYPE)
+
+        train_features = bottleneck_features.FeatureSequence(train_store, BATCH_SIZE, shuffle=True,
+                                                             seed=42 + start_epoch)
+        validation_features = bottleneck_features.FeatureSequence(validation_store, BATCH_SIZE)
+
+        # Resuming part way through -> The order the sequence would've gotten to (epochs count from start_epoch)
+        train_features.set_epoch(max(start_epoch, initial_epoch) - start_epoch)
+
+        cnn_model = suffix_model.fit_generator(
+                        train_features,
+                        initial_epoch=max(start_epoch, initial_epoch),
+                        epochs=min(start_epoch + refresh_every, NUM_EPOCHS),
+                        callbacks=callbacks,
+                        validation_data=validation_features,
+                        shuffle=False,
+                        **pipeline.fit_kwargs()
+                        )
+
+        for metric, values in cnn_model.history.items():
+            history.setdefault(metric, []).extend(values)
+
+    return history
+
+
+def train(model, block, cut, initial_epoch=0, callbacks=None):
+    """
+    Train the model for the block the way it's configured (CACHED_PREFIX)
+
+    :param model: model
+    :param block: Name of block
+    :param cut: Index of the first trainable layer
+    :param initial_epoch: Epoch to start at (when resuming)
+    :param callbacks: List of keras callbacks
+
+    :return: history dict
+    """
+    if CACHED_PREFIX:
+        return train_cached(model, block, cut, initial_epoch, callbacks)
+
+    return train_full(model, initial_epoch, callbacks)
+
+
+def save_results(model, block, history):
+    """
+    Save the model & the training/validation accuracy/loss for each epoch
+
+    :param model: Trained model
+    :param block: Name of block
+    :param history: history dict
+
+    :return: None
+    """
+    file_name = helpers.head_file_name(f"xception_finetune_12_reg_75_{block}")
+
     # Save the file
     print("Saving CNN as '{}'...".format(file_name))
     model.save(file_name + ".h5")
 
     # Save training/validation accuracy/loss
     val_loss_df = pd.DataFrame({
-        'train_acc': cnn_model.history["acc"],
-        'train_loss': cnn_model.history["loss"],
-        "val_acc": cnn_model.history["val_acc"],
-        "val_loss": cnn_model.history["val_loss"]
+        'train_acc': history["acc"],
+        'train_loss': history["loss"],
+        "val_acc": history["val_acc"],
+        "val_loss": history["val_loss"]
     })
     val_loss_df.to_csv(file_name + "val_loss.csv", sep=',')
 
+
+def main():
+    for block, cut in blocks.items():
+        model = create_model(cut)
+        history = train(model, block, cut)
+        save_results(model, block, history)
+
+        # Don't want the graphs for every block piling up
+        K.clear_session()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Fetches that fail aren't lost & don't stop the crawl.
+
+Every failure is appended to FAILURE_FILE (JSON Lines, see crawl_state.py) w/ the error & how many times it's been
+tried. Failures that might go away (couldn't connect, timed out, 429, 5xx...) are tried again in the background after
+an exponential backoff w/ jitter while the crawl keeps going:
+
+    wait = random between 0 and min(MAX_DELAY, BASE_DELAY * 2 ^ (attempts - 1))
+
+A page that's gotten on a retry ends up in the page cache (http_cache.py) -> the next run of the scraper gets it from
+there. Images are saved like any other.
+
+After MAX_ATTEMPTS (or straight away for e.g. a 404) it's a dead letter. The dead letters (& anything still waiting for
+a retry when the crawl ended) can be tried again w/o running the whole crawl:
+
+python retry_queue.py           -> What failed
+python retry_queue.py --drain   -> Try only the failures again
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import random
+import threading
+import time
+from collections import Counter
+from crawl_state import CrawlState
+
+FAILURE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "sculpture_data", "failed_fetches.jsonl")
+
+# Turn it off -> failures are only logged
+ENABLED = True
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 30
+MAX_DELAY = 30 * 60
+
+# Statuses worth trying again. Anything else that fails (e.g. 404) goes straight to the dead letters.
+RETRY_STATUSES = [408, 429, 500, 502, 503, 504]
+
+
+def backoff(attempts, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """
+    Seconds to wait before the next try -> Exponential backoff w/ full jitter (so retries don't all come at once)
+
+    :param attempts: # of tries so far
+    :param base_delay: Max wait after the first
+    :param max_delay: Max wait ever
+
+    :return: float
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempts - 1)))
+
+
+def retryable(status_code):
+    """
+    :param status_code: Status of the response (None if there wasn't one)
+    """
+    return status_code is None or status_code in RETRY_STATUSES
+
+
+class RetryQueue:
+    """
+    Durable queue of failed fetches. The last line for a url is its current state -> retrying, dead, or done.
+    """
+    def __init__(self, path=FAILURE_FILE, crawler=None, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY):
+        """
+        :param path: JSON Lines file
+        :param crawler: crawler.Crawler the retries are done w/. Default -> crawler.get_crawler()
+        :param max_attempts: Tries before it's a dead letter
+        :param base_delay: See backoff
+        :param max_delay: See backoff
+        """
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._crawler = crawler
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.log = CrawlState(path, key="url")
+        self.latest = {record['url']: record for record in self.log.records}
+        self.lock = threading.Lock()
+        self.scheduled = set()
+
+    @property
+    def crawler(self):
+        if self._crawler is None:
+            import crawler
+            self._crawler = crawler.get_crawler()
+        return self._crawler
+
+    def _add(self, entry):
+        self.log.add(entry)
+        self.latest[entry['url']] = entry
+
+    def failed(self, url, error, status_code=None, kind="page", user_agent=None, **context):
+        """
+        Record a failure & schedule the next try (if there is one)
+
+        :param url: What failed
+        :param error: Exception or message
+        :param status_code: Status of the response (None if there wasn't one)
+        :param kind: page or image
+        :param user_agent: User-Agent it was sent w/ (used again for the retries)
+        :param context: Anything else needed to try it again (e.g. file & db for images)
+
+        :return: dict of the entry
+        """
+        with self.lock:
+            previous = self.latest.get(url)
+            attempts = previous['attempts'] + 1 if previous is not None and previous['status'] != "done" else 1
+            retry = retryable(status_code) and attempts < self.max_attempts
+
+            entry = dict(context, url=url, kind=kind, error=repr(error) if isinstance(error, Exception) else error,
+                         status_code=status_code, attempts=attempts, user_agent=user_agent,
+                         status="retrying" if retry else "dead", time=time.time())
+            self._add(entry)
+
+        if retry:
+            # Not waited for by the crawl -> whatever is still waiting at the end is left for drain()
+            future = self.crawler.submit(self._retry(entry, backoff(attempts, self.base_delay, self.max_delay)),
+                                         tracked=False)
+            with self.lock:
+                self.scheduled.add(future)
+            future.add_done_callback(lambda done: self.scheduled.discard(done))
+
+        return entry
+
+    def succeeded(self, url):
+        """
+        Record that a url that failed before worked (nothing happens for one that never failed)
+        """
+        with self.lock:
+            previous = self.latest.get(url)
+            if previous is not None and previous['status'] != "done":
+                self._add(dict(previous, status="done", time=time.time()))
+
+    def pending(self):
+        """
+        :return: List of the entries that haven't worked (yet)
+        """
+        with self.lock:
+            return [entry for entry in self.latest.values() if entry['status'] != "done"]
+
+    async def _retry(self, entry, delay):
+        await asyncio.sleep(delay)
+        await self.attempt(entry)
+
+    async def attempt(self, entry):
+        """
+        Try an entry again (a failure goes through failed() as usual)
+        """
+        headers = {'User-Agent': entry['user_agent']} if entry.get('user_agent') else None
+
+        if entry['kind'] == "image":
+            await self.crawler.download_image(entry['file'], entry['url'], headers, entry['db'])
+        else:
+            await self.crawler.fetch(entry['url'], headers)
+
+    def wait(self):
+        """
+        Wait for every retry that's scheduled (incl. the ones they schedule)
+        """
+        while True:
+            with self.lock:
+                scheduled = list(self.scheduled)
+            if not scheduled:
+                return
+            concurrent.futures.wait(scheduled)
+
+    def drain(self):
+        """
+        Try every failure (dead letters included) again now & wait for them & any retries that follow
+
+        :return: Counter of the states after
+        """
+        entries = self.pending()
+        print(f"Trying {len(entries)} failures again")
+
+        async def attempt_all():
+            await asyncio.gather(*[self.attempt(entry) for entry in entries])
+
+        self.crawler.run(attempt_all())
+        self.crawler.wait()
+        self.wait()
+
+        return Counter(self.latest[entry['url']]['status'] for entry in entries)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """
+    The queue shared by helpers & the crawler (None if it's turned off)
+    """
+    global _queue
+    with _queue_lock:
+        if ENABLED and _queue is None:
+            _queue = RetryQueue()
+
+    return _queue if ENABLED else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or retry the failed fetches")
+    parser.add_argument("--drain", action="store_true", help="Try only the failures again")
+    args = parser.parse_args()
+
+    queue = get_queue()
+    pending = queue.pending()
+
+    print(Counter(entry['status'] for entry in queue.latest.values()))
+    for entry in pending:
+        print(f"{entry['status']:8s} {entry['attempts']} {entry['kind']:5s} {entry['url']} - {entry['error']}")
+
+    if args.drain and pending:
+        print(dict(queue.drain()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Check crawler.py against local stand-ins for the sites (nothing is sent to the real ones):
+- Requests to a host are never closer together than its crawl delay
+- Different hosts (e.g. a site & its image CDN) are fetched at the same time
+- Connections are kept alive & reused
+and compare the time taken with the old way (a new connection & a sleep after every request).
+
+Every stand-in is a local HTTP server on its own port -> its own host as far as the crawler is concerned.
+
+python benchmark_crawler.py [--pages 10] [--delay 0.5]
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import requests
+
+import crawler
+
+HOSTS = ["site", "cdn", "other_site"]
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.times = []
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Needed for keep-alive
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.times.append(time.monotonic())
+            self.server.connections.add(self.client_address)
+
+        body = self.path.encode() * 100
+        self.send_response(200 if not self.path.startswith("/missing") else 404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_servers():
+    servers = {}
+    for name in HOSTS:
+        servers[name] = StandInServer()
+        threading.Thread(target=servers[name].serve_forever, daemon=True).start()
+
+    return servers
+
+
+def reset(servers):
+    for server in servers.values():
+        server.times, server.connections = [], set()
+
+
+def old_way(urls, delay):
+    """
+    What helpers.get_page does -> new connection & sleep after every request
+    """
+    for url in urls:
+        requests.get(url, timeout=5)
+        time.sleep(delay)
+
+
+def check(servers, delays):
+    """
+    :return: Smallest gap between 2 requests to each host & # of connections each used
+    """
+    results = {}
+    for name, server in servers.items():
+        gaps = [b - a for a, b in zip(server.times, server.times[1:])]
+        results[name] = (min(gaps) if gaps else 0, len(server.connections))
+        # The gaps are measured when the requests arrive -> allow a little jitter from the threads/network
+        assert min(gaps) >= delays[server.host] - 0.02, f"{name} was hit faster than its crawl delay"
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check & benchmark crawler.py against local stand-in servers")
+    parser.add_argument("--pages", type=int, default=10, help="# of pages from each host")
+    parser.add_argument("--delay", type=float, default=0.5, help="Crawl delay of the first host (the rest are faster)")
+    args = parser.parse_args()
+
+    servers = start_servers()
+    delays = {server.host: args.delay / (i + 1) for i, server in enumerate(servers.values())}
+    urls = [f"http://{server.host}/page_{page}" for page in range(args.pages) for server in servers.values()]
+
+    start = time.perf_counter()
+    old_way(urls, args.delay)
+    old_seconds = time.perf_counter() - start
+    reset(servers)
+
+    engine = crawler.Crawler(delays=delays, error_log="/dev/null")
+    start = time.perf_counter()
+    responses = engine.run(engine.fetch_all(urls))
+    new_seconds = time.perf_counter() - start
+
+    assert all(response is not None and response.content == url[url.rfind("/"):].encode() * 100
+               for url, response in zip(urls, responses)), "Wrong response"
+    results = check(servers, delays)
+
+    # Bad status -> still returned (like helpers.get_page). Nothing listening -> None
+    assert engine.get(f"http://{servers['site'].host}/missing").status_code == 404
+    assert engine.get("http://127.0.0.1:1/nothing") is None
+    engine.close()
+
+    print(f"{'Host':12s} {'Delay':>7s} {'Min gap':>8s} {'Connections':>12s}")
+    for name, server in servers.items():
+        print(f"{name:12s} {delays[server.host]:6.2f}s {results[name][0]:7.2f}s {results[name][1]:12d}")
+
+    # Slowest host decides how long it takes
+    best = max(delays.values()) * (args.pages - 1)
+    print(f"\nOld way:  {old_seconds:.2f}s")
+    print(f"Crawler:  {new_seconds:.2f}s ({old_seconds / new_seconds:.1f}x) - slowest host alone needs {best:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Compare how long html_extract.py takes against the BeautifulSoup code the scrapers used before (and for the big pages
+the memory each needs). That both give the same thing is checked on saved pages in tests/test_html_extract.py.
+
+The pages are made up to look like the real ones (same tags, attributes & encodings). The WGA artist listing & the
+WikiArt list are made big like the real ones (max=50000 & every sculpture loaded).
+
+Memory is what tracemalloc sees -> only python objects. That's the whole cost of BeautifulSoup & of the streaming
+parsers (they never build a tree) but not of an lxml tree, so it's only given for the big pages.
+
+python benchmark_parsers.py [--artists 20000] [--sculptures 5000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from html import escape
+import pandas as pd
+from bs4 import BeautifulSoup
+
+import html_extract
+
+FIRST_NAMES = ["Gian Lorenzo", "Antonio", "Jean-Antoine", "Eugène-Emmanuel", "Jérôme", "Mário", "Agostino", "Hans",
+               "François", "Tilman"]
+LAST_NAMES = ["BERNINI", "CANOVA", "HOUDON", "VIOLLET-LE-DUC", "DUQUESNOY", "GÓMEZ", "DI DUCCIO", "MÜLLER",
+              "RUDE", "RIEMENSCHNEIDER"]
+PERIODS = ["Baroque", "Medieval", "Renaissance", "Mannerism", "Neoclassicism", "Romanticism", "Realism"]
+
+
+#################################################################
+# The old code (as it was in the scrapers)
+#################################################################
+
+def old_artist_page(page):
+    soup = BeautifulSoup(page, "lxml", from_encoding="ISO-8859-1")
+    table = soup.find_all('table', {'style': 'border: 0;', 'border': "1", "cellpadding": "4", "width": "700"})[0]
+    trs = table.find_all('tr')[1:]
+
+    artists = []
+    for tr in trs:
+        tds = tr.find_all('td')
+        artists.append({'Artist': tds[1].get_text(), 'Period': tds[3].get_text()})
+
+    return pd.DataFrame(artists)
+
+
+def old_wga_sculpture_page(content):
+    soup = BeautifulSoup(content, 'lxml')
+    name = soup.findAll("div", {"class": "INDEX2"})[0].text
+    td = soup.findAll("td", {'width': "30%"})[0]
+
+    return name, td.find("a")["href"]
+
+
+def old_wikiart_sculpture_page(content):
+    soup = BeautifulSoup(content, "lxml")
+    style = soup.findAll("li", {"class": "dictionary-values"})[0].text
+    style = style[style.find(":") + 1:].strip()
+
+    image_links = soup.findAll("main", {"ng-controller": "ArtworkViewCtrl"})[0]['ng-init']
+    image_dict = json.loads(image_links[image_links.find("=") + 2:-1])
+    original = [url for url in image_dict["ImageThumbnailsModel"][0]["Thumbnails"] if url['Name'] == 'Original'][0]
+
+    return style, original['Url']
+
+
+def old_wikiart_sculpture_list(path):
+    # Was opened w/ the default encoding -> utf-8 here so it doesn't depend on the machine
+    with open(path, encoding="utf-8") as file:
+        soup = BeautifulSoup(file.read(), "lxml")
+
+    artists = soup.findAll("a", {"target": "_self", "class": "artist-name ng-binding"})
+    artists = [artist.text[:artist.text.find('\xa0•')].strip() for artist in artists]
+
+    titles = soup.findAll("a", {"target": "_self", "class": "artwork-name ng-binding"})
+    sculpt_titles = [title.text.strip() for title in titles]
+    sculpt_links = [title['href'] for title in titles]
+
+    lis = soup.findAll("li", {"class": "ng-scope"})
+    images = [li.find("img")['ng-src'] for li in lis]
+    images = [image[image.rfind("/") + 1:] for image in images]
+
+    return {'artists': artists, 'titles': sculpt_titles, "links":  sculpt_links, 'images': images}
+
+
+def old_nga_page(content):
+    return [(sculpt.find_all("dt")[0].text, sculpt.find_all("dt")[1].text, sculpt.find("img")['src'])
+            for sculpt in BeautifulSoup(content, "lxml").findAll("li", {"class": "art"})]
+
+
+def new_nga_page(content):
+    return [html_extract.nga_sculpture(sculpt) for sculpt in html_extract.nga_sculptures(content)]
+
+
+#################################################################
+# Made up pages
+#################################################################
+
+def artist_name(rng):
+    return f"{rng.choice(LAST_NAMES)}, {rng.choice(FIRST_NAMES)}"
+
+
+def make_artist_page(rows, seed=42):
+    """
+    WGA artist listing -> ISO-8859-1 bytes. A layout table before the one wanted & tags left open like on the site.
+    """
+    rng = random.Random(seed)
+    lines = ['<html><head><title>Artists</title></head><body>',
+             '<table border="0" width="700"><tr><td><a href="/index.html">Home</a></td></tr></table>',
+             '<table style="border: 0;" border="1" cellpadding="4" width="700">',
+             '<tr><td><b>#</b></td><td><b>ARTIST</b></td><td><b>BORN-DIED</b></td><td><b>PERIOD</b></td>'
+             '<td><b>SCHOOL</b></td></tr>']
+    for i in range(rows):
+        name = artist_name(rng)
+        lines.append(f'<tr><td>{i}<td><a href="/html/{name[0].lower()}/{i}.html"><b>{escape(name)}</b></a>\n'
+                     f'<td>(b. 1{rng.randint(200, 899)}, Firenze)<td>{rng.choice(PERIODS)}</td>'
+                     f'<td><i>Italian</i> &amp; sculptor</td></tr>')
+    lines.append('</table><table style="border: 0;" border="1" cellpadding="4" width="700"><tr><td>Not this one'
+                 '</td></tr></table></body></html>')
+
+    return "\n".join(lines).encode("ISO-8859-1")
+
+
+def make_wga_sculpture_page(rng):
+    name = artist_name(rng)
+    return (f'<html><head><meta http-equiv="Content-Type" content="text/html; charset=iso-8859-1"></head><body>'
+            f'<table><tr><td width="70%"><a href="/index.html">Home</a></td>'
+            f'<td width="30%"><a href="/art/b/bernini/{rng.randint(0, 999)}.jpg"><img src="/detail.jpg"></a></td>'
+            f'</tr></table><div class="INDEX2 big">{escape(name)}</div><div class="INDEX2">Other</div></body></html>'
+            ).encode("ISO-8859-1")
+
+
+def make_wikiart_sculpture_page(rng):
+    thumbnails = [{"Name": name, "Url": f"https://uploads.wikiart.org/images/{rng.randint(0, 9999)}{suffix}.jpg"}
+                  for name, suffix in [("PinterestSmall", "!PinterestSmall"), ("Original", ""), ("Large", "!Large")]]
+    model = json.dumps({"ImageThumbnailsModel": [{"Thumbnails": thumbnails}], "Title": "Pietà – Saint Jérôme"})
+
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>'
+            f'<main ng-controller="ArtworkViewCtrl" ng-init="vm.init = {escape(model)};"><article><ul>'
+            f'<li class="dictionary-values dictionary-values-genre"><s>Style:</s>\n <span><a href="/s">'
+            f'{rng.choice(PERIODS)}</a></span>\n</li><li class="dictionary-values"><s>Genre:</s> sculpture</li>'
+            f'</ul></article></main></body></html>').encode("utf-8")
+
+
+def make_nga_page(rng, sculptures=24):
+    lis = []
+    for i in range(sculptures):
+        classes = "art" if i % 3 else "art even"
+        lis.append(f'<li class="{classes}"><a href="/collection/art-object-page.{i}.html">'
+                   f'<img src="https://media.nga.gov/iiif/public/objects/{i}/primary-0/{i}-primary-0-nativeres.jpg">'
+                   f'</a><dl><dt>{escape(artist_name(rng))}</dt><dt><em>Bust {i}</em>, 1{rng.randint(500, 899)}</dt>'
+                   f'<dd>bronze</dd></dl></li>')
+
+    return (f'<html><body><ul class="returns"><li class="facet">Style</li>{"".join(lis)}</ul></body></html>'
+            ).encode("utf-8")
+
+
+def make_wikiart_list(sculptures, seed=42):
+    """
+    Saved WikiArt sculpture listing w/ every sculpture loaded (angular leaves ng-scope all over the place)
+    """
+    rng = random.Random(seed)
+    lis = []
+    for i in range(sculptures):
+        image = f"https://uploads.wikiart.org/images/{i}/sculpture-{i}.jpg!PinterestSmall.jpg"
+        lis.append(f'<li class="ng-scope" ng-repeat="painting in paintings"><div class="title-block">'
+                   f'<a class="artwork-name ng-binding" target="_self" href="/en/artist/sculpture-{i}">'
+                   f'\n  Pietà nº {i}\n</a><a class="artist-name ng-binding" target="_self" href="/en/artist">'
+                   f'{escape(artist_name(rng))}\xa0• {rng.randint(1300, 1900)}</a></div>'
+                   f'<a class="image-wrapper" href="/en/artist/sculpture-{i}"><img ng-src="{image}" src="{image}">'
+                   f'<img ng-src="/other.png"></a></li>')
+
+    return (f'<html><head><meta charset="utf-8"></head><body><div class="ng-scope"><ul class="wiki-masonry">'
+            f'{"".join(lis)}</ul></div></body></html>')
+
+
+#################################################################
+# Benchmark
+#################################################################
+
+def timed(function, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(arg)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def peak_memory(function, arg):
+    tracemalloc.start()
+    function(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def compare(name, old, new, arg, repeat, memory=False):
+    _, old_seconds = timed(old, arg, repeat)
+    _, new_seconds = timed(new, arg, repeat)
+
+    line = f"{name:24s} {old_seconds:8.3f}s {new_seconds:8.3f}s {old_seconds / new_seconds:6.1f}x"
+    if memory:
+        line += f" {peak_memory(old, arg):9.1f}MB {peak_memory(new, arg):9.1f}MB"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the html parsing of the scrapers")
+    parser.add_argument("--artists", type=int, default=20000, help="Rows of the WGA artist listing")
+    parser.add_argument("--sculptures", type=int, default=5000, help="Sculptures in the WikiArt list")
+    parser.add_argument("--pages", type=int, default=200, help="# of each of the small pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    artist_page = make_artist_page(args.artists)
+    wga_pages = [make_wga_sculpture_page(rng) for _ in range(args.pages)]
+    wikiart_pages = [make_wikiart_sculpture_page(rng) for _ in range(args.pages)]
+    nga_pages = [make_nga_page(rng) for _ in range(args.pages // 10 + 1)]
+
+    print(f"{'':24s} {'Before':>9s} {'Now':>9s} {'':7s} {'Mem before':>11s} {'Mem now':>11s}")
+
+    compare(f"WGA artists ({len(artist_page) // 1024}KB)", old_artist_page,
+            lambda page: pd.DataFrame(html_extract.artist_rows(page)), artist_page, args.repeat, memory=True)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "WikiArt.html")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(make_wikiart_list(args.sculptures))
+
+        compare(f"WikiArt list ({os.path.getsize(path) // 1024}KB)", old_wikiart_sculpture_list,
+                html_extract.wikiart_sculpture_list, path, args.repeat, memory=True)
+
+    # Small pages -> All of them at a time
+    compare(f"WGA sculptures ({len(wga_pages)})", lambda pages: [old_wga_sculpture_page(page) for page in pages],
+            lambda pages: [html_extract.wga_sculpture_page(page) for page in pages], wga_pages, args.repeat)
+    compare(f"WikiArt sculptures ({len(wikiart_pages)})",
+            lambda pages: [old_wikiart_sculpture_page(page) for page in pages],
+            lambda pages: [html_extract.wikiart_sculpture_page(page) for page in pages], wikiart_pages, args.repeat)
+    compare(f"NGA listings ({len(nga_pages)})", lambda pages: [old_nga_page(page) for page in pages],
+            lambda pages: [new_nga_page(page) for page in pages], nga_pages, args.repeat)
+
+    # What the browser hands back is a str
+    compare("NGA listing (str)", old_nga_page, new_nga_page, nga_pages[0].decode("utf-8"), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,102 @@ Scrape the sculpture pages and info off of the NGA database
 NOTE: Robots.txt specifies 10 seconds 
 """
 import pandas as pd
-from bs4 import BeautifulSoup
 from fake_useragent import UserAgent
-import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from helpers import *
+from crawl_state import CrawlState
+from crawler import get_page, scrape_image, wait_for_downloads, wait_turn
+from html_extract import nga_sculpture, nga_sculptures
+from metadata_store import get_store
 
-# Selenium bullshit - 2nd/3rd line is for custom User-Agent
+# Selenium bullshit
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.options import Options
-opts = Options()
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Headless browsers kept open for all the pages
+BROWSERS = 2
+
+# Max seconds to wait for the sculptures to show up on a page
+PAGE_TIMEOUT = 30
+
+# Try a plain request first -> only use a browser when the listing needs the javascript
+TRY_HTTP = True
+TRY_HTTP_LOCK = threading.Lock()
+
+
+class BrowserPool:
+    """
+    Headless Chrome sessions that are started once (when first needed) & reused for every page
+    """
+    def __init__(self, size, fake_user):
+        """
+        :param size: Max # of browsers
+        :param fake_user: Fake User Object -> each browser gets its own User-Agent
+        """
+        self.size = size
+        self.fake_user = fake_user
+        self.idle = queue.Queue()
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def _start(self):
+        opts = Options()
+        opts.add_argument("--headless")
+        opts.add_argument("--disable-gpu")
+        opts.add_argument(f"user-agent={self.fake_user.random}")
+
+        browser = webdriver.Chrome(chrome_options=opts)
+        browser.set_page_load_timeout(PAGE_TIMEOUT)
+
+        return browser
+
+    @contextmanager
+    def browser(self):
+        """
+        Borrow a browser. One that breaks is thrown away & a new one is started the next time.
+        """
+        with self.lock:
+            start = self.idle.empty() and self.started < self.size
+            if start:
+                self.started += 1
+
+        try:
+            browser = self._start() if start else self.idle.get()
+        except Exception:
+            with self.lock:
+                self.started -= 1
+            raise
+
+        broken = False
+        try:
+            yield browser
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            if broken:
+                browser.quit()
+                with self.lock:
+                    self.started -= 1
+            else:
+                self.idle.put(browser)
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get().quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 def parse_sculpture(sculpt):
@@ -22,13 +109,8 @@ def parse_sculpture(sculpt):
 
     :return: name, title, image_url
     """
-    # Image link
-    image_url = sculpt.find("img")['src']
-
-    # Get Name and Title of Sculpture
-    dt_tags = sculpt.find_all("dt")
-    name = dt_tags[0].text
-    title = dt_tags[1].text
+    # Name, Title & Image link
+    name, title, image_url = nga_sculpture(sculpt)
 
     # Fix image url -> To get bigger image
     image_url = image_url[:image_url.find("primary-0") + len("primary-0") + 1] + "440x400.jpg"
@@ -38,37 +120,73 @@ def parse_sculpture(sculpt):
     return name, title, image_url
 
 
-def parse_page(style, page_num, fake_user):
+def page_url(style, page_num):
+    return f"{style}".join(["https://www.nga.gov/collection-search-result.html?artobj_imagesonly=Images_online&artobj_"
+                            "classification=sculpture&artobj_style=",
+                            f"&pageNumber={page_num+1}&lastFacet=artobj_style"])
+
+
+def parse_page_http(url, fake_user):
+    """
+    Get the page w/o a browser
+
+    :return: list of <li> tags (empty if they're only added by javascript). None if the request failed.
+    """
+    response = get_page(url, fake_user)
+    return nga_sculptures(response.content) if response is not None else None
+
+
+def parse_page_browser(url, pool):
+    """
+    Get the page w/ one of the browsers -> To deal with dynamic content
+
+    :return: list of <li> tags
+    """
+    # Still keep to the crawl delay
+    wait_turn(url)
+
+    with pool.browser() as browser:
+        browser.get(url)
+
+        # Done once the sculptures are there
+        try:
+            WebDriverWait(browser, PAGE_TIMEOUT).until(
+                expected_conditions.presence_of_all_elements_located((By.CSS_SELECTOR, "li.art")))
+        except TimeoutException:
+            print(f"No sculptures showed up on {url}")
+
+        return nga_sculptures(browser.page_source)
+
+
+def parse_page(style, page_num, fake_user, pool):
     """
     Get the basic stuff needed for a given style/page
     
     :param style: Style to be scraped
     :param page_num: Page #
     :param fake_user: Fake User Object
+    :param pool: BrowserPool
     
     :return: list of <li> tags
     """
-    url = f"{style}".join(["https://www.nga.gov/collection-search-result.html?artobj_imagesonly=Images_online&artobj_"
-                           "classification=sculpture&artobj_style=", f"&pageNumber={page_num+1}&lastFacet=artobj_style"])
-
-    # Custom User-Agent
-    opts.add_argument(fake_user.random)
+    global TRY_HTTP
 
-    # Get given url and html
-    # To deal with dynamic content
-    browser = webdriver.Chrome(chrome_options=opts)
-    browser.get(url)
+    url = page_url(style, page_num)
 
-    # Pass for 10 seconds
-    time.sleep(10)
+    if TRY_HTTP:
+        li_tags = parse_page_http(url, fake_user)
+        if li_tags:
+            return li_tags
 
-    soup = BeautifulSoup(browser.page_source, "lxml")
+        # Only a page that came back w/o any sculptures means the listing needs the javascript -> don't bother for
+        # the rest of the pages. A failed request just gets the browser this once.
+        if li_tags is not None:
+            with TRY_HTTP_LOCK:
+                if TRY_HTTP:
+                    print("NGA listing isn't served w/o javascript -> Using the browsers")
+                    TRY_HTTP = False
 
-    # Destroy the object
-    browser.quit()
-
-    # List of sculptures
-    return soup.findAll("li", {"class": "art"})
+    return parse_page_browser(url, pool)
 
 
 def parse_styles(fake_user):
@@ -84,12 +202,16 @@ def parse_styles(fake_user):
 
     # My name, NGA name, and # of pages
     styles = [["Minimalism", "Minimalist", 3], ["Realism", "Realist", 4], ["Impressionism", "Impressionist", 4]]
+    pages = [(style, page_num) for style in styles for page_num in range(style[2])]
 
-    for style in styles:
-        for page_num in range(style[2]):
-            print(f"Scraping {style[1]} page {page_num+1}")
-            li_tags = parse_page(style[1], page_num, fake_user)
+    def scrape(page):
+        style, page_num = page
+        print(f"Scraping {style[1]} page {page_num+1}")
+        return parse_page(style[1], page_num, fake_user, pool)
 
+    # The pages are still requested one per crawl delay but a slow page doesn't hold up the next
+    with BrowserPool(BROWSERS, fake_user) as pool, ThreadPoolExecutor(max_workers=BROWSERS) as executor:
+        for (style, _), li_tags in zip(pages, executor.map(scrape, pages)):
             # Iterate through sculptures on given page
             for sculpt in li_tags:
                 name, title, image_url = parse_sculpture(sculpt)
@@ -112,11 +234,8 @@ def get_data():
     # e.g. 0005, 0050, 0467, 2350...etc.
     file_num = 0
 
-    # Load data already processed
-    processed_sculptures = json.loads(open("../../../sculpture_data/nga/sculptures/nga_sculpture_data.json", 'r').read())['data']
-
-    # Get files already processed - can easily look if scraped
-    files_processed = [x['file'] for x in processed_sculptures]
+    # Data already processed - can easily look if scraped
+    state = CrawlState("../../../sculpture_data/nga/sculptures/nga_sculpture_data.jsonl")
 
     # Raw data for each sculpture
     raw_data = parse_styles(fake_user)
@@ -125,26 +244,31 @@ def get_data():
         file_name = "".join(["nga_", format(file_num, '04d'), ".jpg"])
 
         # If we already parsed and scraped - don't bother
-        if file_name not in files_processed:
+        if file_name not in state:
             print(file_name)
 
             # Scrape and Save image
             scrape_image(file_name, sculpture['url'], fake_user, "nga")
 
             # Add to master list
-            processed_sculptures.append({'Author': sculpture['Author'],
-                                         "title": sculpture['title'],
-                                         'file': file_name,
-                                         'url': sculpture['url'],
-                                         'Period': sculpture['Period']})
-
-            # Dump over new json to file
-            with open("../../../sculpture_data/nga/sculptures/nga_sculpture_data.json", "w+") as file:
-                json.dump({"data": processed_sculptures}, file)
+            state.add({'Author': sculpture['Author'],
+                       "title": sculpture['title'],
+                       'file': file_name,
+                       'url': sculpture['url'],
+                       'Period': sculpture['Period']})
+        elif not if_image_exists(file_name, "nga"):
+            # Recorded but the image was never saved (e.g. killed before its download finished)
+            print(file_name, "- image missing")
+            scrape_image(file_name, sculpture['url'], fake_user, "nga")
 
         file_num += 1
 
-    df = pd.DataFrame(processed_sculptures)
+    # Images are downloaded in the background
+    wait_for_downloads()
+    state.close()
+
+    df = state.to_frame()
+    get_store().write_sculptures("nga", df)
     df.to_csv('../../../sculpture_data/nga/sculptures/nga_sculpture_periods.csv', sep=',')
 
     return df
@@ -10,10 +10,12 @@ Note: The catalog is downloaded from their website - https://www.wga.hu/index1.h
 """
 
 import pandas as pd
-from bs4 import BeautifulSoup
 from fake_useragent import UserAgent
-import json
 from helpers import *
+from crawl_state import CrawlState
+from crawler import get_page, scrape_image, wait_for_downloads
+from html_extract import wga_sculpture_page
+from metadata_store import get_store
 
 
 def fix_artist_name(name):
@@ -51,18 +53,16 @@ def parse_sculpture_page(url, fake_user, file_name):
     :param url: url for given sculpture 
     :param fake_user: Fake user agent object
     
-    :return: artist name for sculpture
+    :return: artist name for sculpture (None if the page couldn't be gotten)
     """
-    # Get and soupify page
-    soup = BeautifulSoup(get_page(url, fake_user).content, 'lxml')
-
-    # Get Artist Name (name from catalog.csv is fucked up)
-    name = soup.findAll("div", {"class": "INDEX2"})[0].text
-
-    # Image Url
-    # Only one matching td tag
-    td = soup.findAll("td", {'width': "30%"})[0]
-    image_url_base = td.find("a")["href"]
+    # Get and parse page
+    # If it failed it's retried in the background (see retry_queue.py) & the next run picks it up
+    response = get_page(url, fake_user)
+    if response is None:
+        return None
+
+    # Get Artist Name (name from catalog.csv is fucked up) & Image Url
+    name, image_url_base = wga_sculpture_page(response.content)
     url = ''.join(["https://www.wga.hu", image_url_base])
 
     # Check to see if we want to scrape and save the image
@@ -98,11 +98,8 @@ def get_data():
     # e.g. 0005, 0050, 0467, 2350...etc.
     file_num = 0
 
-    # Load data already processed
-    processed_sculptures = json.loads(open("../../../sculpture_data/wga/sculptures/wga_sculpture_data.json", 'r').read())['data']
-
-    # Get files already processed - can easily look if scraped
-    files_processed = [x['file'] for x in processed_sculptures]
+    # Data already processed - can easily look if scraped
+    state = CrawlState("../../../sculpture_data/wga/sculptures/wga_sculpture_data.jsonl")
 
     # Iterate through data
     # Create new DataFrame and save data
@@ -110,47 +107,56 @@ def get_data():
         file_name = "".join(["wga_", format(file_num, '04d'), ".jpg"])
 
         # If we already parsed and scraped - don't bother
-        if file_name not in files_processed:
+        if file_name not in state:
             print(file_name)
 
             # Parse and append
             name = parse_sculpture_page(sculpture['URL'], fake_user, file_name)
-            processed_sculptures.append({'Author': name, "title": sculpture['TITLE'], 'file': file_name, 'url': sculpture['URL']})
-
-            # Dump over new json to file
-            with open("../../../sculpture_data/wga/sculptures/wga_sculpture_data.json", "w+") as file:
-                json.dump({"data": processed_sculptures}, file)
+            if name is not None:
+                state.add({'Author': name, "title": sculpture['TITLE'], 'file': file_name, 'url': sculpture['URL']})
+        elif not if_image_exists(file_name, "wga"):
+            # Recorded but the image was never saved (e.g. killed before its download finished) -> Parse the page
+            # again (it's cached) for the image
+            print(file_name, "- image missing")
+            parse_sculpture_page(sculpture['URL'], fake_user, file_name)
 
         file_num += 1
 
-    return merge_sculpture_artist(pd.DataFrame(processed_sculptures))
+    # Images are downloaded in the background
+    wait_for_downloads()
+    state.close()
+
+    return merge_sculpture_artist(state.to_frame())
 
 
 def merge_sculpture_artist(sculpture_df):
     """
-    Merge the DataFrame with the sculpture info with "wga_artists.csv" to get the period for each sculpture
+    Get the period for each sculpture from the artists in the metadata store (see scrape_artists)
     
-    Deposit the end result in -> 'wgu_sculpture_periods.csv'
+    Deposit the end result in the store & -> 'wgu_sculpture_periods.csv'
     
     :param sculpture_df: DataFrame of info for each sculpture
     
     :return: None
     """
-    artist_df = pd.read_csv("../../../sculpture_data/wga/sculptures/wga_artists.csv", index_col=0)
-    artist_df = artist_df.rename(index=str, columns={"Artist": "Author"})
+    store = get_store()
+
+    # Artists scraped before the store -> from wga_artists.csv
+    store.import_missing()
 
     # Deal with inconsistent names
-    sculpture_df['Author'] = sculpture_df.apply(lambda row: fix_artist_name(row['Author']), axis=1)
+    sculpture_df['Author'] = sculpture_df['Author'].map(fix_artist_name)
 
-    # Merge and drop the couple of duplicates (only 3 examples)
-    df = pd.merge(sculpture_df, artist_df, how="left", on="Author")
-    df = df.drop_duplicates(subset=['file'])
+    # Indexed lookup of only these artists. An artist listed more than once (only 3 examples) -> the first one.
+    df = sculpture_df.drop_duplicates(subset=['file']).copy()
+    df['Period'] = df['Author'].map(store.artist_periods("wga", df['Author'].dropna().unique()))
 
     # Can fill in Period for these though we don't know the name
-    df['Period'] = df.apply(lambda row: "Medieval" if "MEDIEVAL" in row['Author'] else row['Period'], axis=1)
+    df['Period'] = df['Period'].where(~df['Author'].str.contains("MEDIEVAL", regex=False, na=False), "Medieval")
 
     df = df[~df['title'].str.contains("(detail)")]
 
+    store.write_sculptures("wga", df)
     df.to_csv('../../../sculpture_data/wga/sculptures/wga_sculpture_periods.csv', sep=',')
 
 
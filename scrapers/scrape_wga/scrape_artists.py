@@ -1,10 +1,12 @@
 """
 Scrape the artist info for the Web Gallery of Art database and deposit in a CSV (wga_artists.csv).
 """
-from bs4 import BeautifulSoup
 import pandas as pd
 from fake_useragent import UserAgent
 from helpers import *
+from crawler import get_page
+from html_extract import artist_rows
+from metadata_store import get_store
 
 
 def create_artist_url(art_period):
@@ -27,22 +29,9 @@ def parse_artist_page(page):
     
     :return: DataFrame of artist info for that page
     """
-    # Encoding is different from individual sculpture pages
-    soup = BeautifulSoup(page, "lxml", from_encoding="ISO-8859-1")
-
-    # Only 1 of this table on page
-    table = soup.find_all('table', {'style': 'border: 0;', 'border': "1", "cellpadding": "4", "width": "700"})[0]
-
-    # First row are the cols
-    trs = table.find_all('tr')[1:]
-
-    # Get All Artists
-    artists = []
-    for tr in trs:
-        tds = tr.find_all('td')
-        artists.append({'Artist': tds[1].get_text(), 'Period': tds[3].get_text()})
-
-    return pd.DataFrame(artists)
+    # Encoding is different from individual sculpture pages (ISO-8859-1). Pages are huge (max=50000) -> only the
+    # table is kept, never the whole page.
+    return pd.DataFrame(artist_rows(page))
 
 
 def convert_artists():
@@ -65,13 +54,18 @@ def convert_artists():
     for period in periods:
         print("Scraping", period)
         response = get_page(create_artist_url(period), fake_user)
+        if response is None:
+            # Retried in the background (see retry_queue.py) -> Run again once it's been gotten
+            print(f"Couldn't get the artists for {period}. wga_artists.csv won't have them.")
+            continue
         dfs.append(parse_artist_page(response.content))
 
     # Combine all individual DataFrames and reset
     artists_df = pd.concat(dfs)
     artists_df = artists_df.reset_index(drop=True)
 
-    # Write to file -> wga_artists.csv
+    # Into the metadata store (looked up by process_sculptures) & to file -> wga_artists.csv
+    get_store().write_artists("wga", artists_df)
     artists_df.to_csv("../../../sculpture_data/wga/sculptures/wga_artists.csv", sep=',')
 
 
@@ -2,12 +2,14 @@
 Scrape the sculpture pages and info off of the WikiArt database
 """
 
-from bs4 import BeautifulSoup
-import json
 import pandas as pd
 from fake_useragent import UserAgent
 import os
 from helpers import *
+from crawl_state import CrawlState
+from crawler import get_page, scrape_image, wait_for_downloads
+from html_extract import wikiart_sculpture_list, wikiart_sculpture_page
+from metadata_store import get_store
 
 
 def parse_sculpture_page(sculpture_url, file_name, fake_user):
@@ -18,27 +20,19 @@ def parse_sculpture_page(sculpture_url, file_name, fake_user):
     :param file_name: Given file_name for the new image
     :param fake_user: Fake User object
     
-    :return: style - String
+    :return: style - String (None if the page couldn't be gotten)
     """
-    soup = BeautifulSoup(get_page(sculpture_url, fake_user).content, "lxml")
+    # If it failed it's retried in the background (see retry_queue.py) & the next run picks it up
+    response = get_page(sculpture_url, fake_user)
+    if response is None:
+        return None
 
-    # Get Style of Sculpture
-    style = soup.findAll("li", {"class": "dictionary-values"})[0].text
-    style = style[style.find(":") + 1:].strip()
-
-    # Get the link to the original image
-    image_links = soup.findAll("main", {"ng-controller": "ArtworkViewCtrl"})[0]['ng-init']
-
-    # Dict of different types of images...there's a semicolon at the end
-    string_dict = image_links[image_links.find("=") + 2:-1]
-    image_dict = json.loads(string_dict)
-
-    # We want the image marked 'original'
-    original_image_link = [url for url in image_dict["ImageThumbnailsModel"][0]["Thumbnails"] if url['Name'] == 'Original'][0]
+    # Get Style of Sculpture & the link to the original image
+    style, original_image_link = wikiart_sculpture_page(response.content)
 
     # Get & save image - using file_num
     # Only scrape if not saved already
-    scrape_image(file_name, original_image_link['Url'], fake_user, "wikiart")
+    scrape_image(file_name, original_image_link, fake_user, "wikiart")
 
     return style
 
@@ -59,32 +53,13 @@ def parse_sculpture_list():
     
     :return: Dict - with the lists of 4 pieces of info above
     """
-    try:
-        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "WikiArt.html")) as file:
-            sculpt_file = file.read()
-    except FileNotFoundError:
+    sculpt_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "WikiArt.html")
+    if not os.path.isfile(sculpt_file):
         raise Exception("The Wikiart.html file needs to be placed in this directory",
                         os.path.dirname(os.path.realpath(__file__)))
 
-    soup = BeautifulSoup(sculpt_file, "lxml")
-
-    # Get name of artists
-    artists = soup.findAll("a", {"target": "_self", "class": "artist-name ng-binding"})
-    artists = [artist.text[:artist.text.find('\xa0•')].strip() for artist in artists]
-
-    # Get name of title and link to the page for the sculpture
-    titles = soup.findAll("a", {"target": "_self", "class": "artwork-name ng-binding"})
-    sculpt_titles = [title.text.strip() for title in titles]
-    sculpt_links = [title['href'] for title in titles]
-
-    # Get image name
-    lis = soup.findAll("li", {"class": "ng-scope"})
-    images = [li.find("img")['ng-src'] for li in lis]
-
-    # Just take image name from hyperlink we just scraped (from last backslash)
-    images = [image[image.rfind("/") + 1:] for image in images]
-
-    return {'artists': artists, 'titles': sculpt_titles, "links":  sculpt_links, 'images': images}
+    # Read in chunks & only the artists, titles, links & images (name from last backslash) are kept
+    return wikiart_sculpture_list(sculpt_file)
 
 
 def get_data():
@@ -103,34 +78,38 @@ def get_data():
     # e.g. 0005, 0050, 0467, 2350...etc.
     file_num = 0
 
-    # Load data already processed
-    processed_sculptures = json.loads(open("../../../sculpture_data/wikiart/sculptures/wikiart_sculpture_data.json", 'r').read())['data']
-
-    # Get files already processed - can easily look if scraped
-    files_processed = [x['file'] for x in processed_sculptures]
+    # Data already processed - can easily look if scraped
+    state = CrawlState("../../../sculpture_data/wikiart/sculptures/wikiart_sculpture_data.jsonl")
 
     for index in range(len(sculptures_raw['images'])):
         file_name = "".join(["wikiart_", format(file_num, '04d'), ".jpg"])
 
         # If we already parsed and scraped - don't bother
-        if file_name not in files_processed:
+        if file_name not in state:
             print(file_name)
 
             # Parse and append
             style = parse_sculpture_page(sculptures_raw['links'][index], file_name, fake_user)
-            processed_sculptures.append({'Author': sculptures_raw['artists'][index],
-                                         "title": sculptures_raw['titles'][index],
-                                         'file': file_name,
-                                         'url': sculptures_raw['links'][index],
-                                         'Period': style})
-
-            # Dump over new json to file
-            with open("../../../sculpture_data/wikiart/sculptures/wikiart_sculpture_data.json", "w+") as file:
-                json.dump({"data": processed_sculptures}, file)
+            if style is not None:
+                state.add({'Author': sculptures_raw['artists'][index],
+                           "title": sculptures_raw['titles'][index],
+                           'file': file_name,
+                           'url': sculptures_raw['links'][index],
+                           'Period': style})
+        elif not if_image_exists(file_name, "wikiart"):
+            # Recorded but the image was never saved (e.g. killed before its download finished) -> Parse the page
+            # again (it's cached) for the image
+            print(file_name, "- image missing")
+            parse_sculpture_page(sculptures_raw['links'][index], file_name, fake_user)
 
         file_num += 1
 
-    df = pd.DataFrame(processed_sculptures).drop_duplicates(subset=['Author', 'title'])
+    # Images are downloaded in the background
+    wait_for_downloads()
+    state.close()
+
+    df = state.to_frame().drop_duplicates(subset=['Author', 'title'])
+    get_store().write_sculptures("wikiart", df)
     df.to_csv('../../../sculpture_data/wikiart/sculptures/wikiart_sculpture_periods.csv', sep=',')
 
 
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Same as running the scripts -> the shared modules & the models import each other by name. The old
+# BeautifulSoup parsers are in scrapers/benchmark_parsers.py.
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+for folder in [ROOT, os.path.join(ROOT, "models"), os.path.join(ROOT, "scrapers")]:
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
@@ -0,0 +1,64 @@
+"""
+build_model_data against a made up corpus in a temporary folder (the paths are relative -> run from tmp/work/models)
+"""
+import os
+import pandas as pd
+import pytest
+from PIL import Image
+import clean_data
+import image_ingest
+
+
+def save_image(path, size, color):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, color).save(path, "JPEG")
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def model_image(row):
+    with open(os.path.join(clean_data.MODEL_DATA_DIR, row['path']), "rb") as file:
+        return file.read()
+
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    work = tmp_path / "work" / "models"
+    work.mkdir(parents=True)
+    monkeypatch.chdir(work)
+    monkeypatch.setattr(clean_data, "USE_THUMBNAILS", True)
+    monkeypatch.setattr(clean_data, "get_data", lambda: pd.DataFrame({"file": ["wga_0001.jpg", "nga_0001.jpg"],
+                                                                       "Period": ["BAROQUE", "REALISM"]}))
+
+    full_size = {file: save_image(image_ingest.image_path(file, file[:file.find("_")]), (900, 700), color)
+                 for file, color in [("wga_0001.jpg", "red"), ("nga_0001.jpg", "blue")]}
+
+    return full_size, str(tmp_path / "manifest.csv")
+
+
+def test_thumbnail_replaces_full_size(corpus):
+    full_size, manifest_file = corpus
+
+    manifest = clean_data.build_model_data("copy", workers=2, manifest_file=manifest_file).set_index("file")
+    assert model_image(manifest.loc["wga_0001.jpg"]) == full_size["wga_0001.jpg"]
+
+    # Working copy shows up later (e.g. image_ingest.backfill)
+    thumbnail = save_image(image_ingest.thumbnail_path("wga_0001.jpg", "wga"), (300, 233), "red")
+
+    rebuilt = clean_data.build_model_data("copy", workers=2, manifest_file=manifest_file).set_index("file")
+    assert rebuilt.loc["wga_0001.jpg", "source"] == image_ingest.thumbnail_path("wga_0001.jpg", "wga")
+    assert model_image(rebuilt.loc["wga_0001.jpg"]) == thumbnail
+
+    # Split comes from the full size image -> doesn't move. The other image is left alone.
+    assert rebuilt.loc["wga_0001.jpg", "path"] == manifest.loc["wga_0001.jpg", "path"]
+    assert model_image(rebuilt.loc["nga_0001.jpg"]) == full_size["nga_0001.jpg"]
+
+
+def test_full_size_again_w_o_thumbnails(corpus, monkeypatch):
+    full_size, manifest_file = corpus
+    save_image(image_ingest.thumbnail_path("wga_0001.jpg", "wga"), (300, 233), "red")
+    clean_data.build_model_data("copy", workers=2, manifest_file=manifest_file)
+
+    monkeypatch.setattr(clean_data, "USE_THUMBNAILS", False)
+    rebuilt = clean_data.build_model_data("copy", workers=2, manifest_file=manifest_file).set_index("file")
+    assert model_image(rebuilt.loc["wga_0001.jpg"]) == full_size["wga_0001.jpg"]
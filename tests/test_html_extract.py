@@ -0,0 +1,76 @@
+"""
+html_extract.py has to give the same thing as the BeautifulSoup code the scrapers used before (kept in
+scrapers/benchmark_parsers.py) on saved pages that look like the real ones (same tags, attributes & encodings).
+"""
+import os
+import pandas as pd
+import pytest
+import html_extract
+from benchmark_parsers import (old_artist_page, old_nga_page, old_wga_sculpture_page, old_wikiart_sculpture_list,
+                               old_wikiart_sculpture_page)
+
+FIXTURES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fixtures")
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURES, name)
+
+
+def read_fixture(name):
+    with open(fixture_path(name), "rb") as file:
+        return file.read()
+
+
+def test_artist_rows():
+    page = read_fixture("wga_artists.html")
+
+    new = pd.DataFrame(html_extract.artist_rows(page))
+    pd.testing.assert_frame_equal(old_artist_page(page), new)
+
+    # Only the first matching table & the names are decoded from ISO-8859-1
+    assert len(new) == 8
+    assert new['Artist'].str.contains("è").any()
+
+
+def test_artist_rows_no_table():
+    with pytest.raises(IndexError):
+        html_extract.artist_rows(b"<html><body><table><tr><td>Nothing</td></tr></table></body></html>")
+
+
+def test_wga_sculpture_page():
+    content = read_fixture("wga_sculpture.html")
+
+    assert html_extract.wga_sculpture_page(content) == old_wga_sculpture_page(content)
+    assert html_extract.wga_sculpture_page(content) == ("GÓMEZ, Jérôme", "/art/g/gomez/557.jpg")
+
+
+def test_wikiart_sculpture_list():
+    path = fixture_path("wikiart_list.html")
+
+    new = html_extract.wikiart_sculpture_list(path)
+    assert new == old_wikiart_sculpture_list(path)
+    assert [len(new[key]) for key in ['artists', 'titles', 'links', 'images']] == [5] * 4
+
+
+def test_wikiart_sculpture_page():
+    content = read_fixture("wikiart_sculpture.html")
+
+    assert html_extract.wikiart_sculpture_page(content) == old_wikiart_sculpture_page(content)
+    assert html_extract.wikiart_sculpture_page(content) == ("Mannerism", "https://uploads.wikiart.org/images/6061.jpg")
+
+
+@pytest.mark.parametrize("decoded", [False, True])
+def test_nga_sculptures(decoded):
+    # What the browser hands back is a str
+    content = read_fixture("nga_listing.html")
+    if decoded:
+        content = content.decode("utf-8")
+
+    new = [html_extract.nga_sculpture(sculpt) for sculpt in html_extract.nga_sculptures(content)]
+    assert new == old_nga_page(content)
+    assert len(new) == 6
+
+
+def test_nga_sculptures_empty():
+    assert html_extract.nga_sculptures(b"") == []
+    assert html_extract.nga_sculptures(b"<html><body><ul class='returns'></ul></body></html>") == []
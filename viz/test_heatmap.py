@@ -5,6 +5,7 @@ Bulk of code found here - https://matplotlib.org/gallery/images_contours_and_fie
 import matplotlib.pyplot as plt
 from matplotlib import ticker
 import numpy as np
+import os
 from sklearn.metrics import confusion_matrix
 
 classes = ['BAROQUE', 'EARLY RENAISSANCE', 'HIGH RENAISSANCE', 'IMPRESSIONISM', 'MANNERISM', 'MEDIEVAL', 'MINIMALISM',
@@ -120,15 +121,19 @@ def annotate_heatmap(im, data=None, valfmt="{x:.2f}", textcolors=["black", "whit
     return texts
 
 
-# Get preds and true
-preds = np.loadtxt("test_preds.txt")
-y_test, y_pred = [], []
-for pred in preds:
-    y_pred.append(pred[0])
-    y_test.append(pred[1])
+# predict_test.py already computes the confusion matrix -> Only fall back to the preds if it's not there
+if os.path.isfile("test_confusion.txt"):
+    cnf_matrix = np.loadtxt("test_confusion.txt", dtype=int)
+else:
+    # Get preds and true
+    preds = np.loadtxt("test_preds.txt")
+    y_test, y_pred = [], []
+    for pred in preds:
+        y_pred.append(pred[0])
+        y_test.append(pred[1])
 
-# Compute confusion matrix
-cnf_matrix = confusion_matrix(y_test, y_pred)
+    # Compute confusion matrix
+    cnf_matrix = confusion_matrix(y_test, y_pred)
 np.set_printoptions(precision=2)
 
 fig, ax = plt.subplots()